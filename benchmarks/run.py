@@ -0,0 +1,307 @@
+"""
+Benchmark das etapas do pipeline sobre bases sintéticas (ver 'benchmarks/synthetic.py')
+
+Cada configuração da grade (trechos x anos de histórico) gera uma base nova em um diretório temporário e mede,
+separadamente, a leitura do manifesto, a carga dos arquivos do INMET, a geração do cubo climático (com '--cubo'),
+o itinerário e a consulta do histórico, o ajuste das distribuições, a simulação, o score fuzzy, os resultados e os
+gráficos. Os tempos de etapas aninhadas são exclusivos (o tempo do ajuste não entra no tempo do itinerário).
+
+Executar a partir da raiz do repositório:
+
+    python -m benchmarks.run --trechos 4 8 16 --anos 1 2 4 --salvar-referencia referencia.json
+    python -m benchmarks.run --trechos 4 8 16 --anos 1 2 4 --comparar referencia.json
+
+Com '--comparar', o código de saída é 1 se alguma etapa ficou mais lenta que a referência além da tolerância.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+import src.simulate
+from src.utils import logger
+from src.profiling import perfil, trecho
+from src.climate import write_cubo
+from src.integrate import Integrador
+from src.scenarios import get_armazem
+from src.storage import connect
+from src.simulate import Simulador
+from benchmarks.synthetic import create_base
+
+
+# etapas na ordem em que são executadas
+ETAPAS = ['manifesto', 'carga', 'cubo', 'itinerario', 'ajuste', 'simulacao', 'fuzzy', 'resultados', 'agregados',
+          'graficos']
+ETAPAS_STREAMING = ['manifesto', 'carga', 'cubo', 'itinerario', 'ajuste', 'streaming']
+
+# distribuição do atraso de todos os trechos com '--atrasos' (gama com média de 40 minutos, em minutos)
+ATRASO = ('gamma', '2,0,20')
+
+# variações abaixo deste tempo (segundos) são tratadas como ruído na comparação com a referência
+TEMPO_MINIMO_DE_REGRESSAO = 0.05
+
+# opções do pandas para as tabelas impressas
+EXIBICAO = ('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.3f}'.format)
+
+
+class Cronometragem:
+    def __init__(self):
+        """
+        Acumula o tempo de cada etapa. Quando uma etapa é chamada dentro de outra, o seu tempo é descontado da etapa
+        externa, de forma que a soma das etapas é o tempo total.
+        """
+        self.tempos = {}
+        self.pilha = []
+
+    def medir(self, etapa, func):
+        """
+        :param etapa: nome da etapa
+        :param func:  função medida
+        :return:      função que acumula o seu tempo em 'etapa' e devolve o resultado de 'func'
+        """
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.pilha.append(0.0)
+            inicio = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                total = time.perf_counter() - inicio
+                internas = self.pilha.pop()
+                self.tempos[etapa] = self.tempos.get(etapa, 0.0) + total - internas
+                if self.pilha:
+                    self.pilha[-1] += total
+
+        return wrapper
+
+
+def run_configuracao(trechos, anos, opcoes, caminho):
+    """
+    Executa todas as etapas do pipeline para uma rota sintética
+
+    :param trechos: quantidade de trechos da rota
+    :param anos:    anos de histórico
+    :param opcoes:  argumentos da linha de comando
+    :param caminho: diretório temporário da base e dos arquivos
+    :return:        tempo exclusivo de cada etapa (segundos)
+    """
+    cronometragem = Cronometragem()
+
+    cnx = connect(os.path.join(caminho, 'benchmark.sqlite'))
+    integrador = Integrador(cnx, workers=opcoes.workers)
+    integrador.data_path = os.path.join(caminho, 'data')
+    create_base(cnx, integrador.data_path, trechos=trechos, anos=anos, seed=opcoes.seed)
+    if opcoes.atrasos:
+        cnx.execute("update transit_time set atraso_dist = ?, atraso_params = ?", ATRASO)
+        cnx.commit()
+
+    cronometragem.medir('manifesto', integrador.read_estacoes_inmet)()
+    cronometragem.medir('carga', integrador.read_historical_data)()
+
+    caminho_cubo = os.path.join(caminho, 'cubo') if opcoes.cubo else None
+    if caminho_cubo is not None:
+        cronometragem.medir('cubo', write_cubo)(cnx, caminho_cubo)
+
+    # nenhuma rota é simulada na construção: as etapas são chamadas uma a uma, como no laço de 'Simulador'
+    simulador = Simulador(cnx, cache=opcoes.cache, metodo_de_ajuste=opcoes.metodo, armazem=opcoes.armazem,
+                          streaming=opcoes.streaming, amostragem=opcoes.amostragem, rotas=[], graficos='arquivo',
+                          caminho_graficos=os.path.join(caminho, 'graficos'), caminho_cubo=caminho_cubo,
+                          atrasos=opcoes.atrasos)
+    simulador.rota_id = 1
+    simulador.armazem = get_armazem(opcoes.armazem, cnx, os.path.join(caminho, 'cenarios'), simulador.escrita)
+    simulador.workers = opcoes.workers
+    if opcoes.workers > 1:
+        simulador.executor = src.simulate.ProcessPoolExecutor(max_workers=opcoes.workers)
+
+    for metodo, etapa in [('get_distribuicoes', 'ajuste'), ('write_resultados', 'resultados')]:
+        setattr(simulador, metodo, cronometragem.medir(etapa, getattr(simulador, metodo)))
+
+    # funções de módulo chamadas por 'get_results' (substituídas apenas durante a medição)
+    originais = {nome: getattr(src.simulate, nome) for nome in ['get_fuzzy_results', 'get_agregados']}
+    src.simulate.get_fuzzy_results = cronometragem.medir('fuzzy', originais['get_fuzzy_results'])
+    src.simulate.get_agregados = cronometragem.medir('agregados', originais['get_agregados'])
+
+    try:
+        cronometragem.medir('itinerario', simulador.get_clima_por_hora)()
+
+        if opcoes.streaming:
+            cronometragem.medir('streaming', simulador.simulate_streaming)()
+        else:
+            cronometragem.medir('simulacao', simulador.simulate_por_hora)()
+            cronometragem.medir('resultados', simulador.get_results)()
+            cronometragem.medir('graficos', src.simulate.render_graficos)(simulador.agregados,
+                                                                          simulador.caminho_graficos,
+                                                                          simulador.executor)
+    finally:
+        for nome, func in originais.items():
+            setattr(src.simulate, nome, func)
+
+        if simulador.executor is not None:
+            simulador.executor.shutdown()
+
+        cnx.close()
+
+    return cronometragem.tempos
+
+
+def run_benchmark(opcoes):
+    """
+    :param opcoes: argumentos da linha de comando
+    :return:       mediana das repetições do tempo de cada (trechos, anos, etapa)
+    """
+    medicoes = []
+
+    for trechos in opcoes.trechos:
+        for anos in opcoes.anos:
+            for repeticao in range(opcoes.repeticoes):
+                with tempfile.TemporaryDirectory(prefix='benchmark_') as caminho:
+                    inicio = time.perf_counter()
+                    with trecho('configuracao', trechos=trechos, anos=anos, repeticao=repeticao + 1):
+                        tempos = run_configuracao(trechos, anos, opcoes, caminho)
+
+                print(f"trechos={trechos} anos={anos} repeticao={repeticao + 1}: "
+                      f"{time.perf_counter() - inicio:.2f} segundos", file=sys.stderr)
+
+                medicoes += [(trechos, anos, etapa, segundos) for etapa, segundos in tempos.items()]
+
+    medicoes = pd.DataFrame(medicoes, columns=['trechos', 'anos', 'etapa', 'segundos'])
+
+    return medicoes.groupby(['trechos', 'anos', 'etapa'], sort=False)['segundos'].median().reset_index()
+
+
+def get_expoentes(tempos, variavel):
+    """
+    Curva de escala de cada etapa: expoente 'b' de tempo ~ variavel^b (regressão em escala log-log), mantidas as
+    demais dimensões da grade fixas no seu maior valor
+
+    :param tempos:   tempos medidos por 'run_benchmark'
+    :param variavel: dimensão da grade ('trechos' ou 'anos')
+    :return:         expoente de cada etapa (vazio se a grade tem um único valor da dimensão)
+    """
+    fixa = 'anos' if variavel == 'trechos' else 'trechos'
+    curva = tempos[(tempos[fixa] == tempos[fixa].max()) & (tempos['segundos'] > 0)]
+
+    expoentes = {}
+    for etapa, pontos in curva.groupby('etapa', sort=False):
+        if pontos[variavel].nunique() > 1:
+            expoentes[etapa] = np.polyfit(np.log(pontos[variavel]), np.log(pontos['segundos']), 1)[0]
+
+    return pd.Series(expoentes, name=f'expoente_{variavel}', dtype=float)
+
+
+def get_chave(trechos, anos, etapa):
+    return f'trechos={trechos}|anos={anos}|{etapa}'
+
+
+def write_referencia(tempos, arquivo, opcoes):
+    referencia = {'configuracao': {'metodo': opcoes.metodo, 'armazem': opcoes.armazem, 'cache': opcoes.cache,
+                                   'workers': opcoes.workers, 'streaming': opcoes.streaming,
+                                   'amostragem': opcoes.amostragem, 'seed': opcoes.seed,
+                                   'atrasos': opcoes.atrasos},
+                  'tempos': {get_chave(*linha[:3]): linha[3] for linha in tempos.itertuples(index=False)}}
+
+    with open(arquivo, 'w') as file:
+        json.dump(referencia, file, indent=2)
+
+
+def compare_referencia(tempos, arquivo, tolerancia):
+    """
+    :param tempos:     tempos medidos por 'run_benchmark'
+    :param arquivo:    referência gravada por 'write_referencia'
+    :param tolerancia: aumento relativo aceito em relação à referência
+    :return:           comparação de cada etapa presente na referência e se houve regressão
+    """
+    with open(arquivo) as file:
+        referencia = json.load(file)['tempos']
+
+    comparacao = tempos.assign(referencia=[referencia.get(get_chave(*linha[:3]))
+                                           for linha in tempos.itertuples(index=False)]).dropna(subset=['referencia'])
+    comparacao['variacao'] = comparacao['segundos'] / comparacao['referencia'] - 1
+    comparacao['regressao'] = ((comparacao['variacao'] > tolerancia)
+                               & (comparacao['segundos'] - comparacao['referencia'] > TEMPO_MINIMO_DE_REGRESSAO))
+
+    return comparacao
+
+
+def get_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das etapas do pipeline sobre bases sintéticas")
+    parser.add_argument('--trechos', type=int, nargs='+', default=[4, 8], help="tamanhos de rota (trechos)")
+    parser.add_argument('--anos', type=int, nargs='+', default=[1, 2], help="anos de histórico")
+    parser.add_argument('--repeticoes', type=int, default=3, help="repetições de cada configuração (mediana)")
+    parser.add_argument('--workers', type=int, default=1, help="processos da carga e do ajuste")
+    parser.add_argument('--metodo', default='nativo', help="método de ajuste das distribuições")
+    parser.add_argument('--armazem', default='numpy', help="armazenamento dos cenários")
+    parser.add_argument('--amostragem', default='aleatoria', help="estratégia de amostragem")
+    parser.add_argument('--streaming', action='store_true', help="simulação e score em lotes")
+    parser.add_argument('--cache', action='store_true', help="usa o cache de distribuições (desligado: mede o "
+                                                             "ajuste completo)")
+    parser.add_argument('--cubo', action='store_true', help="lê o histórico do cubo climático em vez da tabela")
+    parser.add_argument('--atrasos', action='store_true', help="sorteia o atraso de cada trecho ('ATRASO')")
+    parser.add_argument('--seed', type=int, default=0, help="semente dos dados sintéticos")
+    parser.add_argument('--saida', help="grava os tempos medidos em CSV")
+    parser.add_argument('--salvar-referencia', help="grava os tempos medidos como referência (JSON)")
+    parser.add_argument('--comparar', help="compara os tempos medidos com uma referência (JSON)")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="aumento relativo aceito na comparação")
+    parser.add_argument('--perfil', help="grava o perfil de trechos e contadores da execução (.json ou .csv)")
+    parser.add_argument('--memoria', action='store_true', help="inclui o pico de memória no perfil")
+    parser.add_argument('--verbose', action='store_true', help="mantém o log do pipeline")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    opcoes = get_argumentos(argv)
+
+    if not opcoes.verbose:
+        logger.setLevel(logging.WARNING)
+
+    if opcoes.perfil:
+        perfil.enable(memoria=opcoes.memoria)
+
+    tempos = run_benchmark(opcoes)
+
+    if opcoes.perfil:
+        perfil.write(opcoes.perfil)
+
+    etapas = ETAPAS_STREAMING if opcoes.streaming else ETAPAS
+    tabela = tempos.pivot_table(index=['trechos', 'anos'], columns='etapa', values='segundos')
+    tabela = tabela[[etapa for etapa in etapas if etapa in tabela.columns]]
+    tabela['total'] = tabela.sum(axis=1)
+
+    with pd.option_context(*EXIBICAO):
+        print(tabela)
+
+        escala = pd.concat([get_expoentes(tempos, 'trechos'), get_expoentes(tempos, 'anos')], axis=1)
+        if not escala.empty:
+            print()
+            print(escala.reindex([etapa for etapa in etapas if etapa in escala.index]))
+
+    if opcoes.saida:
+        tempos.to_csv(opcoes.saida, index=False)
+
+    if opcoes.salvar_referencia:
+        write_referencia(tempos, opcoes.salvar_referencia, opcoes)
+
+    if opcoes.comparar:
+        comparacao = compare_referencia(tempos, opcoes.comparar, opcoes.tolerancia)
+
+        with pd.option_context(*EXIBICAO):
+            print()
+            print(comparacao.to_string(index=False))
+
+        if comparacao['regressao'].any():
+            print(f"\n{comparacao['regressao'].sum()} etapa(s) mais lenta(s) que a referência", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# cabeçalho das colunas dos arquivos anuais de estações automáticas do INMET (a partir de 2019)
+COLUNAS_INMET = ['Data', 'Hora UTC', 'PRECIPITAÇÃO TOTAL, HORÁRIO (mm)',
+                 'PRESSAO ATMOSFERICA AO NIVEL DA ESTACAO, HORARIA (mB)',
+                 'PRESSÃO ATMOSFERICA MAX.NA HORA ANT. (AUT) (mB)', 'PRESSÃO ATMOSFERICA MIN. NA HORA ANT. (AUT) (mB)',
+                 'RADIACAO GLOBAL (Kj/m²)', 'TEMPERATURA DO AR - BULBO SECO, HORARIA (°C)',
+                 'TEMPERATURA DO PONTO DE ORVALHO (°C)', 'TEMPERATURA MÁXIMA NA HORA ANT. (AUT) (°C)',
+                 'TEMPERATURA MÍNIMA NA HORA ANT. (AUT) (°C)', 'TEMPERATURA ORVALHO MAX. NA HORA ANT. (AUT) (°C)',
+                 'TEMPERATURA ORVALHO MIN. NA HORA ANT. (AUT) (°C)', 'UMIDADE REL. MAX. NA HORA ANT. (AUT) (%)',
+                 'UMIDADE REL. MIN. NA HORA ANT. (AUT) (%)', 'UMIDADE RELATIVA DO AR, HORARIA (%)',
+                 'VENTO, DIREÇÃO HORARIA (gr) (° (gr))', 'VENTO, RAJADA MAXIMA (m/s)',
+                 'VENTO, VELOCIDADE HORARIA (m/s)']
+
+# valor utilizado pelo INMET para medições ausentes
+NULO = -9999
+
+# data de início das rotas sintéticas (os dados históricos são gerados para os anos anteriores)
+INICIO_DAS_ROTAS = '2023-07-15'
+
+
+def get_clima_sintetico(ano, rng, latitude=-22.0):
+    """
+    Série horária (UTC) com ciclos anual e diário de temperatura e umidade inversamente relacionada à temperatura
+
+    :param ano:      ano da série
+    :param rng:      gerador de números aleatórios
+    :param latitude: latitude da estação (estações mais ao sul têm invernos mais frios)
+    :return:         série horária com as medidas utilizadas pela simulação
+    """
+    horarios = pd.date_range(f'{ano}-01-01 00:00', f'{ano}-12-31 23:00', freq='h')
+    dia, hora_local = horarios.dayofyear.values, (horarios.hour.values - 3) % 24
+
+    # ruído autocorrelacionado (AR(1)) para que horas consecutivas tenham condições parecidas
+    ruido = np.empty(len(horarios))
+    ruido[0] = rng.normal()
+    choques = rng.normal(scale=np.sqrt(1 - 0.9 ** 2), size=len(horarios))
+    for hora in range(1, len(horarios)):
+        ruido[hora] = 0.9 * ruido[hora - 1] + choques[hora]
+
+    temperatura = (24 + latitude / 10 + 4 * np.cos(2 * np.pi * (dia - 15) / 365)
+                   + 5 * np.cos(2 * np.pi * (hora_local - 15) / 24) + 2 * ruido)
+    umidade = np.clip(70 - 2.5 * (temperatura - 22) + 8 * rng.normal(size=len(horarios)), 8, 100)
+
+    return pd.DataFrame({'horario': horarios, 'temperatura': temperatura, 'umidade': umidade,
+                         't_max': temperatura + np.abs(rng.normal(0.5, 0.3, len(horarios))),
+                         't_min': temperatura - np.abs(rng.normal(0.5, 0.3, len(horarios))),
+                         'u_max': np.clip(umidade + np.abs(rng.normal(3, 1, len(horarios))), 0, 100),
+                         'u_min': np.clip(umidade - np.abs(rng.normal(3, 1, len(horarios))), 0, 100)})
+
+
+def write_arquivo_inmet(caminho_dos_dados, estacao, ano, rng, ausentes=0.02):
+    """
+    Grava um arquivo anual de estação automática no formato do INMET: 8 linhas de metadados, cabeçalho, separador
+    ';', vírgula decimal, -9999 para medições ausentes e codificação windows-1252, em
+    'caminho_dos_dados/<ano>/INMET_<região>_<UF>_<código>_<localidade>_01-01-<ano>_A_31-12-<ano>.CSV'
+
+    :param caminho_dos_dados: diretório dos arquivos do INMET
+    :param estacao:           dicionário com 'estacao_id', 'localidade', 'regiao', 'estado' e 'latitude'
+    :param ano:               ano do arquivo
+    :param rng:               gerador de números aleatórios
+    :param ausentes:          fração de horas sem medição
+    :return:                  caminho do arquivo gravado
+    """
+    clima = get_clima_sintetico(ano, rng, estacao['latitude'])
+
+    def decimal(valores, casas=1):
+        return np.char.replace(np.char.mod(f'%.{casas}f', valores), '.', ',')
+
+    colunas = {coluna: np.full(len(clima), '') for coluna in COLUNAS_INMET}
+    colunas['Data'] = clima['horario'].dt.strftime('%Y/%m/%d').values
+    colunas['Hora UTC'] = clima['horario'].dt.strftime('%H00 UTC').values
+    colunas[COLUNAS_INMET[2]] = decimal(np.where(rng.random(len(clima)) < 0.1, rng.exponential(2, len(clima)), 0))
+    colunas[COLUNAS_INMET[3]] = decimal(rng.normal(930, 3, len(clima)))
+    colunas[COLUNAS_INMET[7]] = decimal(clima['temperatura'])
+    colunas[COLUNAS_INMET[8]] = decimal(clima['temperatura'] - (100 - clima['umidade']) / 5)
+    colunas[COLUNAS_INMET[9]] = decimal(clima['t_max'])
+    colunas[COLUNAS_INMET[10]] = decimal(clima['t_min'])
+    colunas[COLUNAS_INMET[13]] = np.round(clima['u_max']).astype(int).astype(str)
+    colunas[COLUNAS_INMET[14]] = np.round(clima['u_min']).astype(int).astype(str)
+    colunas[COLUNAS_INMET[15]] = np.round(clima['umidade']).astype(int).astype(str)
+    colunas[COLUNAS_INMET[18]] = decimal(rng.gamma(2, 1, len(clima)))
+
+    linhas = pd.DataFrame(colunas)
+
+    # horas sem medição: todas as medidas com o valor nulo do INMET
+    sem_medicao = rng.random(len(linhas)) < ausentes
+    linhas.loc[sem_medicao, COLUNAS_INMET[2:]] = str(NULO)
+
+    nome = (f"INMET_{estacao['regiao']}_{estacao['estado']}_{estacao['estacao_id']}_{estacao['localidade']}_"
+            f"01-01-{ano}_A_31-12-{ano}.CSV")
+    caminho = os.path.join(caminho_dos_dados, str(ano), nome)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+
+    metadados = [f"REGIÃO:;{estacao['regiao']}", f"UF:;{estacao['estado']}", f"ESTAÇÃO:;{estacao['localidade']}",
+                 f"CODIGO (WMO):;{estacao['estacao_id']}", f"LATITUDE:;{estacao['latitude']:.8f}".replace('.', ','),
+                 "LONGITUDE:;-47,00000000", "ALTITUDE:;800", "DATA DE FUNDAÇÃO:;01/01/00"]
+
+    with open(caminho, 'w', encoding='windows-1252', newline='') as arquivo:
+        arquivo.write('\r\n'.join(metadados) + '\r\n')
+        arquivo.write(';'.join(COLUNAS_INMET) + ';\r\n')
+        arquivo.writelines(';'.join(linha) + ';\r\n' for linha in linhas.itertuples(index=False, name=None))
+
+    return caminho
+
+
+def get_estacoes(quantidade, rng):
+    """
+    :param quantidade: quantidade de estações
+    :param rng:        gerador de números aleatórios
+    :return:           estações sintéticas (uma por cidade das rotas)
+    """
+    return [{'estacao_id': f'S{numero:03d}', 'localidade': f'CIDADE {numero}', 'regiao': 'SE', 'estado': 'SP',
+             'latitude': rng.uniform(-30, -10)} for numero in range(1, quantidade + 1)]
+
+
+def create_base(cnx, caminho_dos_dados, trechos=6, anos=2, rotas=1, seed=0):
+    """
+    Cria uma base sintética completa: arquivos do INMET de cada estação para os anos de histórico e os cadastros de
+    'cidades', 'rotas' e 'transit_time'. Todas as rotas percorrem a mesma sequência de cidades, com tempos de
+    trânsito diferentes, e iniciam em 'INICIO_DAS_ROTAS'.
+
+    As tabelas devem ter sido criadas antes (por exemplo, pelo 'Integrador').
+
+    :param cnx:               conexão com o banco de dados local
+    :param caminho_dos_dados: diretório dos arquivos do INMET
+    :param trechos:           quantidade de trechos de cada rota (tamanho da rota)
+    :param anos:              anos de histórico anteriores ao início das rotas (profundidade do histórico)
+    :param rotas:             quantidade de rotas ativas
+    :param seed:              semente dos dados gerados
+    :return:                  caminhos dos arquivos gravados
+    """
+    rng = np.random.default_rng(seed)
+    estacoes = get_estacoes(trechos + 1, rng)
+
+    ultimo_ano = int(INICIO_DAS_ROTAS[:4]) - 1
+    arquivos = [write_arquivo_inmet(caminho_dos_dados, estacao, ano, rng)
+                for ano in range(ultimo_ano - anos + 1, ultimo_ano + 1) for estacao in estacoes]
+
+    cnx.executemany("insert into cidades (cidade_id, cidade, estado, estacao_id, estacao_aproximada, latitude, "
+                    "longitude) values (?, ?, ?, ?, 0, ?, -47.0)",
+                    [(cidade_id, estacao['localidade'], estacao['estado'], estacao['estacao_id'], estacao['latitude'])
+                     for cidade_id, estacao in enumerate(estacoes, start=1)])
+
+    for rota_id in range(1, rotas + 1):
+        cnx.execute("insert into rotas (rota_id, origem, destino, inicio, ativo) values (?, 1, ?, ?, 1)",
+                    (rota_id, len(estacoes), INICIO_DAS_ROTAS))
+        cnx.executemany("insert into transit_time (rota_id, origem, destino, transit_time) values (?, ?, ?, ?)",
+                        [(rota_id, cidade, cidade + 1, int(rng.integers(60, 400))) for cidade in range(1, trechos + 1)])
+
+    cnx.commit()
+
+    return arquivos
@@ -0,0 +1,13 @@
+/*ndices*/
+
+CREATE INDEX IF NOT EXISTS idx_dados_metereologicos_calendario ON dados_metereologicos (
+    estacao_id,
+    dia_do_ano,
+    hora,
+    temperatura,
+    t_max,
+    t_min,
+    umidade,
+    u_max,
+    u_min
+);
@@ -40,7 +40,9 @@ CREATE TABLE IF NOT EXISTS transit_time (
                          NOT NULL,
     destino      INTEGER REFERENCES cidades (cidade_id)
                          NOT NULL,
-    transit_time INTEGER,
+    transit_time  INTEGER,
+    atraso_dist   VARCHAR (20),
+    atraso_params VARCHAR (50),
     PRIMARY KEY (
         rota_id,
         origem,
@@ -70,12 +72,26 @@ CREATE TABLE IF NOT EXISTS dados_metereologicos (
     umidade     NUMERIC,
     u_max       NUMERIC,
     u_min       NUMERIC,
+    dia_do_ano  INTEGER,
+    hora        INTEGER,
     PRIMARY KEY (
         estacao_id,
         timestamp
     )
 );
 
+CREATE TABLE IF NOT EXISTS manifesto (
+    caminho    VARCHAR (200) NOT NULL
+                             PRIMARY KEY,
+    estacao_id VARCHAR (10)  NOT NULL
+                             REFERENCES estacoes (estacao_id),
+    ano        INTEGER       NOT NULL,
+    tamanho    INTEGER,
+    modificado NUMERIC,
+    hash       VARCHAR (40),
+    carregado  BOOLEAN       DEFAULT 0
+);
+
 /*Tabelas de Sada*/
 
 CREATE TABLE IF NOT EXISTS distribuicoes (
@@ -93,8 +109,6 @@ CREATE TABLE IF NOT EXISTS distribuicoes (
         rota_id,
         saida,
         cidade_id,
-        mes,
-        dia,
         hora,
         medida
     )
@@ -103,19 +117,88 @@ CREATE TABLE IF NOT EXISTS distribuicoes (
 CREATE TABLE IF NOT EXISTS simulacoes (
     rota_id     INTEGER  REFERENCES rotas (rota_id),
     saida       DATETIME NOT NULL,
+    hora        TIME,
     cidade_id   INTEGER  NOT NULL,
-    duracao,    INTEGER,
+    duracao     INTEGER,
     cenario     INTEGER,
     temperatura NUMERIC,
     umidade     NUMERIC
 );
 
 CREATE TABLE IF NOT EXISTS resultados (
-    rota_id INTEGER  REFERENCES rotas (rota_id),
-    saida   DATETIME,
-    score   NUMERIC,
+    rota_id        INTEGER  REFERENCES rotas (rota_id),
+    saida          DATETIME,
+    score          NUMERIC,
+    desvio_padrao  NUMERIC,
+    score_inferior NUMERIC,
+    score_superior NUMERIC,
+    p05            NUMERIC,
+    p50            NUMERIC,
+    p95            NUMERIC,
+    cenarios       INTEGER,
+    ranking        INTEGER,
+    PRIMARY KEY (
+        rota_id,
+        saida
+    )
+);
+
+CREATE TABLE IF NOT EXISTS eliminacoes (
+    rota_id        INTEGER  REFERENCES rotas (rota_id),
+    saida          DATETIME,
+    rodada         INTEGER,
+    cenarios       INTEGER,
+    score          NUMERIC,
+    score_superior NUMERIC,
+    saida_lider    DATETIME,
+    lider_inferior NUMERIC,
     PRIMARY KEY (
         rota_id,
         saida
     )
 );
+
+/*Tabelas de Cache*/
+
+CREATE TABLE IF NOT EXISTS cache_distribuicoes (
+    chave      VARCHAR (40) NOT NULL
+                            PRIMARY KEY,
+    dist_name  VARCHAR (20),
+    params     VARCHAR (50),
+    acessos    INTEGER      DEFAULT 0,
+    ultimo_uso DATETIME
+);
+
+CREATE TABLE IF NOT EXISTS dependencias (
+    rota_id    INTEGER      REFERENCES rotas (rota_id)
+                            NOT NULL,
+    saida      DATETIME     NOT NULL,
+    etapa      VARCHAR (20) NOT NULL,
+    impressao  VARCHAR (40) NOT NULL,
+    atualizado DATETIME,
+    PRIMARY KEY (
+        rota_id,
+        saida,
+        etapa
+    )
+);
+
+CREATE TABLE IF NOT EXISTS climatologia (
+    estacao_id     VARCHAR (10) NOT NULL,
+    dia_do_ano     INTEGER      NOT NULL,
+    hora           INTEGER      NOT NULL,
+    medida         VARCHAR (20) NOT NULL,
+    n              INTEGER      NOT NULL,
+    soma           NUMERIC,
+    soma_quadrados NUMERIC,
+    soma_cubos     NUMERIC,
+    minimo         NUMERIC,
+    maximo         NUMERIC,
+    histograma     BLOB,
+    PRIMARY KEY (
+        estacao_id,
+        dia_do_ano,
+        hora,
+        medida
+    )
+);
@@ -1,24 +1,289 @@
-import sqlite3
+import sys
+import argparse
 
-from src.utils import cronometro, logger
-from src.simulate import Simulador
-from src.integrate import Integrador
+from src.utils import logger
+from src.profiling import cronometro, perfil
+from src.storage import connect, get_pragmas
+
+
+CAMINHO_BANCO = 'data.sqlite'
+
+# perfil da execução (trechos e contadores, ver 'src/profiling.py'): arquivo '.json' ou '.csv', ou None para desligar
+CAMINHO_PERFIL = None
+PERFIL_DE_MEMORIA = False
+
+# Cada comando importa apenas o que usa: a carga e o relatório não dependem do scipy, do skfuzzy nem do matplotlib,
+# que juntos levam cerca de um segundo para serem importados. Uso:
+#
+#     python main.py ingest --workers 4
+#     python main.py fit --rotas 1 2 --data 2023-07-15
+#     python main.py simulate --rotas 1 --data 2023-07-01 --ate 2023-08-29 --intervalo 120
+#     python main.py simulate --rotas 1 --streaming --corrida
+#     python main.py simulate --rotas 1 --streaming --atrasos
+#     python main.py simulate --rotas 1 --streaming --superficie
+#     python main.py --seed 42 simulate --rotas 1 --streaming
+#     python main.py score --rotas 1 --graficos arquivo
+#     python main.py report --rotas 1 --top 3
+#     python main.py report --rotas 1 --grade --csv grade.csv
+#     python main.py serve --porta 8080 --workers 2
+#     curl 'http://127.0.0.1:8080/melhor-saida?rota=1&data=2023-07-15&top=3'
+#
+# Sem comando, executa a simulação completa de todas as rotas ativas, com os gráficos em janela.
+
+
+def get_semente(opcoes):
+    """
+    :param opcoes: argumentos da linha de comando
+    :return:       parâmetro 'seed' de 'Simulador', apenas quando informado (caso contrário, vale 'SEED')
+    """
+    return {} if opcoes.seed is None else {'seed': opcoes.seed}
+
+
+def run_ingest(cnx, opcoes):
+    from src.integrate import Integrador
+
+    Integrador(cnx, atualizar_base=True, workers=opcoes.workers, pragmas=get_pragmas(opcoes.pragma))
+
+
+def run_simulador(cnx, opcoes, etapas):
+    from src.integrate import Integrador
+    from src.simulate import Simulador
+
+    Integrador(cnx)
+
+    parametros = {'etapas': etapas, 'rotas': opcoes.rotas, 'data_de_saida': opcoes.data,
+                  'graficos': None if opcoes.graficos == 'nenhum' else opcoes.graficos,
+                  'incremental': not getattr(opcoes, 'recalcular', False), **get_semente(opcoes)}
+
+    # sem '--armazem', o padrão é o de quem executa: 'Simulador' (sqlite) ou 'Escalonador' (numpy, em paralelo)
+    if opcoes.armazem is not None:
+        parametros.update(armazem=opcoes.armazem)
+
+    if 'ajuste' in etapas:
+        parametros.update(metodo_de_ajuste=opcoes.metodo, cache=not opcoes.sem_cache, data_final=opcoes.ate,
+                          intervalo_de_saida=opcoes.intervalo, atrasos=opcoes.atrasos)
+
+    if 'simulacao' in etapas:
+        parametros.update(streaming=opcoes.streaming, persistir_cenarios=opcoes.persistir_cenarios,
+                          amostragem=opcoes.amostragem, erro_padrao_alvo=opcoes.erro_padrao, corrida=opcoes.corrida,
+                          atrasos=opcoes.atrasos)
+
+    if 'resultados' in etapas:
+        parametros.update(superficie=opcoes.superficie)
+
+    if getattr(opcoes, 'rotas_em_paralelo', 1) > 1:
+        from src.scheduler import Escalonador
+
+        escalonador = Escalonador(opcoes.banco, workers=opcoes.rotas_em_paralelo, pragmas=get_pragmas(opcoes.pragma),
+                                  **parametros)
+        logger.info(f"Relatório:\n{escalonador.relatorio.to_string(index=False)}")
+        return
+
+    simulador = Simulador(cnx, workers=opcoes.workers, **parametros)
+    logger.info(f"Relatório:\n{simulador.relatorio.to_string(index=False)}")
+
+
+def run_fit(cnx, opcoes):
+    run_simulador(cnx, opcoes, ['ajuste'])
+
+
+def run_simulate(cnx, opcoes):
+    run_simulador(cnx, opcoes, ['simulacao', 'resultados'] if opcoes.reutilizar_ajustes else
+                  ['ajuste', 'simulacao', 'resultados'])
+
+
+def run_score(cnx, opcoes):
+    run_simulador(cnx, opcoes, ['resultados'])
+
+
+def run_report(cnx, opcoes):
+    import pandas as pd
+
+    # banco ainda sem as tabelas (nenhuma carga ou simulação executada)
+    tabelas = {tabela for tabela, in cnx.execute("select name from sqlite_master where type = 'table'")}
+    if not {'resultados', 'rotas', 'cidades'} <= tabelas:
+        print("Nenhum resultado encontrado")
+        return
+
+    filtro = f"where r.rota_id in ({', '.join('?' * len(opcoes.rotas))}) " if opcoes.rotas else ""
+
+    resultados = pd.read_sql("select r.rota_id, origem.cidade as origem, destino.cidade as destino, r.ranking, "
+                             "       r.saida, r.score, r.score_inferior, r.score_superior, r.p05, r.p50, r.p95, "
+                             "       r.cenarios "
+                             "from resultados r "
+                             "inner join rotas using (rota_id) "
+                             "inner join cidades origem on (origem.cidade_id = rotas.origem) "
+                             "inner join cidades destino on (destino.cidade_id = rotas.destino) " + filtro +
+                             "order by r.rota_id, substr(r.saida, 1, 10), r.ranking", cnx, params=opcoes.rotas)
+
+    if opcoes.top is not None:
+        resultados = resultados[resultados['ranking'] <= opcoes.top]
+
+    # grade (dia x horário de saída) do score, para horizontes de vários dias
+    if opcoes.grade:
+        resultados = (resultados.assign(dia=resultados['saida'].str[:10], horario=resultados['saida'].str[11:16])
+                      .pivot_table(index=['rota_id', 'origem', 'destino', 'dia'], columns='horario', values='score')
+                      .reset_index())
+        resultados.columns.name = None
+
+    if opcoes.csv:
+        resultados.to_csv(opcoes.csv, index=False)
+        logger.info(f"{len(resultados)} resultados gravados em '{opcoes.csv}'")
+        return
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None,
+                           'display.float_format', '{:.2f}'.format):
+        print(resultados.to_string(index=False) if not resultados.empty else "Nenhum resultado encontrado")
+
+
+def run_serve(cnx, opcoes):
+    import asyncio
+    from src.integrate import Integrador
+    from src.service import Servico
+
+    Integrador(cnx)
+
+    servico = Servico(opcoes.banco, workers=opcoes.workers, metodo_de_ajuste=opcoes.metodo,
+                      intervalo_de_saida=opcoes.intervalo, amostragem=opcoes.amostragem,
+                      erro_padrao_alvo=opcoes.erro_padrao, corrida=opcoes.corrida, atrasos=opcoes.atrasos,
+                      pragmas=get_pragmas(opcoes.pragma), **get_semente(opcoes))
+
+    try:
+        asyncio.run(servico.serve(opcoes.host, opcoes.porta, opcoes.socket))
+    except KeyboardInterrupt:
+        logger.info("Serviço interrompido")
+    finally:
+        servico.close()
+
+
+def run_completo(cnx, opcoes):
+    from src.integrate import Integrador
+    from src.simulate import Simulador
+
+    Integrador(cnx, atualizar_base=False)
+    simulador = Simulador(cnx, **get_semente(opcoes))
+    logger.info(f"Relatório:\n{simulador.relatorio.to_string(index=False)}")
+
+
+def get_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Simulação das condições climáticas no transporte de sementes de "
+                                                 "soja")
+    parser.add_argument('--banco', default=CAMINHO_BANCO, help="banco de dados local")
+    parser.add_argument('--perfil', default=CAMINHO_PERFIL, help="grava o perfil da execução (.json ou .csv)")
+    parser.add_argument('--memoria', action='store_true', default=PERFIL_DE_MEMORIA,
+                        help="inclui o pico de memória no perfil")
+    parser.add_argument('--pragma', action='append', metavar='NOME=VALOR',
+                        help="PRAGMA da conexão, sobre os padrões de 'src/storage.py' (ex.: --pragma synchronous=FULL)")
+    parser.add_argument('--seed', type=int,
+                        help="semente dos cenários, para resultados reprodutíveis (padrão: 'SEED' de "
+                             "'src/monte_carlo.py')")
+    parser.set_defaults(comando=run_completo)
+
+    comandos = parser.add_subparsers(title='comandos')
+
+    # opções comuns aos comandos por rota
+    por_rota = argparse.ArgumentParser(add_help=False)
+    por_rota.add_argument('--rotas', type=int, nargs='+', help="identificadores das rotas (padrão: rotas ativas)")
+    por_rota.add_argument('--graficos', choices=['janela', 'arquivo', 'nenhum'], default='nenhum',
+                          help="gráficos de cada rota")
+    por_rota.add_argument('--armazem', choices=['sqlite', 'numpy', 'parquet'],
+                          help="armazenamento dos cenários (padrão: sqlite, ou numpy com --rotas-em-paralelo)")
+
+    ajuste = argparse.ArgumentParser(add_help=False)
+    ajuste.add_argument('--data', help="dia dos horários de saída, AAAA-MM-DD (padrão: início cadastrado na rota)")
+    ajuste.add_argument('--ate', help="último dia do horizonte de planejamento, AAAA-MM-DD (padrão: apenas '--data')")
+    ajuste.add_argument('--intervalo', type=int, default=60, help="minutos entre saídas consecutivas")
+    ajuste.add_argument('--workers', type=int, default=1, help="processos para o ajuste de distribuições")
+    ajuste.add_argument('--metodo', choices=['distfit', 'nativo', 'validacao', 'resumo'], default='distfit',
+                        help="método de ajuste das distribuições")
+    ajuste.add_argument('--sem-cache', action='store_true', help="não reaproveita distribuições já ajustadas")
+    ajuste.add_argument('--recalcular', action='store_true',
+                        help="recalcula todas as saídas, mesmo as que não mudaram desde a última execução")
+    ajuste.add_argument('--atrasos', action='store_true',
+                        help="sorteia por cenário o atraso dos trechos com distribuição cadastrada em 'transit_time'")
+
+    ingest = comandos.add_parser('ingest', help="carrega os arquivos novos ou alterados do INMET")
+    ingest.add_argument('--workers', type=int, default=1, help="processos para a leitura dos arquivos")
+    ingest.set_defaults(comando=run_ingest)
+
+    fit = comandos.add_parser('fit', parents=[por_rota, ajuste], help="ajusta as distribuições de cada rota")
+    fit.set_defaults(comando=run_fit)
+
+    simulate = comandos.add_parser('simulate', parents=[por_rota, ajuste],
+                                   help="simula os cenários e calcula os resultados de cada rota")
+    simulate.add_argument('--reutilizar-ajustes', action='store_true',
+                          help="simula com as distribuições já gravadas, sem ajustar novamente")
+    simulate.add_argument('--streaming', action='store_true', help="calcula o score lote a lote")
+    simulate.add_argument('--persistir-cenarios', action='store_true',
+                          help="no modo streaming, grava também os cenários")
+    simulate.add_argument('--amostragem', choices=['aleatoria', 'antitetica', 'hipercubo', 'sobol'],
+                          default='aleatoria', help="estratégia de amostragem")
+    simulate.add_argument('--erro-padrao', type=float, help="no modo streaming, erro padrão alvo do score")
+    simulate.add_argument('--corrida', action='store_true', help="no modo streaming, elimina as saídas piores")
+    simulate.add_argument('--superficie', action='store_true',
+                          help="interpola o score em uma superfície pré-calculada, em vez das regras fuzzy")
+    simulate.add_argument('--rotas-em-paralelo', type=int, default=1,
+                          help="rotas simuladas ao mesmo tempo, em processos separados")
+    simulate.set_defaults(comando=run_simulate)
+
+    score = comandos.add_parser('score', parents=[por_rota],
+                                help="calcula os resultados a partir dos cenários já armazenados")
+    score.add_argument('--superficie', action='store_true',
+                       help="interpola o score em uma superfície pré-calculada, em vez das regras fuzzy")
+    score.set_defaults(comando=run_score, data=None, workers=1)
+
+    report = comandos.add_parser('report', help="apresenta o ranking dos horários de saída")
+    report.add_argument('--rotas', type=int, nargs='+', help="identificadores das rotas (padrão: todas)")
+    report.add_argument('--top', type=int, help="apenas as N melhores saídas de cada rota e dia")
+    report.add_argument('--grade', action='store_true', help="score em grade (dia x horário de saída)")
+    report.add_argument('--csv', help="grava o ranking em CSV em vez de exibi-lo")
+    report.set_defaults(comando=run_report)
+
+    serve = comandos.add_parser('serve', help="serviço local que responde ao ranking das saídas de uma rota e dia")
+    serve.add_argument('--host', default='127.0.0.1', help="endereço do serviço")
+    serve.add_argument('--porta', type=int, default=8080, help="porta do serviço")
+    serve.add_argument('--socket', help="socket Unix, no lugar do endereço e da porta")
+    serve.add_argument('--workers', type=int, default=2, help="processos para as simulações")
+    serve.add_argument('--metodo', choices=['distfit', 'nativo', 'validacao', 'resumo'], default='distfit',
+                       help="método de ajuste das distribuições")
+    serve.add_argument('--intervalo', type=int, default=60, help="minutos entre saídas consecutivas")
+    serve.add_argument('--amostragem', choices=['aleatoria', 'antitetica', 'hipercubo', 'sobol'],
+                       default='aleatoria', help="estratégia de amostragem")
+    serve.add_argument('--erro-padrao', type=float, help="erro padrão alvo do score")
+    serve.add_argument('--corrida', action='store_true', help="elimina as saídas piores")
+    serve.add_argument('--atrasos', action='store_true', help="sorteia por cenário o atraso dos trechos")
+    serve.set_defaults(comando=run_serve)
+
+    return parser.parse_args(argv)
 
 
 @cronometro
-def main():
+def main(opcoes):
     logger.info('Iniciando!')
-    cnx = sqlite3.connect('data.sqlite')
+    cnx = connect(opcoes.banco, get_pragmas(opcoes.pragma))
 
-    Integrador(cnx, atualizar_base=False)
-    Simulador(cnx)
+    try:
+        opcoes.comando(cnx, opcoes)
+    finally:
+        if perfil.ativo:
+            tempos = cnx.get_tempos().head(10).to_string(index=False, max_colwidth=100)
+            logger.info(f"Comandos SQL mais demorados:\n{tempos}")
+        cnx.close()
 
-    cnx.close()
     logger.info('Fim!')
 
 
 if __name__ == "__main__":
+    opcoes = get_argumentos()
+
+    if opcoes.perfil is not None:
+        perfil.enable(memoria=opcoes.memoria)
+
     try:
-        main()
+        main(opcoes)
     except Exception as Erro:  # noqa
         logger.info("Erro:" + str(Erro))
+        sys.exit(1)
+    finally:
+        if opcoes.perfil is not None:
+            perfil.write(opcoes.perfil)
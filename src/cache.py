@@ -0,0 +1,83 @@
+import hashlib
+
+import numpy as np
+
+from src.utils import logger
+from src.storage import Escrita
+from src.climatology import Resumo
+
+
+# quantidade máxima de ajustes mantidos em cache (os menos utilizados recentemente são descartados)
+CAPACIDADE = 100_000
+
+
+class CacheDeDistribuicoes:
+    def __init__(self, cnx, capacidade=CAPACIDADE, escrita=None):
+        """
+        Cache persistente de distribuições ajustadas, endereçado pelo conteúdo da amostra
+
+        Horários de saída consecutivos passam pelas mesmas cidades nas mesmas horas, de forma que a mesma amostra
+        histórica é ajustada diversas vezes em uma rota (e novamente a cada execução). A chave do cache é um hash
+        dos valores da amostra e da configuração do ajuste, então qualquer alteração nos dados gera uma nova chave.
+
+        :param cnx:        conexão com o banco de dados local
+        :param capacidade: quantidade máxima de ajustes armazenados
+        :param escrita:    destino das escritas (por padrão, a própria conexão)
+        """
+        self.cnx = cnx
+        self.escrita = escrita if escrita is not None else Escrita(cnx)
+        self.capacidade = capacidade
+
+        self.acertos = 0
+        self.falhas = 0
+
+    @staticmethod
+    def get_chave(data, *configuracao):
+        """
+        Calcula a chave de uma amostra: os valores são ordenados, pois o ajuste não depende da ordem das observações
+
+        :param data:         conjunto de dados a ser ajustado (ou resumo das observações, no método 'resumo')
+        :param configuracao: parâmetros do ajuste (distribuições candidatas, método etc.)
+        :return:             hash hexadecimal da amostra e da configuração
+        """
+        if isinstance(data, Resumo):
+            chave = hashlib.sha1(data.tobytes())
+        else:
+            chave = hashlib.sha1(np.sort(np.asarray(data, dtype=np.float64)).tobytes())
+        chave.update(repr(configuracao).encode())
+
+        return chave.hexdigest()
+
+    def get(self, chave):
+        """
+        :param chave: chave da amostra
+        :return:      distribuição e parâmetros armazenados, ou None caso a amostra ainda não tenha sido ajustada
+        """
+        resultado = self.cnx.execute("select dist_name, params from cache_distribuicoes where chave = ?",
+                                     (chave,)).fetchone()
+
+        if resultado is None:
+            self.falhas += 1
+            return None
+
+        self.acertos += 1
+        self.escrita.execute("update cache_distribuicoes set acessos = acessos + 1, ultimo_uso = datetime('now') "
+                             "where chave = ?", (chave,))
+
+        return resultado
+
+    def set(self, chave, dist_name, params):
+        self.escrita.execute("insert or replace into cache_distribuicoes "
+                             "(chave, dist_name, params, acessos, ultimo_uso) values (?, ?, ?, 0, datetime('now'))",
+                             (chave, dist_name, params))
+
+    def evict(self):
+        """
+        Limita o tamanho do cache, descartando os ajustes utilizados há mais tempo
+        """
+        self.escrita.execute("delete from cache_distribuicoes where chave in "
+                             "(select chave from cache_distribuicoes order by ultimo_uso desc, acessos desc "
+                             " limit -1 offset ?)", (self.capacidade,))
+        self.escrita.commit()
+
+        logger.info(f"Cache de distribuições: {self.acertos} acertos, {self.falhas} falhas")
@@ -0,0 +1,211 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.utils import logger
+from src.dependencies import get_impressao
+from src.storage import get_caminho_junto_ao_banco
+
+
+# diretório do cubo climático, relativo ao diretório do banco de dados: 'indice.json' (estações, anos, medidas e
+# versão) e os dados em float32 da versão do índice, em 'dados_<versao>.npy'
+CAMINHO_CUBO = 'cubo'
+
+MEDIDAS = ['temperatura', 't_max', 't_min', 'umidade', 'u_max', 'u_min']
+
+# eixo de dias do cubo no calendário de um ano bissexto (366 posições): 29/02 tem a sua própria posição, vazia nos
+# demais anos, mas é consultado como o dia 59 do calendário fixo de 'get_dia_do_ano', como na tabela
+DIAS = 366
+HORAS = 24
+DIA_BISSEXTO = 60
+
+# os valores voltam do float32 arredondados, com os mesmos float64 da tabela (o INMET publica até uma casa decimal):
+# as impressões de 'src/dependencies.py' e as chaves do cache de distribuições não dependem da origem dos dados
+CASAS_DECIMAIS = 4
+
+
+class CuboClimatico:
+    def __init__(self, caminho=CAMINHO_CUBO):
+        """
+        Cubo denso (estação, ano, dia, hora, medida) em float32 dos dados de 'dados_metereologicos', com NaN para
+        as horas sem registro, mapeado em memória a partir de um arquivo '.npy'
+
+        A janela de uma rota é uma fatia do cubo (uma visão, sem cópia), e os processos que abrem o mesmo arquivo
+        compartilham as páginas em memória. Gerado por 'write_cubo' após a carga dos arquivos do INMET. Os dados são
+        sempre os da versão do índice, já que o nome do arquivo de dados contém a versão.
+
+        :param caminho: diretório do cubo
+        """
+        with open(os.path.join(caminho, 'indice.json')) as file:
+            indice = json.load(file)
+
+        self.versao = indice['versao']
+        self.anos = np.array(indice['anos'])
+        self.posicao_da_estacao = {estacao_id: posicao for posicao, estacao_id in enumerate(indice['estacoes'])}
+        self.dados = np.load(os.path.join(caminho, get_arquivo_de_dados(self.versao)), mmap_mode='r')
+
+    def get_janela(self, estacao_id, dia_inicial, dia_final):
+        """
+        :param estacao_id:  código da estação
+        :param dia_inicial: primeiro dia do ano da janela (calendário fixo de 365 dias)
+        :param dia_final:   último dia do ano da janela (janelas que viram o ano são divididas em duas faixas)
+        :return:            lista de (dias do ano no calendário fixo, fatia (anos x dias x horas x medidas))
+        """
+        posicao = self.posicao_da_estacao.get(estacao_id)
+        if posicao is None:
+            return []
+
+        if dia_inicial <= dia_final:
+            faixas = [(dia_inicial, dia_final)]
+        else:
+            faixas = [(dia_inicial, 365), (1, dia_final)]
+
+        janelas = []
+        for inicio, fim in faixas:
+            primeira, ultima = get_posicao_do_dia(inicio), get_posicao_do_dia(fim)
+
+            # o dia 59 também cobre 29/02, que fica na posição seguinte
+            if fim == DIA_BISSEXTO - 1:
+                ultima += 1
+
+            dias = np.arange(primeira, ultima + 1)
+            janelas += [(dias + 1 - (dias >= DIA_BISSEXTO - 1), self.dados[posicao, :, primeira:ultima + 1])]
+
+        return janelas
+
+    def read(self, estacoes_por_cidade, dia_inicial, dia_final):
+        """
+        Mesmo formato da consulta de 'Simulador.get_dados_metereologicos': uma linha por cidade, ano, dia e hora
+        com ao menos uma medida registrada
+
+        :param estacoes_por_cidade: estação de cada cidade
+        :param dia_inicial:         primeiro dia do ano da janela
+        :param dia_final:           último dia do ano da janela
+        :return:                    dados meteorológicos com as colunas 'cidade_id', 'dia_do_ano' e 'hora'
+        """
+        partes = []
+
+        for cidade_id, estacao_id in estacoes_por_cidade.items():
+            for dias, janela in self.get_janela(estacao_id, dia_inicial, dia_final):
+                # (dias x horas x anos x medidas), na ordem do índice da tabela
+                valores = janela.transpose(1, 2, 0, 3)
+                registrados = ~np.isnan(valores).all(axis=-1)
+                dia, hora, _ = np.nonzero(registrados)
+
+                partes += [pd.DataFrame({'cidade_id': cidade_id, 'dia_do_ano': dias[dia], 'hora': hora,
+                                         **dict(zip(MEDIDAS, np.round(valores[registrados].astype(np.float64),
+                                                                      CASAS_DECIMAIS).T))})]
+
+        return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=['cidade_id', 'dia_do_ano',
+                                                                                         'hora', *MEDIDAS])
+
+
+def get_posicao_do_dia(dia_do_ano):
+    """
+    :param dia_do_ano: dia do ano no calendário fixo de 365 dias
+    :return:           posição do dia no eixo de dias do cubo (calendário bissexto, a partir de 0)
+    """
+    return dia_do_ano - 1 + (dia_do_ano >= DIA_BISSEXTO)
+
+
+def get_versao(cnx):
+    """
+    :param cnx: conexão com o banco de dados local
+    :return:    impressão dos arquivos carregados segundo o manifesto (muda a cada carga)
+    """
+    return get_impressao(cnx.execute("select caminho, hash from manifesto where carregado "
+                                     "order by caminho").fetchall())
+
+
+def get_arquivo_de_dados(versao):
+    """
+    :param versao: versão dos dados do cubo ('get_versao')
+    :return:       nome do arquivo de dados da versão
+    """
+    return f'dados_{versao}.npy'
+
+
+def get_cubo(cnx, caminho=CAMINHO_CUBO):
+    """
+    :param cnx:     conexão com o banco de dados local
+    :param caminho: diretório do cubo (relativo ao diretório do banco)
+    :return:        cubo climático, ou None se ainda não foi gerado ou se está desatualizado em relação à tabela
+    """
+    caminho = get_caminho_junto_ao_banco(cnx, caminho)
+
+    if not os.path.exists(os.path.join(caminho, 'indice.json')):
+        return None
+
+    # sem o arquivo de dados da versão do índice (cubo gerado por uma versão anterior, ou substituído por uma nova
+    # geração entre a leitura do índice e a dos dados), os dados são lidos do banco
+    try:
+        cubo = CuboClimatico(caminho)
+    except (KeyError, OSError):
+        logger.info(f"Cubo climático incompleto em '{caminho}': os dados serão lidos do banco")
+        return None
+
+    if cubo.versao != get_versao(cnx):
+        logger.info(f"Cubo climático desatualizado em '{caminho}': os dados serão lidos do banco")
+        return None
+
+    return cubo
+
+
+def write_cubo(cnx, caminho=CAMINHO_CUBO):
+    """
+    Gera o cubo climático a partir de 'dados_metereologicos', uma estação por vez: o arquivo de dados, com a
+    versão no nome, é preenchido diretamente em disco, e só então o índice é substituído de uma só vez
+    ('os.replace'). Quem lê o índice antigo continua com os dados antigos, e quem lê o novo, com os novos. Os
+    arquivos de dados de outras versões são removidos ao final, exceto os que ainda estão abertos (no Windows)
+
+    :param cnx:     conexão com o banco de dados local
+    :param caminho: diretório do cubo (relativo ao diretório do banco)
+    """
+    caminho = get_caminho_junto_ao_banco(cnx, caminho)
+
+    estacoes = [estacao_id for estacao_id, in cnx.execute("select distinct estacao_id from dados_metereologicos "
+                                                          "order by estacao_id")]
+    ano_inicial, ano_final = cnx.execute("select min(substr(timestamp, 1, 4)), max(substr(timestamp, 1, 4)) "
+                                         "from dados_metereologicos").fetchone()
+    anos = list(range(int(ano_inicial), int(ano_final) + 1)) if estacoes else []
+
+    versao = get_versao(cnx)
+    arquivo = get_arquivo_de_dados(versao)
+
+    os.makedirs(caminho, exist_ok=True)
+    temporario = os.path.join(caminho, f'{arquivo}.tmp')
+
+    dados = np.lib.format.open_memmap(temporario, mode='w+', dtype=np.float32,
+                                      shape=(len(estacoes), len(anos), DIAS, HORAS, len(MEDIDAS)))
+    dados[:] = np.nan
+
+    for posicao, estacao_id in enumerate(estacoes):
+        dm = pd.read_sql(f"select timestamp, {', '.join(MEDIDAS)} from dados_metereologicos "
+                         f"where estacao_id = ?", cnx, params=(estacao_id,), parse_dates=['timestamp'])
+
+        ano = dm['timestamp'].dt.year.values - anos[0]
+        dia = dm['timestamp'].dt.dayofyear.values - 1
+        dia += (~dm['timestamp'].dt.is_leap_year.values) & (dia >= DIA_BISSEXTO - 1)
+
+        dados[posicao, ano, dia, dm['timestamp'].dt.hour.values] = dm[MEDIDAS].values
+
+    dados.flush()
+    del dados
+
+    os.replace(temporario, os.path.join(caminho, arquivo))
+
+    with open(os.path.join(caminho, 'indice.tmp.json'), 'w') as file:
+        json.dump({'versao': versao, 'estacoes': estacoes, 'anos': anos, 'medidas': MEDIDAS}, file)
+
+    os.replace(os.path.join(caminho, 'indice.tmp.json'), os.path.join(caminho, 'indice.json'))
+
+    for anterior in os.listdir(caminho):
+        if anterior.startswith('dados') and anterior.endswith('.npy') and anterior != arquivo:
+            try:
+                os.remove(os.path.join(caminho, anterior))
+            except OSError:
+                pass
+
+    logger.info(f"Cubo climático gravado em '{caminho}': {len(estacoes)} estações x {len(anos)} anos")
@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+
+
+# colunas de cada medida resumida: os valores atuais, máximos e mínimos são ocorrências da mesma medida, como em
+# 'Simulador.get_distribuicoes'
+MEDIDAS_RESUMIDAS = {'temperatura': ['temperatura', 't_max', 't_min'], 'umidade': ['umidade', 'u_max', 'u_min']}
+
+# histograma de intervalos fixos de cada medida (início, fim, intervalos): valores fora da faixa entram nos extremos
+HISTOGRAMAS = {'temperatura': (-10.0, 50.0, 120), 'umidade': (0.0, 100.0, 100)}
+
+CHAVES = ['estacao_id', 'dia_do_ano', 'hora', 'medida']
+ESTATISTICAS = ['n', 'soma', 'soma_quadrados', 'soma_cubos', 'minimo', 'maximo']
+
+# contagens gravadas em 16 bits: cada (estação, dia do ano, hora) tem no máximo três observações por ano
+TIPO_DO_HISTOGRAMA = np.uint16
+
+
+class Resumo:
+    def __init__(self, medida, n, soma, soma_quadrados, soma_cubos, minimo, maximo, histograma):
+        """
+        Estatísticas suficientes de um conjunto de observações de uma medida: contagem, somas das potências (para a
+        média, a variância e a assimetria), extremos e o histograma de intervalos fixos de 'HISTOGRAMAS'
+
+        :param medida:         'temperatura' ou 'umidade'
+        :param n:              quantidade de observações
+        :param soma:           soma das observações
+        :param soma_quadrados: soma dos quadrados
+        :param soma_cubos:     soma dos cubos
+        :param minimo:         menor observação
+        :param maximo:         maior observação
+        :param histograma:     contagem por intervalo
+        """
+        self.medida = medida
+        self.n = int(n)
+        self.soma, self.soma_quadrados, self.soma_cubos = soma, soma_quadrados, soma_cubos
+        self.minimo, self.maximo = minimo, maximo
+        self.histograma = np.asarray(histograma, dtype=np.int32)
+
+    @property
+    def media(self):
+        return self.soma / self.n
+
+    @property
+    def desvio(self):
+        return np.sqrt(max(self.soma_quadrados / self.n - self.media ** 2, 0.0))
+
+    @property
+    def assimetria(self):
+        media = self.media
+        terceiro_momento = self.soma_cubos / self.n - 3 * media * self.soma_quadrados / self.n + 2 * media ** 3
+
+        return terceiro_momento / self.desvio ** 3
+
+    def get_centros(self):
+        """
+        :return: centro de cada intervalo do histograma, limitado aos extremos observados
+        """
+        limites = get_limites(self.medida)
+
+        return np.clip((limites[:-1] + limites[1:]) / 2, self.minimo, self.maximo)
+
+    def get_media_do_log(self, loc):
+        """
+        :param loc: deslocamento (abaixo do mínimo)
+        :return:    média de log(x - loc), aproximada pelos centros dos intervalos
+        """
+        return (self.histograma * np.log(self.get_centros() - loc)).sum() / self.n
+
+    def get_densidade(self):
+        """
+        Histograma com cerca de sqrt(n) intervalos entre os extremos observados, agrupando os intervalos fixos, no
+        mesmo critério do ajuste a partir das observações ('fit_nativo')
+
+        :return: densidade e centro de cada intervalo
+        """
+        limites = get_limites(self.medida)
+        primeiro = max(np.searchsorted(limites, self.minimo, side='right') - 1, 0)
+        ultimo = min(np.searchsorted(limites, self.maximo, side='right') - 1, len(limites) - 2)
+
+        largura = -(-(ultimo - primeiro + 1) // max(int(np.sqrt(self.n)), 1))
+        grupos = np.arange(primeiro, ultimo + 1, largura)
+
+        contagens = np.add.reduceat(self.histograma[primeiro:ultimo + 1], grupos - primeiro)
+        inicios, fins = limites[grupos], limites[np.minimum(grupos + largura, ultimo + 1)]
+
+        return contagens / (self.n * (fins - inicios)), (inicios + fins) / 2
+
+    def tobytes(self):
+        """
+        :return: representação binária (chave do cache de distribuições)
+        """
+        return (np.array([self.n, self.soma, self.soma_quadrados, self.soma_cubos, self.minimo, self.maximo])
+                .tobytes() + self.medida.encode() + self.histograma.tobytes())
+
+
+def get_limites(medida):
+    """
+    :param medida: 'temperatura' ou 'umidade'
+    :return:       limites dos intervalos fixos do histograma da medida
+    """
+    inicio, fim, intervalos = HISTOGRAMAS[medida]
+
+    return np.linspace(inicio, fim, intervalos + 1)
+
+
+def get_resumos(df):
+    """
+    :param df: dados meteorológicos com as colunas 'estacao_id', 'dia_do_ano', 'hora' e as medidas
+    :return:   um resumo por estação, dia do ano, hora e medida ('CHAVES'), com o histograma em um vetor por linha
+    """
+    partes = []
+
+    for medida, colunas in MEDIDAS_RESUMIDAS.items():
+        valores = (df.melt(id_vars=CHAVES[:3], value_vars=colunas, value_name='valor')
+                   .dropna(subset=['valor']))
+        if valores.empty:
+            continue
+
+        limites = get_limites(medida)
+        intervalo = np.clip(np.searchsorted(limites, valores['valor'].values, side='right') - 1, 0, len(limites) - 2)
+
+        x = valores['valor'].values.astype(float)
+        resumo = (valores.assign(medida=medida, n=1, soma=x, soma_quadrados=x ** 2, soma_cubos=x ** 3, minimo=x,
+                                 maximo=x, intervalo=intervalo)
+                  .drop(columns=['variable', 'valor']))
+
+        partes += [combine_resumos(resumo, CHAVES)]
+
+    return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=[*CHAVES, *ESTATISTICAS,
+                                                                                     'histograma'])
+
+
+def combine_resumos(resumos, chaves):
+    """
+    Combina resumos (ou observações com a coluna 'intervalo') com as mesmas chaves: contagens e somas são somadas,
+    os extremos são combinados e os histogramas são somados intervalo a intervalo
+
+    :param resumos: resumos com as colunas de 'ESTATISTICAS' e 'histograma' (ou 'intervalo', para observações)
+    :param chaves:  colunas que identificam cada resumo combinado (incluindo 'medida')
+    :return:        um resumo por combinação de chaves
+    """
+    grupos = resumos.groupby(chaves, sort=False)
+    grupo = grupos.ngroup().values
+
+    combinados = grupos.agg(n=('n', 'sum'), soma=('soma', 'sum'), soma_quadrados=('soma_quadrados', 'sum'),
+                            soma_cubos=('soma_cubos', 'sum'), minimo=('minimo', 'min'),
+                            maximo=('maximo', 'max')).reset_index()
+    medidas = combinados['medida'].values
+
+    histogramas = {}
+    for medida in np.unique(medidas):
+        linhas = np.flatnonzero(resumos['medida'].values == medida)
+        histograma = np.zeros((len(combinados), HISTOGRAMAS[medida][2]), dtype=np.int32)
+
+        if 'intervalo' in resumos:
+            np.add.at(histograma, (grupo[linhas], resumos['intervalo'].values[linhas]), 1)
+        else:
+            np.add.at(histograma, grupo[linhas], np.stack(resumos['histograma'].values[linhas]))
+
+        histogramas[medida] = histograma
+
+    combinados['histograma'] = [histogramas[medida][linha] for linha, medida in enumerate(medidas)]
+
+    return combinados
+
+
+def read_climatologia(cnx, cidades, dia_inicial, dia_final):
+    """
+    Resumos das estações das cidades em uma janela de dias do ano (janelas que viram o ano são divididas em duas
+    faixas), no formato de 'Simulador.get_dados_metereologicos'
+
+    :param cnx:         conexão com o banco de dados local
+    :param cidades:     cidades da rota
+    :param dia_inicial: primeiro dia do ano da janela
+    :param dia_final:   último dia do ano da janela
+    :return:            um resumo por cidade, dia do ano, hora e medida
+    """
+    if dia_inicial <= dia_final:
+        faixas = [(dia_inicial, dia_final)]
+    else:
+        faixas = [(dia_inicial, 365), (1, dia_final)]
+
+    query = " union all ".join(
+        f"select c.cidade_id, cl.dia_do_ano, cl.hora, cl.medida, cl.n, cl.soma, cl.soma_quadrados, cl.soma_cubos, "
+        f"       cl.minimo, cl.maximo, cl.histograma "
+        f"from cidades c "
+        f"inner join climatologia cl on (cl.estacao_id = c.estacao_id) "
+        f"where c.cidade_id in ({', '.join('?' * len(cidades))}) "
+        f"  and cl.dia_do_ano between ? and ?"
+        for _ in faixas)
+    parametros = [parametro for inicio, fim in faixas for parametro in [*map(int, cidades), int(inicio), int(fim)]]
+
+    resumos = (pd.read_sql(query, cnx, params=parametros)
+               .astype({estatistica: float for estatistica in ESTATISTICAS[1:]}))
+    resumos['histograma'] = [np.frombuffer(histograma, dtype=TIPO_DO_HISTOGRAMA).astype(np.int32)
+                             for histograma in resumos['histograma']]
+
+    return resumos
+
+
+def somar_histogramas(gravado, novo):
+    """
+    Função SQL de 'write_climatologia'
+
+    :param gravado: histograma gravado
+    :param novo:    histograma da carga
+    :return:        soma dos histogramas, intervalo a intervalo
+    """
+    return (np.frombuffer(gravado, dtype=TIPO_DO_HISTOGRAMA) + np.frombuffer(novo, dtype=TIPO_DO_HISTOGRAMA)).tobytes()
+
+
+def write_climatologia(cnx, resumos):
+    """
+    Soma os resumos de uma carga aos resumos já gravados das mesmas chaves, no próprio SQLite (upsert): a atualização
+    é incremental e nenhum resumo gravado é lido pelo Python. Não executa o commit.
+
+    :param cnx:     conexão com o banco de dados local
+    :param resumos: resumos calculados por 'get_resumos'
+    """
+    if resumos.empty:
+        return
+
+    cnx.create_function('somar_histogramas', 2, somar_histogramas, deterministic=True)
+
+    colunas = [*CHAVES, *ESTATISTICAS, 'histograma']
+    linhas = zip(*[resumos[coluna].tolist() for coluna in colunas[:-1]],
+                 [histograma.astype(TIPO_DO_HISTOGRAMA).tobytes() for histograma in resumos['histograma']])
+
+    cnx.executemany(f"insert into climatologia ({', '.join(colunas)}) values ({', '.join('?' * len(colunas))}) "
+                    f"on conflict ({', '.join(CHAVES)}) do update set "
+                    f"n = n + excluded.n, soma = soma + excluded.soma, "
+                    f"soma_quadrados = soma_quadrados + excluded.soma_quadrados, "
+                    f"soma_cubos = soma_cubos + excluded.soma_cubos, "
+                    f"minimo = min(minimo, excluded.minimo), maximo = max(maximo, excluded.maximo), "
+                    f"histograma = somar_histogramas(histograma, excluded.histograma)", linhas)
@@ -0,0 +1,92 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from src.storage import Escrita
+
+
+# tabela de saída de cada etapa: a impressão de uma saída só é válida se a saída ainda tem linhas na tabela
+SAIDAS_POR_ETAPA = {'ajuste': 'distribuicoes', 'simulacao': 'resultados'}
+
+
+class Dependencias:
+    def __init__(self, cnx, escrita=None):
+        """
+        Controle de recálculo por (rota, horário de saída): cada etapa grava em 'dependencias' a impressão (hash) das
+        entradas com que calculou cada saída, e a saída só é calculada de novo quando a impressão muda
+
+        :param cnx:     conexão com o banco de dados local
+        :param escrita: destino das escritas (por padrão, a própria conexão)
+        """
+        self.cnx = cnx
+        self.escrita = escrita if escrita is not None else Escrita(cnx)
+
+    def read(self, rota_id, etapa):
+        """
+        :param rota_id: identificador da rota
+        :param etapa:   etapa ('ajuste' ou 'simulacao')
+        :return:        impressão gravada de cada horário de saída da rota
+        """
+        return dict(self.cnx.execute("select saida, impressao from dependencias where rota_id = ? and etapa = ?",
+                                     (rota_id, etapa)))
+
+    def get_validas(self, rota_id, etapa, impressoes):
+        """
+        :param rota_id:    identificador da rota
+        :param etapa:      etapa ('ajuste' ou 'simulacao')
+        :param impressoes: impressão atual das entradas de cada horário de saída
+        :return:           horários de saída cuja impressão não mudou e cujo resultado ainda está gravado
+        """
+        gravadas = self.read(rota_id, etapa)
+        calculadas = {saida for saida, in self.cnx.execute(f"select distinct saida from {SAIDAS_POR_ETAPA[etapa]} "
+                                                           f"where rota_id = ?", (rota_id,))}
+
+        return {saida for saida, impressao in impressoes.items()
+                if impressao is not None and gravadas.get(saida) == impressao and saida in calculadas}
+
+    def write(self, rota_id, etapa, impressoes):
+        """
+        :param rota_id:    identificador da rota
+        :param etapa:      etapa ('ajuste' ou 'simulacao')
+        :param impressoes: impressão das entradas de cada horário de saída recalculado
+        """
+        self.escrita.executemany("insert or replace into dependencias (rota_id, saida, etapa, impressao, atualizado) "
+                                 "values (?, ?, ?, ?, datetime('now'))",
+                                 [(rota_id, saida, etapa, impressao) for saida, impressao in impressoes.items()
+                                  if impressao is not None])
+        self.escrita.commit()
+
+
+def get_impressao(*partes):
+    """
+    :param partes: valores que identificam as entradas (textos, números, tuplas...)
+    :return:       hash hexadecimal das partes
+    """
+    impressao = hashlib.sha1()
+
+    for parte in partes:
+        impressao.update(parte if isinstance(parte, bytes) else repr(parte).encode())
+
+    return impressao.hexdigest()
+
+
+def get_impressoes_por_saida(data, configuracao):
+    """
+    Impressão das entradas do ajuste de cada horário de saída: as observações históricas de cada cidade e hora
+    pela qual o veículo passa (que mudam com os dados meteorológicos e com os trechos da rota) e a configuração do
+    ajuste. A ordem das linhas não altera a impressão.
+
+    :param data:         dados históricos por saída, cidade e hora (ver 'Simulador.get_clima_por_hora')
+    :param configuracao: parâmetros do ajuste (distribuições candidatas, método etc.)
+    :return:             impressão de cada horário de saída
+    """
+    linhas = pd.util.hash_pandas_object(data.drop(columns=['saida']).astype({'hora': str}), index=False).values
+    saida_por_linha, saidas = pd.factorize(data['saida'])
+    saidas = pd.DatetimeIndex(saidas).strftime('%Y-%m-%d %H:%M:%S')
+
+    ordem = np.lexsort((linhas, saida_por_linha))
+    limites = np.searchsorted(saida_por_linha[ordem], np.arange(len(saidas) + 1))
+
+    return {saida: get_impressao(linhas[ordem[inicio:fim]].tobytes(), configuracao)
+            for saida, inicio, fim in zip(saidas, limites[:-1], limites[1:])}
@@ -1,86 +1,222 @@
+from functools import lru_cache
+
 import numpy as np
 
 import skfuzzy as fuzz
-from skfuzzy import control as ctrl
 
 from src.utils import logger
 
 
-def get_fuzzy_results(simulated_df):
+# Domínio fixo das variáveis de entrada (os dados simulados são limitados a estes intervalos em 'get_results')
+DOMINIO_TEMPERATURA = (0, 40)
+DOMINIO_UMIDADE = (0, 100)
+
+# Universo discreto da variável de saída
+UNIVERSO_SCORE = np.arange(0, 11, 1)
+
+# Quantidade de linhas avaliadas por vez, para limitar a memória das matrizes intermediárias
+TAMANHO_DO_LOTE = 100_000
+
+BOM, MEDIO, RUIM = range(3)
+
+# Conjunto de regras consideradas pela lógica fuzzy: (temperatura, umidade) -> score
+REGRAS = {
+    # baixas temperaturas:
+    ('Baixa', 'Baixa'): BOM,
+    ('Baixa', 'Media'): BOM,
+    ('Baixa', 'Alta'): RUIM,
+
+    # médias temperaturas:
+    ('Media', 'Baixa'): BOM,
+    ('Media', 'Media'): MEDIO,
+    ('Media', 'Alta'): RUIM,
+
+    # altas temperaturas:
+    ('Alta', 'Baixa'): MEDIO,
+    ('Alta', 'Media'): RUIM,
+    ('Alta', 'Alta'): RUIM
+}
+
+
+def get_pertinencia_temperatura(temperatura):
+    """
+    Funções de pertinência da temperatura, avaliadas diretamente nos valores simulados
+
+    :param temperatura: valores de temperatura (ºC)
+    :return:            grau de pertinência de cada valor em cada termo
+    """
+    return {'Baixa': fuzz.trapmf(temperatura, [0, 0, 10, 25]),
+            'Media': fuzz.trimf(temperatura, [20, 25, 30]),
+            'Alta': fuzz.trapmf(temperatura, [25, 35, 40, 40])}
+
+
+def get_pertinencia_umidade(umidade):
+    """
+    Funções de pertinência da umidade, avaliadas diretamente nos valores simulados
+
+    :param umidade: valores de umidade relativa do ar (%)
+    :return:        grau de pertinência de cada valor em cada termo
+    """
+    return {'Baixa': fuzz.trapmf(umidade, [0, 0, 30, 50]),
+            'Media': fuzz.trimf(umidade, [40, 60, 80]),
+            'Alta': fuzz.trapmf(umidade, [70, 90, 100, 100])}
+
+
+# Funções de pertinência do score (Bom, Medio, Ruim), discretizadas no universo de saída
+PERTINENCIA_SCORE = np.vstack([fuzz.gaussmf(UNIVERSO_SCORE, mean=10, sigma=2),
+                               fuzz.trimf(UNIVERSO_SCORE, [4, 5, 6]),
+                               fuzz.gaussmf(UNIVERSO_SCORE, mean=0, sigma=2)])
+
+
+def get_ativacoes(temperatura, umidade):
+    """
+    Inferência de Mamdani: a ativação de cada regra é o mínimo ("e") das pertinências de entrada,
+    e a ativação de cada termo do score é o máximo ("ou") das regras que apontam para ele
+
+    :param temperatura: valores de temperatura
+    :param umidade:     valores de umidade
+    :return:            matriz (linhas x termos do score) com o nível de corte de cada termo
+    """
+    pertinencia_temperatura = get_pertinencia_temperatura(temperatura)
+    pertinencia_umidade = get_pertinencia_umidade(umidade)
+
+    ativacoes = np.zeros((len(temperatura), len(PERTINENCIA_SCORE)))
+    for (termo_temperatura, termo_umidade), termo_score in REGRAS.items():
+        disparo = np.fmin(pertinencia_temperatura[termo_temperatura], pertinencia_umidade[termo_umidade])
+        np.fmax(ativacoes[:, termo_score], disparo, out=ativacoes[:, termo_score])
+
+    return ativacoes
+
+
+def defuzzify_centroid(ativacoes):
+    """
+    Defuzzificação pelo centroide, replicando o 'ControlSystemSimulation' do skfuzzy de forma vetorizada:
+    o universo do score é reamostrado nos pontos em que cada função de pertinência cruza o seu nível de corte
+    e a área sob a função agregada é integrada exatamente, trecho a trecho (trapézios)
+
+    :param ativacoes: matriz (linhas x termos do score) com o nível de corte de cada termo
+    :return:          score defuzzificado de cada linha
+    """
+    universo = UNIVERSO_SCORE.astype(float)
+    inicio, fim = PERTINENCIA_SCORE[:, :-1], PERTINENCIA_SCORE[:, 1:]     # (termos x trechos)
+    cortes = ativacoes[:, :, np.newaxis]                                    # (linhas x termos x 1)
+
+    # pontos em que a pertinência de cada termo cruza o seu corte dentro de cada trecho do universo
+    # (corte nulo usa a comparação estrita, como o '_interp_universe_fast' do skfuzzy)
+    acima_inicio = np.where(cortes == 0, inicio > cortes, inicio >= cortes)
+    acima_fim = np.where(cortes == 0, fim > cortes, fim >= cortes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cruzamentos = universo[:-1] + (cortes - inicio) / (fim - inicio)
+    cruzamentos = np.where(acima_inicio != acima_fim, cruzamentos, universo[-1])
+
+    # pontos inválidos ficam no fim do universo e formam trechos de largura nula (sem área)
+    pontos = np.concatenate([np.broadcast_to(universo, (len(ativacoes), len(universo))),
+                             cruzamentos.reshape(len(ativacoes), -1)], axis=1)
+    pontos.sort(axis=1)
+
+    # função de pertinência agregada: máximo entre os termos cortados em seus níveis de ativação
+    agregada = np.zeros_like(pontos)
+    for termo, pertinencia in enumerate(PERTINENCIA_SCORE):
+        np.fmax(agregada, np.fmin(np.interp(pontos, universo, pertinencia), cortes[:, termo]), out=agregada)
+
+    # centroide de cada trapézio, ponderado pela sua área
+    x1, x2 = pontos[:, :-1], pontos[:, 1:]
+    y1, y2 = agregada[:, :-1], agregada[:, 1:]
+    largura = x2 - x1
+
+    area = (0.5 * largura * (y1 + y2)).sum(axis=1)
+    momento = (0.5 * largura * (y1 + y2) * x1 + largura ** 2 * (y1 + 2 * y2) / 6).sum(axis=1)
+
+    return np.where(area > 0, momento / np.fmax(area, np.finfo(float).eps), np.nan)
+
+
+def score_fuzzy(temperatura, umidade):
+    """
+    Calcula o score fuzzy de cada par (temperatura, umidade) com operações vetorizadas do NumPy,
+    em lotes de tamanho fixo
+
+    :param temperatura: valores de temperatura
+    :param umidade:     valores de umidade
+    :return:            score de cada par (quanto maior, melhor)
+    """
+    temperatura = np.asarray(temperatura, dtype=float)
+    umidade = np.asarray(umidade, dtype=float)
+
+    score = np.empty(len(temperatura))
+    for inicio in range(0, len(temperatura), TAMANHO_DO_LOTE):
+        lote = slice(inicio, inicio + TAMANHO_DO_LOTE)
+        score[lote] = defuzzify_centroid(get_ativacoes(temperatura[lote], umidade[lote]))
+
+    return score
+
+
+@lru_cache(maxsize=None)
+def get_superficie_de_score(passo_temperatura=0.1, passo_umidade=0.25):
+    """
+    Pré-calcula o score fuzzy em uma grade regular sobre o domínio fixo de temperatura e umidade
+
+    :param passo_temperatura: espaçamento da grade de temperatura (ºC)
+    :param passo_umidade:     espaçamento da grade de umidade (%)
+    :return:                  eixos de temperatura e umidade e a matriz de scores (temperatura x umidade)
+    """
+    eixo_temperatura = np.linspace(*DOMINIO_TEMPERATURA,
+                                   int(round(np.ptp(DOMINIO_TEMPERATURA) / passo_temperatura)) + 1)
+    eixo_umidade = np.linspace(*DOMINIO_UMIDADE, int(round(np.ptp(DOMINIO_UMIDADE) / passo_umidade)) + 1)
+
+    grade_temperatura, grade_umidade = np.meshgrid(eixo_temperatura, eixo_umidade, indexing='ij')
+    scores = score_fuzzy(grade_temperatura.ravel(), grade_umidade.ravel()).reshape(grade_temperatura.shape)
+
+    return eixo_temperatura, eixo_umidade, scores
+
+
+def interpolate_superficie(superficie, temperatura, umidade):
+    """
+    Interpolação bilinear do score na superfície pré-calculada
+
+    :param superficie:  eixos e matriz de scores retornados por 'get_superficie_de_score'
+    :param temperatura: valores de temperatura
+    :param umidade:     valores de umidade
+    :return:            score interpolado de cada par
+    """
+    eixo_temperatura, eixo_umidade, scores = superficie
+
+    def localiza(eixo, valores):
+        valores = np.clip(np.asarray(valores, dtype=float), eixo[0], eixo[-1])
+        celula = np.clip(np.searchsorted(eixo, valores, side='right') - 1, 0, len(eixo) - 2)
+        return celula, (valores - eixo[celula]) / (eixo[celula + 1] - eixo[celula])
+
+    i, ft = localiza(eixo_temperatura, temperatura)
+    j, fu = localiza(eixo_umidade, umidade)
+
+    return ((1 - ft) * (1 - fu) * scores[i, j] + ft * (1 - fu) * scores[i + 1, j] +
+            (1 - ft) * fu * scores[i, j + 1] + ft * fu * scores[i + 1, j + 1])
+
+
+def get_score(temperatura, umidade, superficie=False):
+    """
+    :param temperatura: valores de temperatura
+    :param umidade:     valores de umidade
+    :param superficie:  se verdadeiro, interpola o score na superfície pré-calculada ('get_superficie_de_score')
+    :return:            score de cada par (quanto maior, melhor)
+    """
+    if superficie:
+        return interpolate_superficie(get_superficie_de_score(), temperatura, umidade)
+
+    return score_fuzzy(temperatura, umidade)
+
+
+def get_fuzzy_results(simulated_df, superficie=False):
     """
     Implementa sistema de lógica fuzzy (nebulosa) para analisar de forma subjetiva a relação entre
     temperatura e umidade.
 
     :param simulated_df: conjunto de dados com as combinações de temperatura e umidade simuladas para o índice
                          composto por horário de saída, cidade, mês, dia e hora
+    :param superficie:   se verdadeiro, interpola o score em uma superfície pré-calculada em vez de
+                         avaliar as regras para cada linha
     :return:             score calculado com base no impacto das condições climáticas sobre a rota
                          (quanto maior, melhor)
     """
     logger.info('Implementando análise fuzzy!')
 
-    data_for_temp = (
-        # np.arange(0, 40, 1)                              # denso
-        simulated_df['temperatura'].sort_values().values   # esparso
-    )
-    data_for_umid = (
-        # np.arange(0, 101, 1)                              # denso
-        simulated_df['umidade'].sort_values().values        # esparso
-    )
-
-    # Declarando variáveis de entrada
-    temperatura = ctrl.Antecedent(universe=data_for_temp, label='Temperatura')
-    umidade = ctrl.Antecedent(universe=data_for_umid, label='Umidade')
-
-    # Declarando variáveis de saída
-    score = ctrl.Consequent(universe=np.arange(0, 11, 1), label='Score', defuzzify_method='centroid')
-
-    # Declarando funções de pertinência
-    # Temperatura:
-    temperatura['Baixa'] = fuzz.trapmf(temperatura.universe, [0, 0, 10, 25])
-    temperatura['Media'] = fuzz.trimf(temperatura.universe, [20, 25, 30])
-    temperatura['Alta'] = fuzz.trapmf(temperatura.universe, [25, 35, 40, 40])
-
-    # Umidade:
-    umidade['Baixa'] = fuzz.trapmf(umidade.universe, [0, 0, 30, 50])
-    umidade['Media'] = fuzz.trimf(umidade.universe, [40, 60, 80])
-    umidade['Alta'] = fuzz.trapmf(umidade.universe, [70, 90, 100, 100])
-
-    # Score:
-    score['Bom'] = fuzz.gaussmf(score.universe, mean=10, sigma=2)
-    score['Medio'] = fuzz.trimf(score.universe, [4, 5, 6])
-    score['Ruim'] = fuzz.gaussmf(score.universe, mean=0, sigma=2)
-
-    # Visualização das funções de pertinência
-    # temperatura.view()
-    # umidade.view()
-    # score.view()
-
-    # Conjunto de regras consideradas pela lógica fuzzy
-    rules = {
-        # baixas temperaturas:
-        temperatura['Baixa'] & umidade['Baixa']: score['Bom'],
-        temperatura['Baixa'] & umidade['Media']: score['Bom'],
-        temperatura['Baixa'] & umidade['Alta']: score['Ruim'],
-
-        # médias temperaturas:
-        temperatura['Media'] & umidade['Baixa']: score['Bom'],
-        temperatura['Media'] & umidade['Media']: score['Medio'],
-        temperatura['Media'] & umidade['Alta']: score['Ruim'],
-
-        # altas temperaturas:
-        temperatura['Alta'] & umidade['Baixa']: score['Medio'],
-        temperatura['Alta'] & umidade['Media']: score['Ruim'],
-        temperatura['Alta'] & umidade['Alta']: score['Ruim']
-    }
-
-    controlador = ctrl.ControlSystem(rules=[ctrl.Rule(key, value) for key, value in rules.items()])
-    simulador = ctrl.ControlSystemSimulation(controlador)
-
-    # Chamando a simulação:
-    simulador.input['Temperatura'] = simulated_df['temperatura'].values
-    simulador.input['Umidade'] = simulated_df['umidade'].values
-
-    simulador.compute()
-    # simulated_df['score'] = simulador.output['Score']
-
-    return simulador.output['Score']
+    return get_score(simulated_df['temperatura'].values, simulated_df['umidade'].values, superficie)
@@ -1,11 +1,43 @@
 import os
+import time
+import hashlib
 import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from src.utils import cronometro, logger
+from src.utils import get_dia_do_ano, logger
+from src.profiling import contar, cronometro
+from src.climate import CAMINHO_CUBO, get_cubo, write_cubo
+from src.climatology import get_resumos, write_climatologia
+from src.storage import pragmas_temporarios
+
+
+# chaves de calendário derivadas do timestamp (mesma regra de 'get_dia_do_ano' para anos bissextos)
+SQL_DIA_DO_ANO = ("cast(strftime('%j', timestamp) as integer) - "
+                  "(strftime('%j', strftime('%Y', timestamp) || '-12-31') = '366' "
+                  " and cast(strftime('%j', timestamp) as integer) >= 60)")
+SQL_HORA = "cast(strftime('%H', timestamp) as integer)"
+
+# colunas gravadas em 'dados_metereologicos' durante a carga dos arquivos do INMET
+COLUNAS = ['estacao_id', 'timestamp', 'temperatura', 't_max', 't_min', 'umidade', 'u_max', 'u_min', 'dia_do_ano',
+           'hora']
+
+# a carga é gravada em poucas transações grandes, com o journal em WAL e um cache de páginas maior (~200 MB); os
+# PRAGMAs do chamador ('--pragma') prevalecem, e os valores da conexão são restaurados ao fim da carga
+LINHAS_POR_TRANSACAO = 500_000
+PRAGMAS_DE_CARGA = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -200_000}
+
+# colunas ausentes em bases antigas: estatísticas por horário de saída em 'resultados' (ver 'src/streaming.py'),
+# a hora de cada célula em 'simulacoes' e a distribuição do atraso de cada trecho em 'transit_time'
+COLUNAS_NOVAS = {'resultados': {'desvio_padrao': 'NUMERIC', 'score_inferior': 'NUMERIC', 'score_superior': 'NUMERIC',
+                                'p05': 'NUMERIC', 'p50': 'NUMERIC', 'p95': 'NUMERIC', 'cenarios': 'INTEGER',
+                                'ranking': 'INTEGER'},
+                 'simulacoes': {'hora': 'TIME'},
+                 'transit_time': {'atraso_dist': 'VARCHAR (20)', 'atraso_params': 'VARCHAR (50)'}}
 
 
 class Integrador:
-    def __init__(self, cnx, atualizar_base=False):
+    def __init__(self, cnx, atualizar_base=False, workers=1, caminho_cubo=CAMINHO_CUBO, pragmas=None):
         """
         Os dados são obtidos a partir do pacote anual de estações automáticas do INMET
         Estes arquivos devem ser adicionados em uma pasta "data/" na raiz do repositório
@@ -13,62 +45,182 @@ class Integrador:
         Apenas as estações que estão nas rotas cadastradas são mapeadas. As restantes são ignoradas.
 
         :param cnx: conexão com o banco de dados local
-        :param atualizar_base: decide se a tabela será limpa antes do procedimento
+        :param atualizar_base: decide se os arquivos novos ou alterados da pasta "data/" serão carregados
+        :param workers: quantidade de processos para a leitura dos arquivos (1 para execução serial)
+        :param caminho_cubo: diretório do cubo climático gerado após a carga ('src/climate.py'; None para não gerar)
+        :param pragmas: PRAGMAs informados pelo chamador, mantidos durante a carga (sobre 'PRAGMAS_DE_CARGA')
         """
         self.data_path = 'data'
         self.cnx = cnx
+        self.workers = workers
+        self.caminho_cubo = caminho_cubo
+        self.pragmas = pragmas or {}
+
+        with open('db/tables.sql', encoding='windows-1252') as file:
+            self.create_db_entities(file.read())
+
+        self.create_chaves_de_calendario()
+        self.create_colunas_novas()
+        self.create_climatologia()
 
-        with open('db/tables.sql') as file:
+        with open('db/indexes.sql', encoding='windows-1252') as file:
             self.create_db_entities(file.read())
 
-        with open('db/views.sql') as file:
+        with open('db/views.sql', encoding='windows-1252') as file:
             self.create_db_entities(file.read())
 
         if atualizar_base:
             logger.info('Atualizando base de estações metereológicas!')
 
-            cnx.execute('delete from dados_metereologicos')
-            cnx.commit()
-
             self.read_estacoes_inmet()
 
             self.read_historical_data()
 
+            self.update_cubo()
+
     def create_db_entities(self, script):
-        for query in script.split(';'):
-            self.cnx.execute(query)
-            self.cnx.commit()
+        """
+        Executa o script em uma única transação (no sqlite3, comandos DDL fora de uma transação explícita são
+        gravados um a um)
+
+        :param script: comandos separados por ';'
+        """
+        self.cnx.execute("begin")
+        try:
+            for query in script.split(';'):
+                self.cnx.execute(query)
+        except Exception:
+            self.cnx.rollback()
+            raise
+        self.cnx.commit()
+
+    def create_chaves_de_calendario(self):
+        """
+        Bases criadas antes das colunas 'dia_do_ano' e 'hora' em 'dados_metereologicos' recebem as colunas e
+        têm as chaves calculadas a partir do timestamp, para que as consultas por janela de calendário usem o índice
+        """
+        colunas = [coluna[1] for coluna in self.cnx.execute("pragma table_info(dados_metereologicos)")]
+
+        for coluna in ['dia_do_ano', 'hora']:
+            if coluna not in colunas:
+                self.cnx.execute(f"alter table dados_metereologicos add column {coluna} INTEGER")
+
+        self.cnx.execute(f"update dados_metereologicos set dia_do_ano = {SQL_DIA_DO_ANO}, hora = {SQL_HORA} "
+                         f"where dia_do_ano is null or hora is null")
+        self.cnx.commit()
+
+    def create_colunas_novas(self):
+        """
+        Bases criadas com versões anteriores das tabelas recebem as colunas novas ('COLUNAS_NOVAS')
+        """
+        for tabela, colunas_novas in COLUNAS_NOVAS.items():
+            colunas = [coluna[1] for coluna in self.cnx.execute(f"pragma table_info({tabela})")]
+
+            for coluna, tipo in colunas_novas.items():
+                if coluna not in colunas:
+                    self.cnx.execute(f"alter table {tabela} add column {coluna} {tipo}")
+        self.cnx.commit()
+
+    def create_climatologia(self):
+        """
+        Bases carregadas antes da tabela 'climatologia' têm os resumos calculados a partir dos dados já gravados
+        """
+        if self.cnx.execute("select 1 from climatologia limit 1").fetchone() is not None:
+            return
+
+        estacoes = [estacao_id for estacao_id, in self.cnx.execute("select distinct estacao_id "
+                                                                   "from dados_metereologicos")]
+        if estacoes:
+            logger.info(f'Calculando a climatologia de {len(estacoes)} estação(ões)')
+            self.update_climatologia(estacoes)
+
+    def update_climatologia(self, estacoes):
+        """
+        Recalcula os resumos de 'climatologia' das estações a partir de todos os seus dados (usado quando dados são
+        removidos; na carga de arquivos novos, os resumos são apenas somados em 'write_dados_metereologicos')
+
+        :param estacoes: estações recalculadas
+        """
+        for estacao_id in estacoes:
+            self.cnx.execute("delete from climatologia where estacao_id = ?", (estacao_id,))
+            write_climatologia(self.cnx, get_resumos(pd.read_sql(
+                "select estacao_id, dia_do_ano, hora, temperatura, t_max, t_min, umidade, u_max, u_min "
+                "from dados_metereologicos where estacao_id = ?", self.cnx, params=(estacao_id,))))
+
+        self.cnx.commit()
 
     @cronometro
     def read_estacoes_inmet(self):
         """
         Mapeia estações com informações existentes nos dados disponibilizados pelo INMET e armazena em um banco local
+
+        Cada arquivo é registrado no manifesto com tamanho, data de modificação e hash do conteúdo. Apenas arquivos
+        novos ou alterados são marcados para carga, e os dados da estação-ano de um arquivo alterado são removidos.
         """
-        self.cnx.execute("delete from estacoes")
-        self.cnx.execute("delete from dados_estacoes")
-        self.cnx.commit()
+        manifesto = {caminho: (tamanho, modificado, hash_do_arquivo) for caminho, tamanho, modificado, hash_do_arquivo
+                     in self.cnx.execute("select caminho, tamanho, modificado, hash from manifesto")}
 
-        df = pd.DataFrame(columns=['estacao_id', 'localidade', 'regiao', 'estado', 'ano', 'arquivo'])
-        idx = 0
+        estacoes, dados_estacoes, alterados = {}, [], []
 
         for ano in os.listdir(self.data_path):
             logger.info(f'Ano de leitura: {ano}')
             caminho_por_ano = os.path.join(self.data_path, ano)
 
             for arquivo in os.listdir(caminho_por_ano):
-                # logging.info(f'Arquivo: {arquivo}')
                 regiao, estado, estacao_id, localidade = arquivo.split('_')[1:5]
 
-                df.loc[idx] = [estacao_id, localidade, regiao, estado, ano, arquivo]
-                idx += 1
+                estacoes[estacao_id] = (estacao_id, localidade, regiao, estado)
+                dados_estacoes += [(estacao_id, int(ano), arquivo)]
+
+                caminho = os.path.join(ano, arquivo)
+                info = os.stat(os.path.join(self.data_path, caminho))
+
+                # tamanho e data de modificação iguais: o arquivo não é lido novamente
+                if caminho in manifesto and manifesto[caminho][:2] == (info.st_size, info.st_mtime):
+                    continue
+
+                hash_do_arquivo = get_hash_do_arquivo(os.path.join(self.data_path, caminho))
+
+                if caminho in manifesto and manifesto[caminho][2] == hash_do_arquivo:
+                    self.cnx.execute("update manifesto set tamanho = ?, modificado = ? where caminho = ?",
+                                     (info.st_size, info.st_mtime, caminho))
+                    continue
 
-        (df[['estacao_id', 'localidade', 'regiao', 'estado']]
-         .drop_duplicates(subset=['estacao_id'])
-         .to_sql('estacoes', self.cnx, if_exists='append', index=False))
+                alterados += [(caminho, estacao_id, int(ano), info.st_size, info.st_mtime, hash_do_arquivo,
+                               caminho in manifesto)]
 
-        (df[['estacao_id', 'ano', 'arquivo']]
-         .drop_duplicates(subset=['estacao_id', 'ano'])
-         .to_sql('dados_estacoes', self.cnx, if_exists='append', index=False))
+        self.cnx.executemany("insert or replace into estacoes (estacao_id, localidade, regiao, estado) "
+                             "values (?, ?, ?, ?)", estacoes.values())
+        self.cnx.executemany("insert or replace into dados_estacoes (estacao_id, ano, arquivo) values (?, ?, ?)",
+                             dados_estacoes)
+
+        removidas = set()
+
+        for caminho, estacao_id, ano, tamanho, modificado, hash_do_arquivo, existente in alterados:
+            inicio, fim = get_intervalo_do_arquivo(ano)
+
+            if existente:
+                logger.info(f'Arquivo alterado: {caminho}')
+                self.cnx.execute("delete from dados_metereologicos "
+                                 "where estacao_id = ? and timestamp >= ? and timestamp < ?", (estacao_id, inicio, fim))
+                removidas.add(estacao_id)
+                carregado = False
+            else:
+                # bases anteriores ao manifesto: arquivos cujos dados já estão em banco não são recarregados
+                carregado = self.cnx.execute("select count(1) from dados_metereologicos "
+                                             "where estacao_id = ? and timestamp >= ? and timestamp < ?",
+                                             (estacao_id, inicio, fim)).fetchone()[0] > 0
+
+            self.cnx.execute("insert or replace into manifesto "
+                             "(caminho, estacao_id, ano, tamanho, modificado, hash, carregado) "
+                             "values (?, ?, ?, ?, ?, ?, ?)",
+                             (caminho, estacao_id, ano, tamanho, modificado, hash_do_arquivo, carregado))
+
+        self.cnx.commit()
+        logger.info(f'{len(alterados)} arquivo(s) novo(s) ou alterado(s)')
+
+        # os resumos não permitem subtrair os dados removidos: as estações de arquivos alterados são recalculadas
+        self.update_climatologia(sorted(removidas))
 
     @cronometro
     def read_historical_data(self):
@@ -77,15 +229,13 @@ class Integrador:
         """
 
         # mapeamento de estações cadastradas:
-        # a query retorna apenas as estações cadastradas para cidades em percurso de rota e sem dados climáticos
-        # populados em banco
-        query = ("select distinct de.estacao_id, e.localidade, de.ano, de.arquivo from dados_estacoes de " +
+        # a query retorna apenas os arquivos de estações cadastradas para cidades em percurso de rota e que ainda
+        # não foram carregados (novos ou alterados, segundo o manifesto)
+        query = ("select distinct m.caminho, m.estacao_id, e.localidade, m.ano from manifesto m " +
                  "inner join cidades c using (estacao_id) " +
                  "inner join estacoes e using (estacao_id) " +
-                 "left join dados_metereologicos dm on " +
-                 "  (de.estacao_id = dm.estacao_id and de.ano = strftime('%Y', dm.timestamp)) " +
-                 "where dm.estacao_id is null " +
-                 "order by de.ano")
+                 "where not m.carregado " +
+                 "order by m.ano")
 
         estacoes_procuradas = self.cnx.execute(query).fetchall()
 
@@ -94,34 +244,162 @@ class Integrador:
             logger.info('Finalizando leitura. Não há necessidade de atualização de estações!')
             return
 
-        # mapeamento de ordem de colunas desejadas:
-        mapping = {0: 'data', 1: 'hora', 7: 'temperatura', 9: 't_max', 10: 't_min', 13: 'u_max', 14: 'u_min',
-                   15: 'umidade'}
-
         # leitura de arquivos do INMET:
-        for arquivo in estacoes_procuradas:
-            estacao_id, localidade, ano, filename = arquivo
+        arquivos = []
+        for caminho, estacao_id, localidade, ano in estacoes_procuradas:
+            if not os.path.exists(os.path.join(self.data_path, caminho)):
+                logger.info(f'({estacao_id}) {localidade} ({ano}): arquivo inexistente no diretório do projeto! '
+                            f'Pulando...')
+                continue
 
-            logger.info(f'Processando: ({estacao_id}) {localidade} ({ano})')
+            arquivos += [(caminho, estacao_id, f'({estacao_id}) {localidade} ({ano})')]
 
-            caminho = os.path.join(self.data_path, str(ano), filename)
-            if not os.path.exists(caminho):
-                logger.info(f'Arquivo inexistente no diretório do projeto! Pulando...')
-                continue
+        self.write_dados_metereologicos(self.get_lotes(arquivos))
+
+    @cronometro
+    def update_cubo(self):
+        """
+        Gera novamente o cubo climático quando ele ainda não existe ou quando a carga alterou os dados
+        """
+        if self.caminho_cubo is None or get_cubo(self.cnx, self.caminho_cubo) is not None:
+            return
+
+        write_cubo(self.cnx, self.caminho_cubo)
+
+    def get_lotes(self, arquivos):
+        """
+        Lê e trata os arquivos do INMET, em um pool de processos quando 'workers' > 1
+
+        No máximo dois arquivos por processo ficam em andamento ao mesmo tempo, de forma que a memória não depende
+        da quantidade de arquivos. Os lotes são entregues na ordem dos arquivos.
+
+        :param arquivos: lista de (caminho, estação, descrição) dos arquivos a serem lidos
+        :return:         gerador de (caminho, conjunto de dados tratado), um por arquivo
+        """
+        if self.workers <= 1:
+            for caminho, estacao_id, descricao in arquivos:
+                logger.info(f'Processando: {descricao}')
+                yield caminho, read_arquivo_inmet(os.path.join(self.data_path, caminho), estacao_id)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pendentes = deque()
+
+            for caminho, estacao_id, descricao in arquivos:
+                logger.info(f'Processando: {descricao}')
+                pendentes.append((caminho, executor.submit(read_arquivo_inmet, os.path.join(self.data_path, caminho),
+                                                           estacao_id)))
+
+                if len(pendentes) >= 2 * self.workers:
+                    caminho, futuro = pendentes.popleft()
+                    yield caminho, futuro.result()
+
+            while pendentes:
+                caminho, futuro = pendentes.popleft()
+                yield caminho, futuro.result()
+
+    def write_dados_metereologicos(self, lotes):
+        """
+        Único escritor da carga: grava os lotes com 'executemany' em transações grandes
+
+        O arquivo é marcado como carregado no manifesto e os seus resumos são somados à 'climatologia' na mesma
+        transação em que os seus dados são gravados.
+
+        :param lotes: gerador de (caminho, conjunto de dados tratado)
+        """
+        insert = (f"insert into dados_metereologicos ({', '.join(COLUNAS)}) "
+                  f"values ({', '.join('?' * len(COLUNAS))})")
+
+        inicio = time.time()
+        linhas, linhas_na_transacao = 0, 0
+
+        with pragmas_temporarios(self.cnx, {**PRAGMAS_DE_CARGA, **self.pragmas}):
+            try:
+                for caminho, df in lotes:
+                    self.cnx.executemany(insert, df[COLUNAS].itertuples(index=False, name=None))
+                    write_climatologia(self.cnx, get_resumos(df))
+                    self.cnx.execute("update manifesto set carregado = 1 where caminho = ?", (caminho,))
+
+                    contar('arquivos_lidos')
+                    contar('linhas_gravadas', len(df))
+
+                    linhas += len(df)
+                    linhas_na_transacao += len(df)
+
+                    if linhas_na_transacao >= LINHAS_POR_TRANSACAO:
+                        self.cnx.commit()
+                        linhas_na_transacao = 0
+
+                        logger.info(f'{linhas} linhas gravadas '
+                                    f'({linhas / (time.time() - inicio):.0f} linhas/segundo)')
+
+                self.cnx.commit()
+            except Exception:
+                # os arquivos do lote com erro continuam pendentes no manifesto e são lidos novamente na próxima carga
+                self.cnx.rollback()
+                raise
+
+        logger.info(f'Carga finalizada: {linhas} linhas gravadas '
+                    f'({linhas / max(time.time() - inicio, 1e-9):.0f} linhas/segundo)')
+
+
+def get_hash_do_arquivo(caminho, tamanho_do_bloco=1 << 20):
+    """
+    :param caminho:          caminho do arquivo
+    :param tamanho_do_bloco: quantidade de bytes lidos por vez
+    :return:                 hash SHA-1 do conteúdo do arquivo
+    """
+    hash_do_arquivo = hashlib.sha1()
+
+    with open(caminho, 'rb') as file:
+        for bloco in iter(lambda: file.read(tamanho_do_bloco), b''):
+            hash_do_arquivo.update(bloco)
+
+    return hash_do_arquivo.hexdigest()
+
+
+def get_intervalo_do_arquivo(ano):
+    """
+    Os arquivos anuais do INMET estão em UTC: após a conversão para GMT-3, as três primeiras horas do ano ficam
+    no dia 31/12 do ano anterior
+
+    :param ano: ano do arquivo
+    :return:    intervalo [início, fim) dos timestamps gravados a partir do arquivo
+    """
+    return f'{ano - 1}-12-31 21:00:00', f'{ano}-12-31 21:00:00'
+
+
+def read_arquivo_inmet(caminho, estacao_id):
+    """
+    Lê e trata um arquivo anual de uma estação automática do INMET
+
+    :param caminho:    caminho do arquivo
+    :param estacao_id: código da estação
+    :return:           dados meteorológicos no formato da tabela 'dados_metereologicos'
+    """
+    # mapeamento de ordem de colunas desejadas:
+    mapping = {0: 'data', 1: 'hora', 7: 'temperatura', 9: 't_max', 10: 't_min', 13: 'u_max', 14: 'u_min',
+               15: 'umidade'}
+
+    df = (pd.read_csv(caminho, delimiter=';', header=8, usecols=mapping.keys(), names=mapping.values(),
+                      encoding='windows-1252', na_values=[-9999])
+          .assign(estacao_id=estacao_id, timestamp=lambda row: row['data'] + " " + row['hora'].str[:2] + ":00"))
+
+    for coluna in ['temperatura', 't_max', 't_min']:
+        df[coluna] = pd.to_numeric(df[coluna].fillna("").str.replace(',', '.', regex=False), errors='coerce')
 
-            df = (pd.read_csv(caminho, delimiter=';', header=8, usecols=mapping.keys(), names=mapping.values(),
-                              encoding='windows-1252', na_values=[-9999])
-                  .assign(estacao_id=estacao_id, timestamp=lambda row: row['data'] + " " + row['hora'].str[:2] + ":00"))
+    # TODO: tratar valores NA de temperatura e umidade...
 
-            for coluna in ['temperatura', 't_max', 't_min']:
-                df[coluna] = pd.to_numeric(df[coluna].fillna("").str.replace(',', '.', regex=False), errors='coerce')
+    # converte UTC para GMT-3
+    df['timestamp'] = pd.to_datetime(df['timestamp']) + pd.offsets.Hour(-3)
 
-            # TODO: tratar valores NA de temperatura e umidade...
+    df.drop(columns=['data', 'hora'], inplace=True)
 
-            # converte UTC para GMT-3
-            df['timestamp'] = pd.to_datetime(df['timestamp']) + pd.offsets.Hour(-3)
+    # chaves de calendário para a consulta por janela de dias do ano (ver 'db/indexes.sql')
+    df['dia_do_ano'] = get_dia_do_ano(df['timestamp'])
+    df['hora'] = df['timestamp'].dt.hour
+    df['timestamp'] = df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
 
-            df.drop(columns=['data', 'hora'], inplace=True)
-            df.dropna(subset=['temperatura', 't_max', 't_min', 'umidade', 'u_max', 'u_min'], how='all', inplace=True)
+    df.dropna(subset=['temperatura', 't_max', 't_min', 'umidade', 'u_max', 'u_min'], how='all', inplace=True)
 
-            df.to_sql('dados_metereologicos', self.cnx, if_exists='append', index=False)
+    return df
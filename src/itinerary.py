@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+from src.utils import MINUTOS_NO_ANO
+
+
+# caminhoneiros são obrigados legalmente a parar 30 minutos a cada 5h30 de viagem
+LIMITE_DE_DIRECAO = 5 * 60 + 30
+PARADA_DE_DESCANSO = 30
+
+# caminhoneiros são obrigados legalmente a parar por 8 horas ininterruptas após 24h de viagem
+LIMITE_DIARIO = 24 * 60
+PARADA_DIARIA = 8 * 60
+
+# atrasos sorteados limitados ao quantil de 99,9% da distribuição de cada trecho: as células alcançadas com os atrasos
+# máximos delimitam as distribuições ajustadas (ver 'get_guia_de_alcance')
+QUANTIL_DO_ATRASO = 0.999
+
+
+def get_saidas(primeiro_dia, intervalo=60, primeira_hora=6, ultima_hora=18):
+    """
+    Possíveis horários de saída em horários comerciais
+
+    :param primeiro_dia:  data de início da rota (00:00)
+    :param intervalo:     intervalo entre saídas consecutivas (minutos)
+    :param primeira_hora: horário da primeira saída
+    :param ultima_hora:   horário da última saída (inclusivo)
+    :return:              lista de horários de saída
+    """
+    return [primeiro_dia + timedelta(minutes=minuto)
+            for minuto in range(primeira_hora * 60, ultima_hora * 60 + 1, intervalo)]
+
+
+def get_sequencia_de_trechos(itinerario, origem, destino):
+    """
+    Ordena os trechos da rota, encadeando o destino de cada trecho à origem do próximo
+
+    :param itinerario: trechos da rota (tabela 'transit_time')
+    :param origem:     cidade de origem da rota
+    :param destino:    cidade de destino da rota
+    :return:           trechos na ordem em que são percorridos
+    """
+    proximo = dict(zip(itinerario['origem'], itinerario.index))
+    sequencia = []
+
+    while origem != destino:
+        if origem not in proximo or len(sequencia) == len(itinerario):
+            raise ValueError(f"Itinerário incompleto: não há trecho partindo da cidade {origem}")
+
+        sequencia += [proximo[origem]]
+        origem = itinerario.at[proximo[origem], 'destino']
+
+    return itinerario.loc[sequencia].reset_index(drop=True)
+
+
+def get_tempos_de_trecho(transit_time):
+    """
+    Calcula o início e o fim de cada trecho em minutos após a saída, incluindo as paradas obrigatórias
+
+    As paradas dependem apenas do tempo acumulado de viagem, e não do horário de saída, então o resultado
+    serve para todos os horários de saída da rota. Com uma matriz (cenários x trechos), as paradas de todos os
+    cenários são resolvidas de uma só vez, trecho a trecho.
+
+    :param transit_time: tempo de trânsito de cada trecho, na ordem do percurso (minutos), ou matriz com o tempo de
+                         trânsito de cada cenário (linhas) e trecho (colunas)
+    :return:             vetores (ou matrizes) com o início e o fim de cada trecho (minutos após a saída)
+    """
+    transit_time = np.asarray(transit_time)
+    tipo = np.result_type(transit_time, int)
+
+    inicio = np.zeros(transit_time.shape, dtype=tipo)
+    fim = np.zeros(transit_time.shape, dtype=tipo)
+
+    relogio, horas_de_viagem, dias_de_viagem = [np.zeros(transit_time.shape[:-1], dtype=tipo) for _ in range(3)]
+
+    for trecho in range(transit_time.shape[-1]):
+        transito = transit_time[..., trecho]
+
+        inicio[..., trecho] = relogio
+        relogio = relogio + transito
+
+        horas_de_viagem = horas_de_viagem + transito
+        dias_de_viagem = dias_de_viagem + transito
+
+        descanso = horas_de_viagem >= LIMITE_DE_DIRECAO
+        relogio = relogio + descanso * PARADA_DE_DESCANSO
+        horas_de_viagem = np.where(descanso, 0, horas_de_viagem)
+        dias_de_viagem = dias_de_viagem + descanso * PARADA_DE_DESCANSO
+
+        diaria = dias_de_viagem >= LIMITE_DIARIO
+        relogio = relogio + diaria * PARADA_DIARIA
+        horas_de_viagem = np.where(diaria, 0, horas_de_viagem)
+        dias_de_viagem = np.where(diaria, 0, dias_de_viagem)
+
+        fim[..., trecho] = relogio
+
+    return inicio, fim
+
+
+def get_alcance_dos_trechos(transit_time, atraso_maximo):
+    """
+    Janela em que o veículo pode estar em cada trecho quando os atrasos são sorteados: do início sem atrasos ao fim
+    com o atraso máximo de todos os trechos
+
+    :param transit_time:  tempo de trânsito de cada trecho, na ordem do percurso (minutos)
+    :param atraso_maximo: maior atraso sorteado em cada trecho (minutos)
+    :return:              vetores com o menor início e o maior fim de cada trecho (minutos após a saída)
+    """
+    inicio, fim = get_tempos_de_trecho(transit_time)
+    inicio_atrasado, fim_atrasado = get_tempos_de_trecho(transit_time + atraso_maximo)
+
+    # as paradas obrigatórias podem mudar de trecho com os atrasos: os dois percursos delimitam a janela
+    return np.minimum(inicio, inicio_atrasado), np.maximum(fim, fim_atrasado)
+
+
+def get_quadro_de_horarios(trechos, saidas):
+    """
+    Quadro de horários de todas as saídas de uma vez: como os tempos de trecho não dependem do horário de saída,
+    basta somar a saída (linhas) aos tempos de cada trecho (colunas)
+
+    :param trechos: trechos ordenados com as colunas 'inicio' e 'fim' (minutos após a saída)
+    :param saidas:  horários de saída
+    :return:        matrizes (saídas x trechos) com os horários de início e fim de cada trecho
+    """
+    saidas = np.array(saidas, dtype='datetime64[m]')[:, np.newaxis]
+
+    inicio = saidas + trechos['inicio'].values.astype('timedelta64[m]')
+    fim = saidas + trechos['fim'].values.astype('timedelta64[m]')
+
+    return inicio, fim
+
+
+def get_guia_de_horarios(trechos, saidas):
+    """
+    Associa cada faixa de uma hora após a saída ao trecho em que o veículo se encontra durante toda a faixa
+
+    As faixas são definidas em relação à saída, logo o mapeamento faixa -> trecho é calculado uma única vez
+    e replicado para todas as saídas (sem produto cartesiano entre faixas e trechos)
+
+    :param trechos: trechos ordenados com as colunas 'origem', 'inicio' e 'fim' (minutos após a saída)
+    :param saidas:  horários de saída
+    :return:        uma linha por saída e faixa horária, com a cidade e a duração do trecho correspondente
+    """
+    inicio, fim = trechos['inicio'].values, trechos['fim'].values
+
+    # somamos 2 para finalizar com o horário "acima" do último
+    # por exemplo: se o trajeto termina às 14h, queremos que o guia vá até às 15h
+    # para que quando o merge seja feito com dm, os dados de 14h sejam inclusos
+    # porque hora do dado meteorológico <= hora de passagem
+    hora_maxima = int(fim.max() // 60)
+    fim_da_faixa = np.arange(1, hora_maxima + 2) * 60
+    inicio_da_faixa = fim_da_faixa - 60
+
+    # o único trecho que pode conter a faixa inteira é o primeiro que termina depois dela
+    trecho = np.minimum(np.searchsorted(fim, fim_da_faixa, side='left'), len(trechos) - 1)
+    contida = (inicio_da_faixa >= inicio[trecho]) & (fim_da_faixa <= fim[trecho])
+
+    trecho = trecho[contida]
+    inicio_da_faixa = inicio_da_faixa[contida].astype('timedelta64[m]')
+    fim_da_faixa = fim_da_faixa[contida].astype('timedelta64[m]')
+
+    saidas = np.array(saidas, dtype='datetime64[ns]')
+    faixas = len(trecho)
+
+    return pd.DataFrame({'saida': np.repeat(saidas, faixas),
+                         'inicio': (saidas[:, np.newaxis] + inicio_da_faixa).ravel(),
+                         'fim': (saidas[:, np.newaxis] + fim_da_faixa).ravel(),
+                         'origem': np.tile(trechos['origem'].values[trecho], len(saidas)),
+                         'duracao': np.tile((fim - inicio)[trecho].astype(int), len(saidas))})
+
+
+def get_guia_de_alcance(trechos, saidas):
+    """
+    Guia de horários com os atrasos sorteados: cada faixa de uma hora após a saída é associada a todos os trechos
+    que podem contê-la em algum cenário ('get_alcance_dos_trechos'), e não apenas ao trecho do percurso sem atrasos.
+    As distribuições são ajustadas para todas as células alcançáveis, e cada cenário usa apenas as que percorre
+    ('get_duracoes_por_cenario').
+
+    :param trechos: trechos ordenados com as colunas 'origem', 'inicio', 'fim', 'inicio_minimo' e 'fim_maximo'
+                    (minutos após a saída)
+    :param saidas:  horários de saída
+    :return:        guia no formato de 'get_guia_de_horarios', com a duração do trecho sem atrasos
+    """
+    primeira = (-(-trechos['inicio_minimo'].values // 60)).astype(int)
+    quantidade = np.maximum(trechos['fim_maximo'].values // 60 - primeira, 0).astype(int)
+
+    trecho = np.repeat(np.arange(len(trechos)), quantidade)
+    ordem = np.arange(len(trecho)) - np.repeat(np.cumsum(quantidade) - quantidade, quantidade)
+    inicio_da_faixa = ((primeira[trecho] + ordem) * 60).astype('timedelta64[m]')
+
+    saidas = np.array(saidas, dtype='datetime64[ns]')
+    faixas = len(trecho)
+    duracao = (trechos['fim'].values - trechos['inicio'].values).astype(int)
+
+    return pd.DataFrame({'saida': np.repeat(saidas, faixas),
+                         'inicio': (saidas[:, np.newaxis] + inicio_da_faixa).ravel(),
+                         'fim': (saidas[:, np.newaxis] + inicio_da_faixa + np.timedelta64(60, 'm')).ravel(),
+                         'origem': np.tile(trechos['origem'].values[trecho], len(saidas)),
+                         'duracao': np.tile(duracao[trecho], len(saidas))})
+
+
+def get_horas_do_alcance(trechos, fora_da_hora):
+    """
+    :param trechos:      trechos ordenados com as colunas 'inicio_minimo' e 'fim_maximo' (minutos após a saída)
+    :param fora_da_hora: a saída não é em hora cheia (cada faixa tem uma única observação, ao fim da primeira hora
+                         cheia, em vez das observações do início e do fim da faixa)
+    :return:             trecho e hora (horas cheias após a hora da saída) de cada observação alcançável
+    """
+    primeira = (-(-trechos['inicio_minimo'].values // 60)).astype(int) + int(fora_da_hora)
+    quantidade = np.maximum(trechos['fim_maximo'].values // 60 - primeira + 1, 0).astype(int)
+
+    trecho = np.repeat(np.arange(len(trechos)), quantidade)
+    ordem = np.arange(len(trecho)) - np.repeat(np.cumsum(quantidade) - quantidade, quantidade)
+
+    return trecho, primeira[trecho] + ordem
+
+
+def get_duracoes_por_cenario(inicio, fim, trecho, hora, fora_da_hora):
+    """
+    Versão por cenário da guia de horários, sem laço pelos cenários: a observação de uma hora pertence ao trecho em
+    um cenário quando alguma faixa de uma hora após a saída contida no trecho a inclui, no mesmo critério de
+    'get_guia_de_horarios' e 'get_observacoes_da_guia'
+
+    :param inicio:       matriz (cenários x trechos) com o início de cada trecho (minutos após a saída)
+    :param fim:          matriz (cenários x trechos) com o fim de cada trecho (minutos após a saída)
+    :param trecho:       trecho de cada observação avaliada
+    :param hora:         hora de cada observação avaliada (horas cheias após a hora da saída)
+    :param fora_da_hora: a saída não é em hora cheia (ver 'get_horas_do_alcance')
+    :return:             matriz (observações x cenários) com a duração do trecho nos cenários em que o veículo passa
+                         pela observação, e zero nos demais
+    """
+    # faixas contidas no trecho: da primeira hora após o início à última antes do fim
+    primeira = -(-inicio[:, trecho] // 60)
+    ultima = fim[:, trecho] // 60
+
+    passa = (ultima > primeira) & (primeira + int(fora_da_hora) <= hora) & (hora <= ultima)
+
+    return np.where(passa, fim[:, trecho] - inicio[:, trecho], 0).T
+
+
+def get_observacoes_da_guia(guia_de_horarios):
+    """
+    Minutos do ano das observações horárias contidas em cada faixa da guia (extremos inclusos), para que o
+    cruzamento com os dados meteorológicos seja uma junção por (cidade, minuto) em vez de um produto entre as faixas
+    e todas as horas da janela. As faixas que viram o ano seguem o calendário circular de minutos do ano.
+
+    :param guia_de_horarios: guia com as colunas 'minuto_inicio' e 'minuto_fim' (ver 'get_minuto_do_ano')
+    :return:                 uma linha por faixa e observação, com a coluna 'minuto'
+    """
+    inicio = guia_de_horarios['minuto_inicio'].values
+    comprimento = (guia_de_horarios['minuto_fim'].values - inicio) % MINUTOS_NO_ANO
+
+    # primeira hora cheia a partir do início da faixa e quantidade de horas cheias até o fim
+    primeira = -inicio % 60
+    quantidade = np.where(primeira <= comprimento, (comprimento - primeira) // 60 + 1, 0)
+
+    faixa = np.repeat(np.arange(len(guia_de_horarios)), quantidade)
+    ordem = np.arange(len(faixa)) - np.repeat(np.cumsum(quantidade) - quantidade, quantidade)
+
+    return guia_de_horarios.iloc[faixa].assign(minuto=(inicio[faixa] + primeira[faixa] + 60 * ordem) % MINUTOS_NO_ANO)
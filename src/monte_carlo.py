@@ -1,37 +1,83 @@
 import numpy as np
-from distfit import distfit
+from scipy import stats
+from scipy.stats import qmc
+
+from src.utils import logger
 
 
 SIZE = 1000
+SEED = None
+
+# métodos de ajuste disponíveis em 'best_fit_distribution'
+METODOS_DE_AJUSTE = ['distfit', 'nativo', 'validacao', 'resumo']
+
+# assimetria a partir da qual a localização da gama é limitada pelo método dos momentos (ver 'get_estimadores')
+ASSIMETRIA_MINIMA = 1e-2
+
+# estratégias de amostragem de 'Amostrador' (as três últimas geram os cenários pela inversa da distribuição acumulada)
+AMOSTRAGENS = ['aleatoria', 'antitetica', 'hipercubo', 'sobol']
+
+
+def get_gerador(seed=SEED, *chaves):
+    """
+    Cria o gerador de números aleatórios utilizado por toda a simulação
+
+    As chaves (por exemplo, o ID da rota) são combinadas à semente para que cada unidade de trabalho tenha uma
+    sequência própria e reprodutível, independente da ordem em que as rotas são processadas
+
+    :param seed:   semente da simulação (None para uma sequência não reprodutível)
+    :param chaves: identificadores inteiros combinados à semente
+    :return:       gerador de números aleatórios
+    """
+    if seed is None:
+        return np.random.default_rng()
+
+    return np.random.default_rng([seed, *chaves])
 
 
-def normal_transformation(loc, scale):
+def _gerador(rng):
+    return rng if rng is not None else np.random.default_rng()
+
+
+def normal_transformation(loc, scale, size=SIZE, rng=None, uniformes=None):
     """
     Geração de números aleatórios conforme a Distribuição Normal
 
     Referência de implementação: Banks, 2010, p. 343
 
-    :param loc:   média da distribuição
-    :param scale: variância da distribuição
-    :return:      números aleatórios
+    :param loc:       média da distribuição
+    :param scale:     variância da distribuição
+    :param size:      quantidade de números gerados (ou formato da matriz de saída)
+    :param rng:       gerador de números aleatórios
+    :param uniformes: números uniformes em (0, 1) transformados pela inversa da distribuição (substituem o gerador)
+    :return:          números aleatórios
     """
-    return np.random.default_rng().normal(loc=loc, scale=scale, size=SIZE)
+    if uniformes is not None:
+        return stats.norm.ppf(uniformes, loc=loc, scale=scale)
+
+    return _gerador(rng).normal(loc=loc, scale=scale, size=size)
 
 
-def expon_transformation(scale, shape):  # noqa
+def expon_transformation(scale, shape, size=SIZE, rng=None, uniformes=None):  # noqa
     """
     Geração de números aleatórios conforme a Distribuição Exponencial
 
     Referência de implementação: Banks, 2010, p. 319
 
-    :param scale: taxa média entre chegadas
-    :param shape: não é utilizado
-    :return:      números aleatórios
+    :param scale:     taxa média entre chegadas
+    :param shape:     não é utilizado
+    :param size:      quantidade de números gerados (ou formato da matriz de saída)
+    :param rng:       gerador de números aleatórios
+    :param uniformes: números uniformes em (0, 1) transformados pela inversa da distribuição (substituem o gerador)
+    :return:          números aleatórios
     """
-    return np.random.default_rng().exponential(scale=scale, size=SIZE)
+    if uniformes is not None:
+        return -scale * np.log(1 - uniformes)
 
+    return _gerador(rng).exponential(scale=scale, size=size)
 
-def gamma_transformation(shape, loc, scale):
+
+def gamma_transformation(shape, loc, scale, size=SIZE, rng=None, uniformes=None):
     """
     Geração de números aleatórios conforme a Distribuição Gama
 
@@ -39,12 +85,18 @@ def gamma_transformation(shape, loc, scale):
         Banks, 2010, p. 340     - shape >= 1
         Law, 2015, p. 455       - shape < 1
 
-    :param shape: beta
-    :param loc:   localização da distribuição
-    :param scale: alpha
-    :return:      números aleatórios
+    :param shape:     beta
+    :param loc:       localização da distribuição
+    :param scale:     alpha
+    :param size:      quantidade de números gerados (ou formato da matriz de saída)
+    :param rng:       gerador de números aleatórios
+    :param uniformes: números uniformes em (0, 1) transformados pela inversa da distribuição (substituem o gerador)
+    :return:          números aleatórios
     """
-    return np.random.default_rng().gamma(shape=shape, scale=scale, size=SIZE) + loc
+    if uniformes is not None:
+        return stats.gamma.ppf(uniformes, shape, loc=loc, scale=scale)
+
+    return _gerador(rng).gamma(shape=shape, scale=scale, size=size) + loc
 
 
 def beta_transformation(a, b, loc, scale):  # noqa
@@ -63,35 +115,44 @@ def beta_transformation(a, b, loc, scale):  # noqa
     pass
 
 
-def triang_transformation(lower, upper, mode):
+def triang_transformation(c, loc, scale, size=SIZE, rng=None, uniformes=None):
     """
     Geração de números aleatórios conforme a Distribuição Triangular
 
-    Referência de implementação:
+    Os parâmetros seguem a ordem do scipy (e, portanto, do distfit e de 'get_estimadores'): o triângulo vai de
+    'loc' a 'loc + scale', com o pico em 'loc + c * scale'
 
-    :param lower: valor à esquerda (ponta do triângulo)
-    :param upper: valor à direita (ponta do triângulo)
-    :param mode:  valor central (pico do triângulo)
+    :param c:         posição relativa do pico (entre 0 e 1)
+    :param loc:       valor à esquerda (ponta do triângulo)
+    :param scale:     largura do triângulo
+    :param size:      quantidade de números gerados (ou formato da matriz de saída)
+    :param rng:       gerador de números aleatórios
+    :param uniformes: números uniformes em (0, 1) transformados pela inversa da distribuição (substituem o gerador)
     :return: números aleatórios
     """
-    # consistência: por algum motivo, existem distribuições ajustadas com mode > upper
-    if mode > upper:
-        mode, upper = upper, mode
+    if uniformes is not None:
+        return stats.triang.ppf(uniformes, c, loc=loc, scale=scale)
 
-    return np.random.default_rng().triangular(left=lower, mode=mode, right=upper, size=SIZE)
+    return _gerador(rng).triangular(left=loc, mode=loc + c * scale, right=loc + scale, size=size)
 
 
-def uniform_transformation(loc, scale):
+def uniform_transformation(loc, scale, size=SIZE, rng=None, uniformes=None):
     """
     Geração de números aleatórios conforme a Distribuição Uniforme
 
     Referência de implementação: Banks, 2010, p. 321
 
-    :param loc:   valor mínimo da distribuição
-    :param scale: tamanho do intervalo entre os pontos mínimo e máximo
-    :return:      números aleatórios
+    :param loc:       valor mínimo da distribuição
+    :param scale:     tamanho do intervalo entre os pontos mínimo e máximo
+    :param size:      quantidade de números gerados (ou formato da matriz de saída)
+    :param rng:       gerador de números aleatórios
+    :param uniformes: números uniformes em (0, 1) transformados pela inversa da distribuição (substituem o gerador)
+    :return:          números aleatórios
     """
-    return np.random.default_rng().uniform(low=loc, high=loc + scale, size=SIZE)
+    if uniformes is not None:
+        return loc + scale * uniformes
+
+    return _gerador(rng).uniform(low=loc, high=loc + scale, size=size)
 
 
 # Mapeamento para chamada em 'simulate.py'
@@ -103,18 +164,256 @@ DIST_x_FUNC = {'norm':      normal_transformation,
                'uniform':   uniform_transformation}
 
 
-def best_fit_distribution(data):
+class Amostrador:
+    def __init__(self, dimensao, amostragem='aleatoria', rng=None):
+        """
+        Gera os números uniformes que alimentam a inversa das distribuições ajustadas, uma dimensão por célula e
+        medida, de modo que cada cenário é um ponto do hipercubo unitário:
+            - aleatoria:  sem números uniformes (cada transformação usa diretamente o gerador)
+            - antitetica: metade dos cenários com U e a outra metade com 1 - U
+            - hipercubo:  hipercubo latino (cada dimensão tem exatamente um cenário em cada estrato de 1 / n)
+            - sobol:      sequência de Sobol embaralhada (lotes em potências de 2 preservam o balanceamento)
+
+        Chamadas sucessivas geram novos lotes; na sequência de Sobol, os lotes continuam a mesma sequência.
+
+        :param dimensao:   quantidade de dimensões (células x medidas)
+        :param amostragem: estratégia de amostragem (ver 'AMOSTRAGENS')
+        :param rng:        gerador de números aleatórios (também embaralha a sequência de Sobol)
+        """
+        if amostragem not in AMOSTRAGENS:
+            raise ValueError(f"Amostragem desconhecida: {amostragem} (opções: {', '.join(AMOSTRAGENS)})")
+
+        self.dimensao = dimensao
+        self.amostragem = amostragem
+        self.rng = _gerador(rng)
+        self.sobol = qmc.Sobol(d=dimensao, scramble=True, seed=self.rng) if amostragem == 'sobol' else None
+
+    def get_uniformes(self, size):
+        """
+        :param size: quantidade de cenários do lote
+        :return:     matriz (dimensões x cenários) de números uniformes em (0, 1), ou None na amostragem aleatória
+        """
+        if self.amostragem == 'aleatoria':
+            return None
+
+        if self.amostragem == 'antitetica':
+            metade = self.rng.random((self.dimensao, (size + 1) // 2))
+            uniformes = np.hstack([metade, 1 - metade])[:, :size]
+        elif self.amostragem == 'hipercubo':
+            estratos = self.rng.permuted(np.tile(np.arange(size), (self.dimensao, 1)), axis=1)
+            uniformes = (estratos + self.rng.random((self.dimensao, size))) / size
+        else:
+            uniformes = self.sobol.random(size).T
+
+        # a inversa de distribuições ilimitadas (normal, gama) diverge nos extremos 0 e 1
+        return np.clip(uniformes, np.finfo(float).eps, 1 - np.finfo(float).eps)
+
+
+def simulate_batch(dist_names, params, size=SIZE, rng=None, uniformes=None):
     """
-    Função responsável por avaliar a distribuição com melhor ajuste aos conjuntos de dados, considerando
-    o método SSE para as distribuições disponíveis em 'DIST_x_FUNC'
+    Geração vetorizada de números aleatórios para um lote de células (saída, cidade, hora) de uma só vez
+
+    As células são agrupadas pela família de distribuição ajustada e cada família é amostrada em uma única
+    chamada ao gerador, com os parâmetros em formato de coluna (células x 1) para o broadcasting do NumPy
+
+    :param dist_names: nome da distribuição ajustada de cada célula
+    :param params:     lista de parâmetros da distribuição ajustada de cada célula
+    :param size:       quantidade de cenários por célula
+    :param rng:        gerador de números aleatórios compartilhado por todo o lote
+    :param uniformes:  matriz (células x cenários) de números uniformes de 'Amostrador' (None para o gerador)
+    :return:           matriz (células x cenários) de números aleatórios
+    """
+    rng = _gerador(rng)
+    amostras = np.full((len(dist_names), size), np.nan)
+
+    familias = {}
+    for celula, dist_name in enumerate(dist_names):
+        familias.setdefault(dist_name, []).append(celula)
+
+    for dist_name, celulas in familias.items():
+        if dist_name not in DIST_x_FUNC:
+            logger.info(f"Falha no método de transformação de {dist_name}")
+            continue
+
+        # cada linha de 'parametros' é um parâmetro da distribuição, em formato de coluna para as células
+        parametros = np.array([params[celula] for celula in celulas], dtype=float).T[:, :, np.newaxis]
+        amostras[celulas] = DIST_x_FUNC[dist_name](*parametros, size=(len(celulas), size), rng=rng,
+                                                   uniformes=None if uniformes is None else uniformes[celulas])
+
+    return amostras
+
+
+def get_quantis(dist_names, params, quantil):
+    """
+    :param dist_names: nome de cada distribuição (ver 'DIST_x_FUNC')
+    :param params:     lista de parâmetros de cada distribuição, na ordem de parâmetros do scipy
+    :param quantil:    probabilidade acumulada
+    :return:           quantil de cada distribuição
+    """
+    return np.array([getattr(stats, dist_name).ppf(quantil, *parametros)
+                     for dist_name, parametros in zip(dist_names, params)], dtype=float)
+
+
+def get_estimadores(data):
+    """
+    Estimadores de forma fechada (ou quase) dos parâmetros de cada distribuição de 'DIST_x_FUNC', na mesma ordem
+    de parâmetros do scipy (e, portanto, do distfit)
+
+        norm:    média e desvio padrão (máxima verossimilhança)
+        gamma:   localização pelo método dos momentos (assimetria), limitada ao mínimo da amostra, e forma/escala
+                 pela aproximação de Minka para a máxima verossimilhança (omitida quando a aproximação não tem
+                 solução)
+        triang:  extremos pelas estatísticas de ordem e moda pelo método dos momentos
+        uniform: extremos pelas estatísticas de ordem (máxima verossimilhança)
 
     :param data: conjunto de dados avaliado
-    :return:     a melhor distribuição ajustada e seus parâmetros
+    :return:     parâmetros estimados para cada distribuição
+    """
+    media, desvio = data.mean(), data.std()
+
+    return get_estimadores_de_momentos(len(data), media, desvio, ((data - media) ** 3).mean() / desvio ** 3,
+                                       data.min(), data.max(), lambda loc: np.log(data - loc).mean())
+
+
+def get_estimadores_de_momentos(n, media, desvio, assimetria, minimo, maximo, media_do_log):
+    """
+    Estimadores de 'get_estimadores' a partir das estatísticas da amostra, calculadas das observações ou de um
+    resumo ('src/climatology.py')
+
+    :param n:            quantidade de observações
+    :param media:        média
+    :param desvio:       desvio padrão
+    :param assimetria:   coeficiente de assimetria
+    :param minimo:       menor observação
+    :param maximo:       maior observação
+    :param media_do_log: função que devolve a média de log(x - loc) para um deslocamento 'loc'
+    :return:             parâmetros estimados para cada distribuição
     """
+    amplitude = maximo - minimo
+
+    estimadores = {'norm': (media, desvio)}
+
+    # gama: a localização precisa ficar abaixo do menor valor observado (em amostras quase simétricas, o limite pela
+    # assimetria levaria a localização a -infinito)
+    loc = minimo - amplitude / n
+    if assimetria > ASSIMETRIA_MINIMA:
+        loc = min(loc, media - 2 * desvio / assimetria)
+
+    # sem s > 0, a aproximação de Minka não tem solução e a gama não é candidata
+    s = np.log(media - loc) - media_do_log(loc)
+    if s > 0:
+        forma = (3 - s + np.sqrt((s - 3) ** 2 + 24 * s)) / (12 * s)
+        estimadores['gamma'] = (forma, loc, (media - loc) / forma)
+
+    # triangular: média = (mínimo + moda + máximo) / 3
+    moda = np.clip(3 * media - minimo - maximo, minimo, maximo)
+
+    estimadores['triang'] = ((moda - minimo) / amplitude, minimo, amplitude)
+    estimadores['uniform'] = (minimo, amplitude)
+
+    return estimadores
+
+
+def fit_nativo(data):
+    """
+    Alternativa ao distfit: estima os parâmetros de forma fechada e ordena as distribuições pelo mesmo critério
+    (SSE entre o histograma da amostra, com sqrt(n) intervalos, e a densidade de cada distribuição)
+
+    :param data: conjunto de dados avaliado
+    :return:     a melhor distribuição ajustada e a lista de seus parâmetros
+    """
+    data = np.asarray(data, dtype=float)
+
+    # amostra constante: qualquer distribuição degenera em um único valor
+    if data.min() == data.max():
+        return 'norm', [data.mean(), 0.0]
+
+    densidade, limites = np.histogram(data, bins=int(np.sqrt(len(data))), density=True)
+    centros = (limites[:-1] + limites[1:]) / 2
+
+    return get_melhor_estimador(get_estimadores(data), densidade, centros)
+
+
+def fit_resumo(resumo):
+    """
+    Ajuste pelo método 'nativo' a partir do resumo das observações ('src/climatology.py'): média, desvio,
+    assimetria e extremos são exatos; a média do logaritmo (gama) e o histograma do critério SSE vêm dos intervalos
+    fixos do resumo
+
+    :param resumo: resumo das observações de uma célula
+    :return:       a melhor distribuição ajustada e a lista de seus parâmetros
+    """
+    if resumo.minimo == resumo.maximo:
+        return 'norm', [resumo.media, 0.0]
+
+    densidade, centros = resumo.get_densidade()
+    estimadores = get_estimadores_de_momentos(resumo.n, resumo.media, resumo.desvio, resumo.assimetria,
+                                              resumo.minimo, resumo.maximo, resumo.get_media_do_log)
+
+    return get_melhor_estimador(estimadores, densidade, centros)
+
+
+def get_melhor_estimador(estimadores, densidade, centros):
+    """
+    :param estimadores: parâmetros estimados para cada distribuição
+    :param densidade:   densidade do histograma da amostra
+    :param centros:     centro de cada intervalo do histograma
+    :return:            a distribuição de menor SSE entre o histograma e a sua densidade, e a lista de parâmetros
+    """
+    with np.errstate(all='ignore'):
+        pdfs = np.vstack([getattr(stats, dist_name).pdf(centros, *params) for dist_name, params in estimadores.items()])
+    sse = np.nan_to_num(((densidade - pdfs) ** 2).sum(axis=1), nan=np.inf)
+
+    dist_name = list(estimadores)[int(np.argmin(sse))]
+
+    return dist_name, [float(param) for param in estimadores[dist_name]]
+
+
+def fit_distfit(data):
+    """
+    :param data: conjunto de dados avaliado
+    :return:     a melhor distribuição ajustada pelo distfit e a lista de seus parâmetros
+    """
+    # pacote opcional, importado apenas no primeiro ajuste pelo distfit (os demais métodos não dependem dele)
+    try:
+        from distfit import distfit
+    except ImportError:
+        raise ImportError("O método de ajuste 'distfit' depende do pacote opcional 'distfit' "
+                          "(os métodos 'nativo' e 'resumo' não dependem dele)") from None
 
     distributions_to_fit = list(DIST_x_FUNC.keys())
 
     dist = distfit(distr=distributions_to_fit, bins=int(np.sqrt(len(data))))
     results = dist.fit_transform(data, verbose=0)['model']
 
-    return results['name'], ','.join(map(str, results['params']))
+    return results['name'], list(results['params'])
+
+
+def best_fit_distribution(data, metodo='distfit'):
+    """
+    Função responsável por avaliar a distribuição com melhor ajuste aos conjuntos de dados, considerando
+    o método SSE para as distribuições disponíveis em 'DIST_x_FUNC'
+
+    :param data:   conjunto de dados avaliado (um resumo das observações no método 'resumo')
+    :param metodo: 'distfit' (otimização genérica do scipy), 'nativo' (estimadores de forma fechada),
+                   'validacao' (ajusta pelos dois métodos, registra as divergências e retorna o do distfit) ou
+                   'resumo' (estimadores de forma fechada a partir de um resumo, ver 'fit_resumo')
+    :return:       a melhor distribuição ajustada e seus parâmetros
+    """
+    if metodo == 'nativo':
+        dist_name, params = fit_nativo(data)
+
+    elif metodo == 'resumo':
+        dist_name, params = fit_resumo(data)
+
+    elif metodo == 'validacao':
+        dist_name, params = fit_distfit(data)
+        dist_nativo, params_nativo = fit_nativo(data)
+
+        if dist_name != dist_nativo:
+            logger.info(f"Validação do ajuste: distfit = {dist_name} {params} / nativo = {dist_nativo} {params_nativo}")
+
+    else:
+        dist_name, params = fit_distfit(data)
+
+    return dist_name, ','.join(map(str, params))
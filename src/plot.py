@@ -1,11 +1,125 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
+import os
+
+import numpy as np
 import pandas as pd
 
-from src.utils import cronometro
+from src.profiling import cronometro
+
+# matplotlib e seaborn são importados no primeiro gráfico: apenas os agregados não dependem deles, e a importação
+# leva perto de um segundo
 
 configs = {"palette": "Paired", "linewidth": 1.25}
 
+# medidas apresentadas nos boxplots e os limites do eixo y
+LIMITES_BOXPLOT = {
+    'score': (0, 10),
+    'temperatura': (-5, 45),
+    'umidade': (-5, 105)
+}
+MEDIDAS_EXPOSICAO = ['temperatura', 'umidade']
+
+# outliers desenhados por horário de saída (os demais não alteram a leitura do gráfico)
+MAXIMO_DE_OUTLIERS = 200
+
+# diretório padrão dos gráficos gravados em arquivo, com um subdiretório por rota (relativo ao diretório do banco de
+# dados, ver 'Simulador')
+CAMINHO_GRAFICOS = 'graficos'
+
+
+def get_estatisticas_boxplot(simulated_df, medida):
+    """
+    Calcula as estatísticas de cada caixa do boxplot (quartis, bigodes de 1,5 IQR e outliers) por horário de saída,
+    no formato de 'Axes.bxp', para que o gráfico não precise dos dados simulados
+
+    :param simulated_df: conjunto de dados simulados (com a coluna 'hora' do horário de saída)
+    :param medida:       medida avaliada
+    :return:             estatísticas de cada horário de saída
+    """
+    estatisticas = []
+
+    for hora, valores in simulated_df.groupby('hora')[medida]:
+        valores = np.sort(valores.dropna().values)
+        q1, mediana, q3 = np.quantile(valores, [0.25, 0.5, 0.75])
+        iqr = q3 - q1
+
+        dentro = valores[(valores >= q1 - 1.5 * iqr) & (valores <= q3 + 1.5 * iqr)]
+        outliers = valores[(valores < q1 - 1.5 * iqr) | (valores > q3 + 1.5 * iqr)]
+
+        if len(outliers) > MAXIMO_DE_OUTLIERS:
+            outliers = outliers[np.linspace(0, len(outliers) - 1, MAXIMO_DE_OUTLIERS).astype(int)]
+
+        estatisticas += [{'label': hora, 'q1': q1, 'med': mediana, 'q3': q3,
+                          'whislo': dentro.min(), 'whishi': dentro.max(), 'fliers': outliers}]
+
+    return estatisticas
+
+
+def get_exposicao(simulated_df, medida, faixas=5):
+    """
+    Calcula a fração do tempo de viagem de cada horário de saída em faixas de mesma largura da medida
+
+    :param simulated_df: conjunto de dados simulados (com as colunas 'saida' e 'duracao')
+    :param medida:       medida avaliada
+    :param faixas:       quantidade de faixas entre o menor e o maior valor simulado
+    :return:             frações de exposição (horários de saída x faixas)
+    """
+    simulated_df = simulated_df[simulated_df[medida].notna()]
+
+    valores = simulated_df[medida].values
+    limites = np.linspace(valores.min(), valores.max(), faixas + 1)
+    rotulos = [f'({inicio:.1f}, {fim:.1f}]' for inicio, fim in zip(limites[:-1], limites[1:])]
+
+    faixa = np.clip(np.searchsorted(limites, valores, side='left') - 1, 0, faixas - 1)
+
+    exposicao = (simulated_df.assign(faixa=pd.Categorical.from_codes(faixa, categories=rotulos))
+                 .groupby(['saida', 'faixa'])['duracao'].sum()
+                 .unstack(fill_value=0))
+    exposicao = exposicao.div(exposicao.sum(axis=1), axis=0)
+    exposicao.index = pd.to_datetime(exposicao.index).strftime("%H:%M")
+
+    return exposicao
+
+
+def get_agregados(simulated_df):
+    """
+    :param simulated_df: conjunto de dados simulados de uma rota
+    :return:             agregados de todos os gráficos da rota, indexados por (tipo de gráfico, medida)
+    """
+    agregados = {('boxplot', medida): get_estatisticas_boxplot(simulated_df, medida) for medida in LIMITES_BOXPLOT}
+    agregados.update({('exposicao', medida): get_exposicao(simulated_df, medida) for medida in MEDIDAS_EXPOSICAO})
+
+    return agregados
+
+
+def draw_boxplot(ax, estatisticas, medida):
+    import seaborn as sns
+
+    caixas = ax.bxp(estatisticas, patch_artist=True, flierprops={'markersize': 2},
+                    boxprops={'linewidth': configs['linewidth']}, medianprops={'color': 'black'})
+
+    for caixa, cor in zip(caixas['boxes'], sns.color_palette(configs['palette'], len(estatisticas))):
+        caixa.set_facecolor(cor)
+
+    ax.set_xlabel("Horário de saída")
+    ax.set_ylabel(medida.capitalize())
+    ax.set_ylim(LIMITES_BOXPLOT[medida])
+
+
+def draw_exposicao(ax, exposicao, medida):
+    from matplotlib.ticker import PercentFormatter
+
+    exposicao.plot(kind='barh', stacked=True, ax=ax)
+
+    ax.set_title(f"Exposição para {medida}")
+    ax.set_ylabel("Horário de saída")
+    ax.set_xlabel("Exposição")
+
+    ax.legend(title=f"Faixas de {medida}", loc='center left', bbox_to_anchor=(1.01, 0.5))
+    ax.xaxis.set_major_formatter(PercentFormatter(1.0))
+
+
+DESENHOS = {'boxplot': draw_boxplot, 'exposicao': draw_exposicao}
+
 
 @cronometro
 def get_boxplot(simulated_df):
@@ -15,22 +129,12 @@ def get_boxplot(simulated_df):
     :param simulated_df: conjunto de dados simulados.
     :return: gráfico de boxplot.
     """
+    import matplotlib.pyplot as plt
 
-    # medidas a serem apresentadas no gráfico e os limites do eixo y
-    plots = {
-        'score': (0, 100),
-        'temperatura': (-5, 45),
-        'umidade': (-5, 105)
-    }
-
-    for medida in list(plots.keys()):
+    for medida in LIMITES_BOXPLOT:
         fig, ax = plt.subplots(figsize=(8, 6), constrained_layout=True)
-        sns.boxplot(x='hora', y=medida, data=simulated_df, ax=ax, whis=1.5, fliersize=2, **configs)
-
-        plt.xlabel("Horário de saída")
-        plt.ylabel(medida.capitalize())
+        draw_boxplot(ax, get_estatisticas_boxplot(simulated_df, medida), medida)
 
-        plt.ylim(plots[medida])
         plt.show()
 
 
@@ -42,36 +146,57 @@ def get_duracao_de_medidas(simulated_df):
     :param simulated_df: conjunto de dados simulados.
     :return: gráfico de barras empilhadas.
     """
+    import matplotlib.pyplot as plt
 
-    for medida in ['temperatura', 'umidade']:
-        intervalos = pd.cut(simulated_df[medida], bins=5)
+    for medida in MEDIDAS_EXPOSICAO:
+        fig, ax = plt.subplots(figsize=(8, 6), constrained_layout=True)
+        draw_exposicao(ax, get_exposicao(simulated_df, medida), medida)
 
-        # criando os grupos
-        df = simulated_df.groupby(by=['saida', intervalos]).agg({'duracao': 'sum'}).reset_index()
-        totais = simulated_df.groupby(by=['saida']).agg({'duracao': 'sum'})
+        plt.show()
 
-        # calculando a frequência
-        df = df.merge(totais, on='saida', suffixes=('', '_total'))
-        df['frequencia'] = df['duracao'] / df['duracao_total']
-        df = df.drop(columns=['duracao', 'duracao_total'])
 
-        # formatando para stacked bar plot
-        df['saida'] = df['saida'].dt.strftime("%H:%M")
-        df = df.set_index(['saida', medida])['frequencia']
+def render_grafico(arquivo, tipo, medida, agregado):
+    """
+    Desenha um gráfico em arquivo sem o pyplot (sem backend interativo nem estado global), o que permite
+    desenhar vários gráficos ao mesmo tempo em processos diferentes
+
+    :param arquivo:  caminho do arquivo de imagem
+    :param tipo:     tipo de gráfico ('boxplot' ou 'exposicao')
+    :param medida:   medida avaliada
+    :param agregado: agregado do gráfico calculado por 'get_agregados'
+    :return:         caminho do arquivo de imagem
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 6), constrained_layout=True)
+    DESENHOS[tipo](fig.subplots(), agregado, medida)
+    fig.savefig(arquivo)
+
+    return arquivo
 
-        fig, ax = plt.subplots(figsize=(8, 6), constrained_layout=True)
-        df.unstack().plot(kind='barh', stacked=True, ax=ax)
 
-        plt.title(f"Exposição para {medida}")
-        plt.ylabel("Horário de saída")
-        plt.xlabel("Exposição")
+@cronometro
+def render_graficos(agregados_por_rota, caminho=CAMINHO_GRAFICOS, executor=None):
+    """
+    Grava todos os gráficos das rotas em 'caminho/rota_<id>/<tipo>_<medida>.png', em paralelo entre rotas e medidas
+    quando há um pool de processos
 
-        ax.legend(title=f"Faixas de {medida}")
-        ax.legend(loc='center left', bbox_to_anchor=(1.01, 0.5))
+    :param agregados_por_rota: agregados de 'get_agregados' de cada rota
+    :param caminho:            diretório base dos gráficos
+    :param executor:           pool de processos (None para desenhar em sequência)
+    :return:                   caminhos dos arquivos gravados
+    """
+    tarefas = []
 
-        ax.set_xticklabels(['{:,.2%}'.format(x) for x in ax.get_xticks()])
+    for rota_id, agregados in agregados_por_rota.items():
+        os.makedirs(os.path.join(caminho, f'rota_{rota_id}'), exist_ok=True)
 
-        plt.show()
+        tarefas += [(os.path.join(caminho, f'rota_{rota_id}', f'{tipo}_{medida}.png'), tipo, medida, agregado)
+                    for (tipo, medida), agregado in agregados.items()]
+
+    mapear = executor.map if executor is not None else map
+
+    return list(mapear(render_grafico, *zip(*tarefas))) if tarefas else []
 
 
 def get_linha_do_tempo(simulated_df):
@@ -87,6 +212,9 @@ def get_linha_do_tempo(simulated_df):
     :param simulated_df: conjunto de dados simulados.
     :return: linha do tempo.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     df = (simulated_df.groupby(by=['rota_id', 'saida', 'hora'])
           .agg({'temperatura': 'mean', 'umidade': 'mean'})
           .reset_index()
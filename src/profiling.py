@@ -0,0 +1,195 @@
+import json
+import time
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+from src.utils import logger
+
+
+class Perfil:
+    def __init__(self):
+        """
+        Registro de trechos (intervalos de execução aninhados, como rota -> etapa -> lote) e contadores de uma
+        execução. Desligado por padrão: 'trecho' e 'contar' não fazem nada até 'enable'.
+
+        Cada trecho guarda o início (relógio do sistema, comparável entre processos), a duração, os contadores
+        incrementados enquanto era o trecho mais interno e, com 'memoria', o pico de memória alocada (tracemalloc).
+        """
+        self.ativo = False
+        self.memoria = False
+        self.registros = []
+        self.abertos = []
+        self.contadores = {}
+
+    def enable(self, memoria=False):
+        """
+        Liga o registro, descartando os trechos e contadores anteriores
+
+        :param memoria: registra o pico de memória de cada trecho (o tracemalloc deixa a execução mais lenta)
+        """
+        self.ativo, self.memoria = True, memoria
+        self.registros, self.abertos, self.contadores = [], [], {}
+
+        if memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.ativo = False
+
+        if self.memoria and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def abrir(self, nome, atributos):
+        pai = self.abertos[-1] if self.abertos else None
+
+        if self.memoria:
+            # o pico é reiniciado a cada trecho: o pico do trecho externo até aqui é guardado antes
+            if pai is not None:
+                pai['memoria_pico'] = max(pai['memoria_pico'] or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        registro = {'id': len(self.registros), 'pai': None if pai is None else pai['id'], 'nivel': len(self.abertos),
+                    'nome': nome, 'atributos': atributos, 'inicio': time.time(), 'duracao': None,
+                    'memoria_pico': None, 'contadores': {}, '_relogio': time.perf_counter()}
+
+        self.registros.append(registro)
+        self.abertos.append(registro)
+
+        return registro
+
+    def fechar(self, registro):
+        registro['duracao'] = time.perf_counter() - registro.pop('_relogio')
+        self.abertos.pop()
+
+        if self.memoria:
+            registro['memoria_pico'] = max(registro['memoria_pico'] or 0, tracemalloc.get_traced_memory()[1])
+
+            if self.abertos:
+                self.abertos[-1]['memoria_pico'] = max(self.abertos[-1]['memoria_pico'] or 0,
+                                                       registro['memoria_pico'])
+
+    def contar(self, contador, quantidade):
+        quantidade = int(quantidade)
+        self.contadores[contador] = self.contadores.get(contador, 0) + quantidade
+
+        if self.abertos:
+            contadores = self.abertos[-1]['contadores']
+            contadores[contador] = contadores.get(contador, 0) + quantidade
+
+    def incorporar(self, registros, contadores):
+        """
+        Adiciona os trechos e contadores registrados em outro processo (ver 'src/scheduler.py'), abaixo do trecho
+        aberto no momento
+
+        :param registros:  trechos concluídos do outro processo
+        :param contadores: contadores totais do outro processo
+        """
+        deslocamento = len(self.registros)
+        pai = self.abertos[-1] if self.abertos else None
+
+        for registro in registros:
+            self.registros.append(dict(registro, id=registro['id'] + deslocamento,
+                                       pai=(registro['pai'] + deslocamento if registro['pai'] is not None
+                                            else None if pai is None else pai['id']),
+                                       nivel=registro['nivel'] + len(self.abertos)))
+
+        for contador, quantidade in contadores.items():
+            self.contadores[contador] = self.contadores.get(contador, 0) + quantidade
+
+    def get_trechos(self):
+        """
+        :return: um trecho concluído por linha, com o início em segundos desde o primeiro trecho e um contador
+                 por coluna
+        """
+        concluidos = [registro for registro in self.registros if registro['duracao'] is not None]
+        primeiro = min((registro['inicio'] for registro in concluidos), default=0)
+
+        trechos = pd.DataFrame([{**{chave: valor for chave, valor in registro.items() if chave != 'contadores'},
+                                 'inicio': registro['inicio'] - primeiro, **registro['contadores']}
+                                for registro in concluidos],
+                               columns=['id', 'pai', 'nivel', 'nome', 'atributos', 'inicio', 'duracao', 'memoria_pico',
+                                        *self.contadores])
+
+        return trechos.astype({'pai': 'Int64', **{contador: 'Int64' for contador in self.contadores}})
+
+    def write(self, caminho):
+        """
+        :param caminho: arquivo do registro ('.json' com os trechos aninhados e os contadores totais, ou '.csv' com
+                        um trecho por linha)
+        """
+        trechos = self.get_trechos()
+
+        if caminho.lower().endswith('.csv'):
+            trechos.assign(atributos=trechos['atributos'].map(json.dumps)).to_csv(caminho, index=False)
+        else:
+            with open(caminho, 'w') as file:
+                json.dump({'trechos': json.loads(trechos.to_json(orient='records')), 'contadores': self.contadores},
+                          file, indent=2, default=str)
+
+        logger.info(f"Perfil da execução gravado em '{caminho}' ({len(trechos)} trechos)")
+
+
+# registro único do processo (cada processo de um pool tem o seu)
+perfil = Perfil()
+
+_NULO = nullcontext()
+
+
+@contextmanager
+def _trecho(nome, atributos):
+    registro = perfil.abrir(nome, atributos)
+    try:
+        yield registro
+    finally:
+        perfil.fechar(registro)
+
+
+def trecho(nome, **atributos):
+    """
+    Delimita um trecho da execução (uso: 'with trecho("lote", lote=3): ...')
+
+    :param nome:      nome do trecho
+    :param atributos: identificação do trecho (rota, saída, medida...)
+    :return:          gerenciador de contexto (sem efeito com o registro desligado)
+    """
+    if not perfil.ativo:
+        return _NULO
+
+    return _trecho(nome, atributos)
+
+
+def contar(contador, quantidade=1):
+    """
+    :param contador:   nome do contador (ajustes, cenários, linhas lidas, acertos do cache...)
+    :param quantidade: incremento
+    """
+    if perfil.ativo:
+        perfil.contar(contador, quantidade)
+
+
+def cronometro(func):
+    """
+    Função de suporte para a contagem de tempo gasta em cada parte do sistema: registra a duração no log e, com o
+    perfil ligado, um trecho com o nome da função. O retorno da função é preservado.
+
+    :param func: função a ser medida
+    :return: empacotamento do cronometro
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        inicio = time.time()
+
+        if perfil.ativo:
+            with _trecho(func.__name__, {}):
+                resultado = func(*args, **kwargs)
+        else:
+            resultado = func(*args, **kwargs)
+
+        logger.info(f"'{func.__name__}' ({(time.time() - inicio):.4f} segundos)")
+
+        return resultado
+
+    return wrapper
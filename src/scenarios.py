@@ -0,0 +1,255 @@
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from src.storage import Escrita, get_caminho_junto_ao_banco
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # o armazenamento em Parquet é opcional
+    pa, pq = None, None
+
+
+# diretório padrão dos armazenamentos em arquivo, particionados por rota e horário de saída (relativo ao diretório
+# do banco de dados, ver 'get_armazem')
+CAMINHO_CENARIOS = 'cenarios'
+
+# diretório (dentro do diretório base) dos lotes gravados e ainda não confirmados pela escrita da rota
+PREPARACAO = '.preparacao'
+
+# tipos das colunas de cenários nos armazenamentos em arquivo ('hora' em minutos desde a meia-noite)
+TIPOS = {'hora': np.int16, 'cidade_id': np.int32, 'duracao': np.int32, 'cenario': np.int32,
+         'temperatura': np.float32, 'umidade': np.float32}
+
+COLUNAS = ['rota_id', 'saida', 'hora', 'cidade_id', 'duracao', 'cenario', 'temperatura', 'umidade']
+
+
+class ArmazemSQLite:
+    def __init__(self, cnx, escrita=None):
+        """
+        Armazena os cenários simulados na tabela 'simulacoes' (adequado para rotas pequenas)
+
+        :param cnx:     conexão com o banco de dados local
+        :param escrita: destino das escritas (por padrão, a própria conexão)
+        """
+        self.cnx = cnx
+        self.escrita = escrita if escrita is not None else Escrita(cnx)
+
+    def clear(self, rota_id, saidas=None):
+        """
+        :param rota_id: identificador da rota
+        :param saidas:  horários de saída removidos (None para todos os cenários da rota)
+        """
+        filtro = '' if saidas is None else f" and saida in ({', '.join('?' * len(saidas))})"
+
+        self.escrita.execute(f"delete from simulacoes where rota_id = ?{filtro}",
+                             (rota_id, *[str(saida) for saida in saidas or []]))
+        self.escrita.commit()
+
+    def write(self, rota_id, saida, cenarios, lote=0):
+        """
+        :param rota_id:  identificador da rota
+        :param saida:    horário de saída
+        :param cenarios: cenários simulados do horário de saída (colunas de 'COLUNAS', exceto rota e saída)
+        :param lote:     número do lote de cenários (lotes de uma mesma saída são gravados em sequência)
+        """
+        self.escrita.append('simulacoes', cenarios.assign(rota_id=rota_id, saida=str(pd.Timestamp(saida)))[COLUNAS])
+
+    def get_saidas(self, rota_id):
+        return sorted(pd.to_datetime([saida for saida, in self.cnx.execute(
+            "select distinct saida from simulacoes where rota_id = ?", (rota_id,))]))
+
+    def read(self, rota_id, saidas=None):
+        """
+        :param rota_id: identificador da rota
+        :param saidas:  horários de saída lidos (None para todos)
+        :return:        cenários simulados da rota
+        """
+        filtro = '' if saidas is None else f" and saida in ({', '.join('?' * len(saidas))})"
+
+        return pd.read_sql(f"select * from simulacoes where rota_id = ?{filtro}", self.cnx,
+                           params=[rota_id, *[str(saida) for saida in saidas or []]], parse_dates=['saida'])
+
+
+class ArmazemNumpy:
+    def __init__(self, caminho, escrita):
+        """
+        Armazena os cenários simulados em arquivos '.npy' tipados, um por coluna, em diretórios por rota, saída e
+        lote de cenários: 'caminho/rota_<id>/<AAAAMMDD_HHMM>/<lote>/<coluna>.npy'
+
+        A leitura usa arquivos mapeados em memória, sem conversão de texto nem cópia prévia dos dados.
+
+        Como as escritas no banco, as gravações e remoções acompanham a escrita da rota: cada lote é gravado em
+        'PREPARACAO' e movido para o seu diretório apenas no commit (no processo escritor, na execução em paralelo),
+        de forma que uma rota com falha não altera os cenários já armazenados. Até lá, as leituras já consideram as
+        operações pendentes da rota.
+
+        :param caminho: diretório base dos cenários
+        :param escrita: destino das operações em arquivo ('src/storage.py')
+        """
+        self.caminho = caminho
+        self.escrita = escrita
+
+    def get_caminho(self, rota_id, saida=None):
+        caminho = os.path.join(self.caminho, f'rota_{rota_id}')
+
+        if saida is not None:
+            caminho = os.path.join(caminho, pd.Timestamp(saida).strftime('%Y%m%d_%H%M'))
+
+        return caminho
+
+    def get_preparacao(self, extensao=''):
+        """
+        :param extensao: extensão do arquivo preparado (vazia para um diretório)
+        :return:         caminho único em 'PREPARACAO', no mesmo sistema de arquivos dos cenários
+        """
+        os.makedirs(os.path.join(self.caminho, PREPARACAO), exist_ok=True)
+
+        return os.path.join(self.caminho, PREPARACAO, uuid.uuid4().hex + extensao)
+
+    def clear(self, rota_id, saidas=None):
+        if saidas is None:
+            self.escrita.remove(self.get_caminho(rota_id))
+            return
+
+        for saida in saidas:
+            self.escrita.remove(self.get_caminho(rota_id, saida))
+
+    def write(self, rota_id, saida, cenarios, lote=0):
+        caminho = self.get_preparacao()
+        os.makedirs(caminho)
+
+        for coluna, colunas in get_colunas_tipadas(cenarios).items():
+            np.save(os.path.join(caminho, f'{coluna}.npy'), colunas)
+
+        self.escrita.move(caminho, os.path.join(self.get_caminho(rota_id, saida), f'{lote:04d}'))
+
+    def read_saida(self, rota_id, saida):
+        """
+        :param rota_id: identificador da rota
+        :param saida:   horário de saída
+        :return:        colunas mapeadas em memória (somente leitura) dos cenários do horário de saída
+                        (saídas gravadas em vários lotes são concatenadas)
+        """
+        lotes = self.get_lotes(rota_id, saida)
+        colunas = {coluna: [np.load(os.path.join(lote, f'{coluna}.npy'), mmap_mode='r') for lote in lotes]
+                   for coluna in TIPOS}
+
+        return {coluna: partes[0] if len(partes) == 1 else np.concatenate(partes)
+                for coluna, partes in colunas.items()}
+
+    def get_lotes(self, rota_id, saida):
+        """
+        :return: lotes armazenados do horário de saída, com as operações pendentes da escrita aplicadas
+        """
+        caminho = self.get_caminho(rota_id, saida)
+        lotes = {lote: os.path.join(caminho, lote) for lote in os.listdir(caminho)} if os.path.isdir(caminho) else {}
+
+        for operacao, origem, *destino in self.escrita.get_arquivos():
+            if operacao == 'remove' and (caminho == origem or caminho.startswith(origem + os.sep)):
+                lotes = {}
+            elif operacao == 'move' and os.path.dirname(destino[0]) == caminho:
+                lotes[os.path.basename(destino[0])] = origem
+
+        return [lotes[lote] for lote in sorted(lotes)]
+
+    def get_saidas(self, rota_id):
+        caminho = self.get_caminho(rota_id)
+        saidas = set(os.listdir(caminho)) if os.path.isdir(caminho) else set()
+
+        for operacao, origem, *destino in self.escrita.get_arquivos():
+            if operacao == 'remove' and origem == caminho:
+                saidas = set()
+            elif operacao == 'remove' and os.path.dirname(origem) == caminho:
+                saidas.discard(os.path.basename(origem))
+            elif operacao == 'move' and os.path.dirname(os.path.dirname(destino[0])) == caminho:
+                saidas.add(os.path.basename(os.path.dirname(destino[0])))
+
+        return sorted(pd.to_datetime(sorted(saidas), format='%Y%m%d_%H%M'))
+
+    def read(self, rota_id, saidas=None):
+        saidas = self.get_saidas(rota_id) if saidas is None else [pd.Timestamp(saida) for saida in saidas]
+
+        return pd.concat([get_cenarios(rota_id, saida, self.read_saida(rota_id, saida)) for saida in saidas]
+                         or [pd.DataFrame(columns=COLUNAS)], ignore_index=True)
+
+
+class ArmazemParquet(ArmazemNumpy):
+    def __init__(self, caminho, escrita):
+        """
+        Armazena os cenários simulados em um arquivo Parquet por rota, saída e lote de cenários:
+        'caminho/rota_<id>/<AAAAMMDD_HHMM>/<lote>.parquet' (depende do pacote opcional 'pyarrow'), com as mesmas
+        gravações preparadas de 'ArmazemNumpy'
+
+        :param caminho: diretório base dos cenários
+        :param escrita: destino das operações em arquivo ('src/storage.py')
+        """
+        if pq is None:
+            raise ImportError("O armazenamento em Parquet depende do pacote 'pyarrow'")
+
+        super().__init__(caminho, escrita)
+
+    def write(self, rota_id, saida, cenarios, lote=0):
+        caminho = self.get_preparacao('.parquet')
+        pq.write_table(pa.table(get_colunas_tipadas(cenarios)), caminho)
+
+        self.escrita.move(caminho, os.path.join(self.get_caminho(rota_id, saida), f'{lote:04d}.parquet'))
+
+    def read_saida(self, rota_id, saida):
+        tabela = pa.concat_tables([pq.read_table(lote, memory_map=True) for lote in self.get_lotes(rota_id, saida)])
+
+        return {coluna: tabela.column(coluna).to_numpy() for coluna in TIPOS}
+
+
+ARMAZENS = {'sqlite': ArmazemSQLite, 'numpy': ArmazemNumpy, 'parquet': ArmazemParquet}
+
+
+def get_armazem(nome, cnx, caminho=CAMINHO_CENARIOS, escrita=None):
+    """
+    :param nome:    tipo de armazenamento ('sqlite', 'numpy' ou 'parquet')
+    :param cnx:     conexão com o banco de dados local (utilizada pelo armazenamento em SQLite)
+    :param caminho: diretório base dos armazenamentos em arquivo (relativo ao diretório do banco de dados)
+    :param escrita: destino das escritas do armazenamento (por padrão, a própria conexão)
+    :return:        armazenamento de cenários
+    """
+    escrita = escrita if escrita is not None else Escrita(cnx)
+
+    if nome == 'sqlite':
+        return ArmazemSQLite(cnx, escrita)
+
+    return ARMAZENS[nome](get_caminho_junto_ao_banco(cnx, caminho), escrita)
+
+
+def get_colunas_tipadas(cenarios):
+    """
+    :param cenarios: cenários simulados de um horário de saída
+    :return:         colunas convertidas para os tipos de 'TIPOS' ('hora' de 'HH:MM:SS' para minutos)
+    """
+    codigos, horas = pd.factorize(cenarios['hora'].astype(str))
+    horas = (pd.to_timedelta(horas).total_seconds() // 60).to_numpy()[codigos]
+
+    return {coluna: (horas if coluna == 'hora' else cenarios[coluna].to_numpy()).astype(tipo)
+            for coluna, tipo in TIPOS.items()}
+
+
+def get_cenarios(rota_id, saida, colunas):
+    """
+    Monta o conjunto de dados de um horário de saída no mesmo formato da tabela 'simulacoes'
+
+    :param rota_id: identificador da rota
+    :param saida:   horário de saída
+    :param colunas: colunas tipadas dos cenários
+    :return:        cenários do horário de saída
+    """
+    minutos, codigos = np.unique(colunas['hora'], return_inverse=True)
+    horas = [f'{minuto // 60:02d}:{minuto % 60:02d}:00' for minuto in minutos]
+
+    cenarios = pd.DataFrame({coluna: valores for coluna, valores in colunas.items() if coluna != 'hora'})
+    cenarios.insert(0, 'hora', pd.Categorical.from_codes(codigos, categories=horas))
+    cenarios.insert(0, 'saida', pd.Timestamp(saida))
+    cenarios.insert(0, 'rota_id', rota_id)
+
+    return cenarios
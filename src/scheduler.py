@@ -0,0 +1,131 @@
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.utils import logger
+from src.profiling import perfil, trecho
+from src.simulate import Simulador
+from src.storage import EscritaAdiada, apply_escritas, connect, discard_arquivos
+
+
+# conexão de leitura de cada processo do pool (ver 'init_worker')
+_cnx = None
+
+
+class Escalonador:
+    def __init__(self, caminho, workers=2, maior_primeiro=True, rotas=None, pragmas=None, **opcoes):
+        """
+        Simula as rotas ativas em paralelo, uma rota por tarefa de um pool de processos
+
+        Cada processo tem a sua própria conexão, apenas de leitura, e registra as escritas da rota ('EscritaAdiada').
+        O processo principal é o único escritor: aplica as escritas de cada rota concluída em uma transação, com o
+        journal em WAL para que as leituras dos processos não sejam bloqueadas. A falha de uma rota é registrada
+        no relatório e não interrompe as demais, e nada da rota com falha é gravado.
+
+        Com o perfil ligado no processo principal ('src/profiling.py'), os processos também registram os seus
+        trechos e contadores, que são incorporados ao perfil principal a cada rota concluída.
+
+        :param caminho:        caminho do banco de dados local
+        :param workers:        quantidade de processos (rotas simuladas ao mesmo tempo)
+        :param maior_primeiro: inicia pelas rotas com maior tempo de trânsito, para que as rotas longas não fiquem
+                               para o final do lote
+        :param rotas:          identificadores das rotas simuladas (None para todas as rotas ativas)
+        :param pragmas:        PRAGMAs da conexão do escritor e das conexões de leitura dos processos ('connect')
+        :param opcoes:         parâmetros de 'Simulador' aplicados a todas as rotas
+        """
+        # cenários em SQLite só são gravados pelo escritor, depois da rota: a leitura dos resultados não os veria
+        # (e os gráficos são gravados em arquivo, já que não há quem feche as janelas nos processos)
+        opcoes.setdefault('armazem', 'numpy')
+        opcoes.setdefault('graficos', 'arquivo')
+        if opcoes['armazem'] == 'sqlite' and not opcoes.get('streaming', False):
+            raise ValueError("O armazenamento 'sqlite' depende do modo 'streaming' na execução em paralelo")
+
+        self.cnx = connect(caminho, pragmas)
+
+        rotas = [rota_id for rota_id in self.get_rotas(maior_primeiro) if rotas is None or rota_id in rotas]
+        logger.info(f"Simulando {len(rotas)} rotas com {workers} processos")
+
+        self.relatorio = []
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(caminho, pragmas, perfil.ativo, perfil.memoria)) as executor:
+                futuros = {executor.submit(simulate_rota, rota_id, opcoes): rota_id for rota_id in rotas}
+
+                for concluidas, futuro in enumerate(as_completed(futuros), start=1):
+                    self.write_rota(futuros[futuro], futuro)
+                    logger.info(f"Progresso: {concluidas}/{len(futuros)} rotas concluídas")
+        finally:
+            self.cnx.close()
+
+        self.relatorio = pd.DataFrame(self.relatorio, columns=['rota_id', 'status', 'segundos', 'melhor_saida', 'erro'])
+
+    def get_rotas(self, maior_primeiro):
+        """
+        :param maior_primeiro: ordena as rotas pelo tempo de trânsito total, da maior para a menor
+        :return:               identificadores das rotas ativas
+        """
+        ordem = "tempo desc, rotas.rota_id" if maior_primeiro else "rotas.rota_id"
+
+        return [rota_id for rota_id, _ in self.cnx.execute(
+            "select rotas.rota_id, coalesce(sum(transit_time.transit_time), 0) as tempo from rotas "
+            "left join transit_time on (transit_time.rota_id = rotas.rota_id) "
+            f"where rotas.ativo = 1 group by rotas.rota_id order by {ordem}")]
+
+    def write_rota(self, rota_id, futuro):
+        """
+        :param rota_id: identificador da rota
+        :param futuro:  tarefa concluída da rota
+        """
+        try:
+            operacoes, melhor_saida, segundos, trechos = futuro.result()
+
+            with trecho('escrita', rota_id=rota_id):
+                apply_escritas(self.cnx, operacoes)
+
+            if trechos is not None:
+                perfil.incorporar(*trechos)
+        except Exception as erro:  # noqa
+            logger.info(f"(Rota: {rota_id}) Falha: {erro!r}")
+            self.relatorio += [(rota_id, 'falha', None, None, repr(erro))]
+            return
+
+        logger.info(f"(Rota: {rota_id}) Concluída em {segundos:.1f} segundos ({len(operacoes)} escritas)")
+        self.relatorio += [(rota_id, 'ok', segundos, melhor_saida, None)]
+
+
+def init_worker(caminho, pragmas=None, perfilar=False, memoria=False):
+    global _cnx
+
+    _cnx = connect(caminho, pragmas, somente_leitura=True)
+
+    if perfilar:
+        perfil.enable(memoria)
+
+
+def simulate_rota(rota_id, opcoes):
+    """
+    Tarefa de um processo do pool: simula uma rota com a conexão de leitura do processo
+
+    :param rota_id: identificador da rota
+    :param opcoes:  parâmetros de 'Simulador'
+    :return:        escritas registradas, melhor horário de saída, duração da simulação (segundos) e, com o perfil
+                    ligado, os trechos e contadores da rota
+    """
+    inicio = time.time()
+    escrita = EscritaAdiada()
+
+    # cada tarefa devolve apenas o perfil da sua rota
+    if perfil.ativo:
+        perfil.enable(perfil.memoria)
+
+    simulador = Simulador(_cnx, rotas=[rota_id], escrita=escrita, **opcoes)
+
+    # rota com falha: nenhuma escrita é devolvida, e os arquivos preparados pelas etapas concluídas são descartados
+    if rota_id in simulador.falhas:
+        discard_arquivos(escrita.operacoes)
+        raise simulador.falhas[rota_id]
+
+    trechos = (perfil.registros, perfil.contadores) if perfil.ativo else None
+
+    return escrita.operacoes, simulador.melhores_saidas.get(rota_id), time.time() - inicio, trechos
@@ -0,0 +1,308 @@
+import json
+import time
+import signal
+import asyncio
+import pandas as pd
+from collections import Counter, OrderedDict, defaultdict
+from urllib.parse import parse_qs, urlsplit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from src.utils import logger
+from src.profiling import contar, perfil, trecho
+from src.scheduler import init_worker, simulate_rota
+from src.simulate import get_dias_do_horizonte
+from src.storage import apply_escritas, connect
+
+
+HOST = '127.0.0.1'
+PORTA = 8080
+
+# respostas mantidas em memória (as menos consultadas recentemente são descartadas)
+CAPACIDADE_DE_RESPOSTAS = 1024
+
+# colunas do ranking devolvido, as mesmas do comando 'report'
+COLUNAS_DO_RANKING = ['rota_id', 'origem', 'destino', 'ranking', 'saida', 'score', 'score_inferior',
+                      'score_superior', 'p05', 'p50', 'p95', 'cenarios']
+
+STATUS_HTTP = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+
+class ErroDeConsulta(Exception):
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class Servico:
+    def __init__(self, caminho, workers=2, capacidade=CAPACIDADE_DE_RESPOSTAS, pragmas=None, **opcoes):
+        """
+        Serviço local que responde, por HTTP, ao ranking dos horários de saída de uma rota em um dia (ou horizonte
+        de dias), mantendo em memória o que uma execução de 'main.py' refaz a cada vez:
+
+        - os processos do pool ficam abertos, com as bibliotecas científicas importadas e a conexão de leitura de
+          'src/scheduler.py' (e, com ela, o cache de páginas do banco, o cubo climático e o cache de distribuições);
+        - as respostas ficam em memória enquanto o banco não é alterado por outra conexão ('pragma data_version'),
+          e são devolvidas sem tocar nos processos;
+        - consultas idênticas simultâneas aguardam uma única simulação, e simulações da mesma rota são executadas
+          uma de cada vez, já que 'Simulador.write_resultados' substitui todos os resultados da rota.
+
+        Como em 'Escalonador', os processos apenas leem o banco: as escritas de cada simulação são aplicadas pelo
+        processo do serviço, o único escritor, com o journal em WAL. A conexão do serviço é criada e usada sempre em
+        uma mesma thread ('run_no_banco'), e não no laço de eventos: a escrita de uma simulação ou a leitura de um
+        ranking não bloqueiam as demais consultas.
+
+        :param caminho:    caminho do banco de dados local
+        :param workers:    quantidade de processos (simulações ao mesmo tempo)
+        :param capacidade: quantidade máxima de respostas mantidas em memória
+        :param pragmas:    PRAGMAs da conexão do serviço e das conexões de leitura dos processos ('connect')
+        :param opcoes:     parâmetros de 'Simulador' aplicados a todas as consultas
+        """
+        # sem gráficos e, por padrão, no modo 'streaming': apenas as estatísticas de cada saída são calculadas
+        opcoes.setdefault('streaming', True)
+        opcoes.setdefault('armazem', 'numpy')
+        opcoes['graficos'] = None
+        if opcoes['armazem'] == 'sqlite' and not opcoes['streaming']:
+            raise ValueError("O armazenamento 'sqlite' depende do modo 'streaming' no serviço")
+
+        self.opcoes = opcoes
+        self.capacidade = capacidade
+
+        self.banco = ThreadPoolExecutor(max_workers=1, thread_name_prefix='banco')
+        self.cnx = self.banco.submit(connect, caminho, pragmas).result()
+
+        self.respostas = OrderedDict()
+        self.em_andamento = {}
+        self.contagens = Counter()
+        self.travas = defaultdict(asyncio.Lock)
+
+        # os processos são iniciados (e aquecidos) antes da primeira consulta
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                            initargs=(caminho, pragmas, perfil.ativo, perfil.memoria))
+        wait([self.executor.submit(time.sleep, 0) for _ in range(workers)])
+
+    def close(self):
+        self.executor.shutdown()
+        self.banco.submit(self.cnx.close).result()
+        self.banco.shutdown()
+
+    async def run_no_banco(self, funcao, *args):
+        """
+        :param funcao: função que usa a conexão do serviço
+        :param args:   argumentos da função
+        :return:       resultado da função, executada na thread da conexão
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.banco, funcao, *args)
+
+    async def serve(self, host=HOST, porta=PORTA, socket=None):
+        """
+        :param host:   endereço do servidor HTTP
+        :param porta:  porta do servidor HTTP
+        :param socket: caminho de um socket Unix, no lugar do endereço e da porta
+        """
+        if socket is not None:
+            servidor = await asyncio.start_unix_server(self.handle, path=socket)
+            logger.info(f"Serviço disponível em '{socket}'")
+        else:
+            servidor = await asyncio.start_server(self.handle, host, porta)
+            logger.info(f"Serviço disponível em http://{host}:{porta}")
+
+        # encerra com Ctrl+C ou SIGTERM (no Windows, o Ctrl+C interrompe 'asyncio.run' diretamente)
+        parada = asyncio.Event()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sinal, parada.set)
+            except NotImplementedError:
+                pass
+
+        async with servidor:
+            await parada.wait()
+
+        logger.info("Serviço encerrado")
+
+    async def handle(self, reader, writer):
+        """
+        Atende uma requisição HTTP por conexão:
+
+            GET /melhor-saida?rota=1&data=2023-07-15[&ate=2023-07-20][&top=3]
+            GET /estado
+        """
+        inicio, linha = time.perf_counter(), []
+
+        try:
+            linha = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():
+                pass
+
+            if len(linha) < 2 or linha[0] != 'GET':
+                raise ErroDeConsulta(405, "Apenas requisições GET são aceitas")
+
+            url = urlsplit(linha[1])
+            parametros = {nome: valores[-1] for nome, valores in parse_qs(url.query).items()}
+
+            if url.path == '/melhor-saida':
+                status, corpo = 200, await self.get_melhor_saida(parametros)
+            elif url.path == '/estado':
+                status, corpo = 200, json.dumps(self.get_estado())
+            else:
+                raise ErroDeConsulta(404, f"Caminho desconhecido: {url.path}")
+        except ErroDeConsulta as erro:
+            status, corpo = erro.status, json.dumps({'erro': str(erro)}, ensure_ascii=False)
+        except Exception as erro:  # noqa
+            logger.info(f"Erro na consulta: {erro!r}")
+            status, corpo = 500, json.dumps({'erro': repr(erro)}, ensure_ascii=False)
+
+        corpo = corpo.encode()
+        writer.write(f"HTTP/1.1 {status} {STATUS_HTTP[status]}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(corpo)}\r\nConnection: close\r\n\r\n".encode() + corpo)
+
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+        self.contar('consultas')
+        logger.info(f"{' '.join(linha[:2]) if linha else '-'} -> {status} "
+                    f"({(time.perf_counter() - inicio) * 1000:.1f} ms)")
+
+    async def get_melhor_saida(self, parametros):
+        """
+        :param parametros: 'rota', 'data' (AAAA-MM-DD), 'ate' (último dia do horizonte) e 'top' (saídas por dia)
+        :return:           ranking das saídas da rota em JSON, no formato do comando 'report'
+        """
+        try:
+            rota_id = int(parametros['rota'])
+            data = str(pd.Timestamp(parametros['data']).date())
+            ate = str(pd.Timestamp(parametros['ate']).date()) if 'ate' in parametros else None
+            top = int(parametros['top']) if 'top' in parametros else None
+            get_dias_do_horizonte(pd.Timestamp(data), ate)
+        except KeyError as erro:
+            raise ErroDeConsulta(400, f"Parâmetro obrigatório ausente: {erro.args[0]}")
+        except ValueError as erro:
+            raise ErroDeConsulta(400, f"Parâmetro inválido: {erro}")
+
+        if not await self.run_no_banco(self.read_rota_ativa, rota_id):
+            raise ErroDeConsulta(404, f"Rota {rota_id} não encontrada ou inativa")
+
+        ranking = await self.get_ranking(rota_id, data, ate)
+        if top is not None:
+            ranking = ranking[ranking['ranking'] <= top]
+
+        return ranking.to_json(orient='records', force_ascii=False)
+
+    async def get_ranking(self, rota_id, data, ate):
+        """
+        Ranking em memória, se o banco não mudou desde que foi calculado; caso contrário, aguarda a simulação da
+        mesma consulta em andamento ou inicia uma nova
+
+        :param rota_id: identificador da rota
+        :param data:    dia dos horários de saída
+        :param ate:     último dia do horizonte de planejamento (None para apenas 'data')
+        :return:        ranking das saídas
+        """
+        chave = (rota_id, data, ate)
+
+        resposta = self.respostas.get(chave)
+        if resposta is not None and resposta[0] == await self.run_no_banco(self.get_versao):
+            self.respostas.move_to_end(chave)
+            self.contar('respostas_em_memoria')
+            return resposta[1]
+
+        if chave in self.em_andamento:
+            self.contar('consultas_agrupadas')
+        else:
+            tarefa = asyncio.ensure_future(self.simulate(rota_id, data, ate))
+            tarefa.add_done_callback(lambda _: self.em_andamento.pop(chave, None))
+            self.em_andamento[chave] = tarefa
+
+        # a simulação continua para as demais consultas mesmo que esta conexão seja encerrada
+        return await asyncio.shield(self.em_andamento[chave])
+
+    async def simulate(self, rota_id, data, ate):
+        """
+        :param rota_id: identificador da rota
+        :param data:    dia dos horários de saída
+        :param ate:     último dia do horizonte de planejamento
+        :return:        ranking das saídas, calculado em um processo do pool
+        """
+        async with self.travas[rota_id]:
+            versao = await self.run_no_banco(self.get_versao)
+            opcoes = {**self.opcoes, 'data_de_saida': data, 'data_final': ate}
+
+            operacoes, _, segundos, trechos = await asyncio.get_running_loop().run_in_executor(
+                self.executor, simulate_rota, rota_id, opcoes)
+
+            await self.run_no_banco(self.write_escritas, rota_id, operacoes)
+
+            if trechos is not None:
+                perfil.incorporar(*trechos)
+
+            self.contar('simulacoes')
+            logger.info(f"(Rota: {rota_id}) Simulada em {segundos:.1f} segundos ({len(operacoes)} escritas)")
+
+            ranking = await self.run_no_banco(self.read_ranking, rota_id, data, ate or data)
+
+        chave = (rota_id, data, ate)
+        self.respostas[chave] = (versao, ranking)
+        self.respostas.move_to_end(chave)
+        while len(self.respostas) > self.capacidade:
+            self.respostas.popitem(last=False)
+
+        return ranking
+
+    def write_escritas(self, rota_id, operacoes):
+        """
+        :param rota_id:   identificador da rota
+        :param operacoes: escritas registradas na simulação da rota, aplicadas em uma única transação
+        """
+        with trecho('escrita', rota_id=rota_id):
+            apply_escritas(self.cnx, operacoes)
+
+    def read_rota_ativa(self, rota_id):
+        """
+        :param rota_id: identificador da rota
+        :return:        se a rota está cadastrada e ativa
+        """
+        return self.cnx.execute("select 1 from rotas where rota_id = ? and ativo = 1",
+                                (rota_id,)).fetchone() is not None
+
+    def read_ranking(self, rota_id, data_inicial, data_final):
+        """
+        :param rota_id:      identificador da rota
+        :param data_inicial: primeiro dia do horizonte
+        :param data_final:   último dia do horizonte
+        :return:             resultados gravados da rota no horizonte, ordenados por dia e ranking
+        """
+        return pd.read_sql("select r.rota_id, origem.cidade as origem, destino.cidade as destino, r.ranking, "
+                           "       r.saida, r.score, r.score_inferior, r.score_superior, r.p05, r.p50, r.p95, "
+                           "       r.cenarios "
+                           "from resultados r "
+                           "inner join rotas using (rota_id) "
+                           "inner join cidades origem on (origem.cidade_id = rotas.origem) "
+                           "inner join cidades destino on (destino.cidade_id = rotas.destino) "
+                           "where r.rota_id = ? and substr(r.saida, 1, 10) between ? and ? "
+                           "order by substr(r.saida, 1, 10), r.ranking", self.cnx,
+                           params=(rota_id, data_inicial, data_final))[COLUNAS_DO_RANKING]
+
+    def get_versao(self):
+        """
+        :return: versão do banco, que muda a cada transação de outra conexão (a carga, o cadastro de rotas ou uma
+                 execução de 'main.py'); as escritas do próprio serviço não a alteram
+        """
+        return self.cnx.execute("pragma data_version").fetchone()[0]
+
+    def contar(self, nome):
+        """
+        Contador do serviço, também registrado no perfil da execução (ver 'src/profiling.py')
+
+        :param nome: nome do contador
+        """
+        self.contagens[nome] += 1
+        contar(nome)
+
+    def get_estado(self):
+        """
+        :return: respostas em memória, simulações em andamento e contadores do serviço
+        """
+        return {'respostas_em_memoria': len(self.respostas), 'em_andamento': len(self.em_andamento),
+                'contadores': dict(self.contagens)}
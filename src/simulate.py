@@ -1,40 +1,211 @@
+import time
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-
-from src.utils import cronometro, logger
-
-from src.plot import get_boxplot, get_duracao_de_medidas
-from src.fuzzy import get_fuzzy_results
-from src.monte_carlo import DIST_x_FUNC, best_fit_distribution
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from src.utils import get_dia_do_ano, get_minuto_do_ano, logger
+from src.profiling import contar, cronometro, trecho
+from src.cache import CacheDeDistribuicoes
+from src.dependencies import Dependencias, get_impressao, get_impressoes_por_saida
+from src.climate import CAMINHO_CUBO, MEDIDAS, get_cubo
+from src.climatology import ESTATISTICAS, Resumo, combine_resumos, read_climatologia
+from src.scenarios import get_armazem
+from src.storage import Escrita, get_caminho_junto_ao_banco
+from src.itinerary import (QUANTIL_DO_ATRASO, get_alcance_dos_trechos, get_duracoes_por_cenario, get_guia_de_alcance,
+                           get_guia_de_horarios, get_horas_do_alcance, get_observacoes_da_guia,
+                           get_quadro_de_horarios, get_saidas, get_sequencia_de_trechos, get_tempos_de_trecho)
+
+from src.plot import CAMINHO_GRAFICOS, get_agregados, get_boxplot, get_duracao_de_medidas, render_graficos
+from src.fuzzy import DOMINIO_TEMPERATURA, DOMINIO_UMIDADE, get_fuzzy_results, get_score
+from src.streaming import (CENARIOS_POR_LOTE, CONFIANCA, MINIMO_DE_LOTES, QUANTIS, EstatisticasOnline,
+                           get_eliminadas, get_lotes, get_pesos_por_saida, get_scores_por_saida)
+from src.monte_carlo import (DIST_x_FUNC, SEED, SIZE, Amostrador, best_fit_distribution, get_gerador, get_quantis,
+                             simulate_batch)
+
+
+# etapas de cada rota, na ordem em que são executadas
+ETAPAS = ['ajuste', 'simulacao', 'resultados']
 
 
 class Simulador:
-    def __init__(self, cnx):
+    def __init__(self, cnx, seed=SEED, cache=True, workers=1, metodo_de_ajuste='distfit', intervalo_de_saida=60,
+                 armazem='sqlite', streaming=False, persistir_cenarios=False, amostragem='aleatoria',
+                 erro_padrao_alvo=None, corrida=False, rotas=None, escrita=None, graficos='janela',
+                 caminho_graficos=CAMINHO_GRAFICOS, etapas=ETAPAS, data_de_saida=None, incremental=True,
+                 caminho_cubo=CAMINHO_CUBO, data_final=None, atrasos=False, superficie=False):
         """
         Função principal responsável por simular as condições climáticas em todos os pontos da rota desejada
         para encontrar o melhor horário de saída em virtude da preservação da qualidade de sementes
 
-        :param cnx: conexão com o banco de dados local
-        :return: melhor horário de saída para a rota no dia simulado
+        :param cnx:                conexão com o banco de dados local
+        :param seed:               semente do gerador de números aleatórios (None para cenários não reprodutíveis)
+        :param cache:              reaproveita distribuições já ajustadas para amostras idênticas
+        :param workers:            quantidade de processos para o ajuste de distribuições (1 para execução serial)
+        :param metodo_de_ajuste:   método de 'best_fit_distribution' ('distfit', 'nativo', 'validacao' ou
+                                   'resumo', que ajusta a partir da tabela 'climatologia' em vez das observações)
+        :param intervalo_de_saida: intervalo entre os horários de saída avaliados (minutos)
+        :param armazem:            armazenamento dos cenários simulados ('sqlite', 'numpy' ou 'parquet')
+        :param streaming:          calcula o score lote a lote durante a simulação, acumulando apenas as estatísticas
+                                   de cada horário de saída (memória constante, sem gráficos)
+        :param persistir_cenarios: no modo 'streaming', grava também os cenários simulados no armazenamento
+        :param amostragem:         estratégia de amostragem ('aleatoria', 'antitetica', 'hipercubo' ou 'sobol')
+        :param erro_padrao_alvo:   no modo 'streaming', interrompe a simulação quando o erro padrão do score de todas
+                                   as saídas fica abaixo do alvo (None para simular sempre 'SIZE' cenários)
+        :param corrida:            no modo 'streaming', elimina a cada lote as saídas claramente piores que a líder,
+                                   concentrando os cenários restantes nas saídas ainda em disputa
+        :param rotas:              identificadores das rotas simuladas (None para todas as rotas ativas)
+        :param escrita:            destino das escritas no banco de dados (por padrão, a própria conexão; ver
+                                   'src/scheduler.py' para a execução de várias rotas em paralelo)
+        :param graficos:           'janela' para exibir os gráficos de cada rota, 'arquivo' para gravá-los em
+                                   'caminho_graficos' ao final (em paralelo, com 'workers' > 1) ou None para nenhum
+        :param caminho_graficos:   diretório dos gráficos gravados em arquivo (relativo ao diretório do banco)
+        :param etapas:             etapas executadas em cada rota ('ETAPAS'): sem 'ajuste', a simulação usa as
+                                   distribuições já gravadas em 'distribuicoes', e sem 'simulacao', os resultados
+                                   são calculados a partir dos cenários já armazenados
+        :param data_de_saida:      dia dos horários de saída avaliados, 'AAAA-MM-DD' (None para o início cadastrado
+                                   em cada rota)
+        :param data_final:         último dia do horizonte de planejamento, 'AAAA-MM-DD' (None para avaliar apenas
+                                   'data_de_saida'): as saídas de todos os dias são avaliadas de uma só vez, com
+                                   uma única consulta do histórico e o ranking por dia
+        :param incremental:        recalcula apenas os horários de saída cujas entradas mudaram desde a última
+                                   execução (ver 'src/dependencies.py'); False para recalcular a rota inteira
+        :param caminho_cubo:       diretório do cubo climático ('src/climate.py'), usado no lugar da tabela quando
+                                   está atualizado (None para sempre consultar a tabela)
+        :param atrasos:            sorteia, em cada cenário, o atraso dos trechos com distribuição cadastrada em
+                                   'transit_time' ('atraso_dist' e 'atraso_params', na ordem de parâmetros do scipy):
+                                   as paradas obrigatórias e as horas de passagem em cada cidade variam entre os
+                                   cenários, e cada cenário pondera apenas as células que percorre
+        :param superficie:         interpola o score fuzzy em uma superfície pré-calculada sobre o domínio de
+                                   temperatura e umidade ('get_superficie_de_score'), em vez de avaliar as regras em
+                                   cada célula de cada cenário
+        :return: melhor horário de saída para a rota no dia simulado ('melhores_saidas'), e o status, a duração e a
+                 falha de cada rota ('relatorio', no formato de 'src/scheduler.py')
         """
         self.cnx = cnx
-        rotas = self.cnx.execute("select rota_id, origem.cidade, destino.cidade from rotas " +
-                                 "inner join cidades origem on (origem.cidade_id = rotas.origem) " +
-                                 "inner join cidades destino on (destino.cidade_id = rotas.destino) " +
-                                 "where rotas.ativo = 1").fetchall()
-
-        for rota_id, origem, destino in rotas:
+        self.escrita = escrita if escrita is not None else Escrita(cnx)
+        self.seed = seed
+        self.cache = CacheDeDistribuicoes(cnx, escrita=self.escrita) if cache else None
+        self.workers = workers
+        self.metodo_de_ajuste = metodo_de_ajuste
+        self.intervalo_de_saida = intervalo_de_saida
+        self.armazem = get_armazem(armazem, cnx, escrita=self.escrita)
+        self.streaming = streaming
+        self.persistir_cenarios = persistir_cenarios
+        self.amostragem = amostragem
+        self.erro_padrao_alvo = erro_padrao_alvo
+        self.corrida = corrida
+        self.melhores_saidas = {}
+        self.graficos = graficos
+        self.caminho_graficos = get_caminho_junto_ao_banco(cnx, caminho_graficos)
+        self.agregados = {}
+        self.etapas = etapas
+        self.data_de_saida = data_de_saida
+        self.data_final = data_final
+        self.incremental = incremental
+        self.dependencias = Dependencias(cnx, escrita=self.escrita)
+        self.cubo = get_cubo(cnx, caminho_cubo) if caminho_cubo is not None else None
+        self.atrasos = atrasos
+        self.superficie = superficie
+
+        if set(etapas) - set(ETAPAS):
+            raise ValueError(f"Etapas desconhecidas: {sorted(set(etapas) - set(ETAPAS))} (opções: {ETAPAS})")
+
+        if streaming and ('simulacao' in etapas) != ('resultados' in etapas):
+            raise ValueError("No modo 'streaming', a simulação e os resultados são calculados juntos")
+
+        if erro_padrao_alvo is not None and not streaming:
+            raise ValueError("O critério de parada por erro padrão depende do modo 'streaming'")
+
+        if corrida and not streaming:
+            raise ValueError("A corrida entre horários de saída depende do modo 'streaming'")
+
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+        rotas_ativas = self.cnx.execute("select rota_id, origem.cidade, destino.cidade from rotas " +
+                                        "inner join cidades origem on (origem.cidade_id = rotas.origem) " +
+                                        "inner join cidades destino on (destino.cidade_id = rotas.destino) " +
+                                        "where rotas.ativo = 1").fetchall()
+        rotas = [rota for rota in rotas_ativas if rotas is None or rota[0] in rotas]
+
+        # cada rota é isolada: uma falha desfaz apenas a etapa em andamento da rota e é registrada no relatório
+        self.falhas = {}
+        self.relatorio = []
+
+        try:
+            for rota_id, origem, destino in rotas:
+                inicio = time.time()
+
+                try:
+                    self.simulate_rota(rota_id, origem, destino)
+                except Exception as erro:  # noqa
+                    logger.info(f"(Rota: {rota_id}) Falha: {erro!r}")
+                    self.falhas[rota_id] = erro
+                    self.agregados.pop(rota_id, None)
+                    self.relatorio += [(rota_id, 'falha', None, None, repr(erro))]
+                    continue
+
+                self.relatorio += [(rota_id, 'ok', time.time() - inicio, self.melhores_saidas.get(rota_id), None)]
+
+            if self.agregados:
+                render_graficos(self.agregados, self.caminho_graficos, self.executor)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
+        self.relatorio = pd.DataFrame(self.relatorio, columns=['rota_id', 'status', 'segundos', 'melhor_saida', 'erro'])
+
+    def simulate_rota(self, rota_id, origem, destino):
+        """
+        :param rota_id: identificador da rota
+        :param origem:  cidade de origem
+        :param destino: cidade de destino
+        """
+        with trecho('rota', rota_id=rota_id):
             logger.info(f"Rota em análise: {origem} -> {destino} (ID: {rota_id})")
             self.rota_id = rota_id
+            self.impressoes, self.recalculadas, self.reaproveitadas = {}, {}, set()
+
+            # cada etapa é uma unidade de trabalho: as escritas da etapa são gravadas em um único commit
 
             # Pré-processamento:
-            self.get_clima_por_hora()
+            if 'ajuste' in self.etapas:
+                with self.escrita.transacao():
+                    self.get_clima_por_hora()
+            elif 'simulacao' in self.etapas:
+                # apenas as saídas da grade atual: o ajuste pode ter sido feito com outro intervalo ou horizonte
+                self.distribuicoes = self.read_distribuicoes([str(saida) for saida in self.get_grade_de_saidas()[1]])
+                self.impressoes = self.dependencias.read(self.rota_id, 'ajuste')
+                self.trechos = self.read_trechos()
+
+            if self.streaming and 'simulacao' in self.etapas:
+                # Processamento e resultados:
+                with self.escrita.transacao():
+                    self.simulate_streaming()
+                return
 
             # Processamento:
-            self.simulate_por_hora()
+            if 'simulacao' in self.etapas:
+                with self.escrita.transacao():
+                    self.simulate_por_hora()
 
             # Resultados:
-            self.get_results()
+            if 'resultados' in self.etapas:
+                with self.escrita.transacao():
+                    self.get_results()
+
+    def get_grade_de_saidas(self):
+        """
+        Inicializa os possíveis horários de saída em horários comerciais, em cada dia do horizonte
+
+        :return: dias do horizonte e horários de saída da rota
+        """
+        primeiro_dia, = self.cnx.execute("select inicio from rotas where rota_id = ?", (self.rota_id,)).fetchone()
+        primeiro_dia = datetime.strptime((self.data_de_saida or primeiro_dia) + " 00:00:00", '%Y-%m-%d %H:%M:%S')
+        dias = get_dias_do_horizonte(primeiro_dia, self.data_final)
+
+        return dias, [saida for dia in dias for saida in get_saidas(dia, self.intervalo_de_saida)]
 
     @cronometro
     def get_clima_por_hora(self):
@@ -44,103 +215,145 @@ class Simulador:
         """
         logger.info('Analisando itinerário da rota!')
 
-        origem_rota, destino_rota, primeiro_dia = \
-            self.cnx.execute(f"select origem, destino, inicio from rotas where rota_id = {self.rota_id}").fetchone()
-        itinerario = (pd.read_sql(f"select * from transit_time where rota_id = {self.rota_id}", self.cnx)
-                      .assign(inicio=None, fim=None))
-
-        # horizonte de planejamento:
-        primeiro_dia = datetime.strptime(primeiro_dia + " 00:00:00", '%Y-%m-%d %H:%M:%S')
-        ultimo_dia = primeiro_dia + timedelta(minutes=int(itinerario['transit_time'].sum()), days=1)
-
-        dm_query = (f"select c.cidade_id, c.cidade, dm.* from dados_metereologicos dm "
-                    f"inner join cidades c using (estacao_id) "
-                    f"where cast(strftime("'"%m"'f", dm.timestamp) as integer) " +
-                    f"      between {primeiro_dia.month} and {ultimo_dia.month} " +
-                    f"  and cast(strftime("'"%d"'f", dm.timestamp) as integer) " +
-                    f"      between {primeiro_dia.day} and {ultimo_dia.day}")
-
-        dm = pd.read_sql(dm_query, self.cnx, parse_dates=['timestamp'])
-        dm['mes'] = dm['timestamp'].dt.month
-        dm['dia'] = dm['timestamp'].dt.day
-        dm['hora'] = dm['timestamp'].dt.time
-
-        # inicializa possíveis horários de saída em horários comerciais:
-        saidas = [primeiro_dia + timedelta(hours=hora) for hora in range(6, 19, 1)]
-
-        for horario in saidas:
-            logger.info(f'(Rota: {self.rota_id}) Saida: {horario}')
-            horario_inicial = horario
+        trechos = self.trechos = self.read_trechos()
+        dias, saidas = self.get_grade_de_saidas()
+
+        _, chegadas = get_quadro_de_horarios(trechos, saidas)
+        if len(dias) == 1:
+            for horario, chegada in zip(saidas, chegadas[:, -1]):
+                logger.info(f'(Rota: {self.rota_id}) Saida: {horario} -> Chegada: {chegada}')
+        else:
+            logger.info(f'(Rota: {self.rota_id}) {len(saidas)} saídas de {dias[0]:%d/%m/%Y} a {dias[-1]:%d/%m/%Y} '
+                        f'-> Última chegada: {chegadas[:, -1].max()}')
+
+        # com os atrasos, a guia cobre todas as células que algum cenário pode percorrer
+        if self.atrasos:
+            guia_de_horarios = get_guia_de_alcance(trechos, saidas)
+        else:
+            guia_de_horarios = get_guia_de_horarios(trechos, saidas)
+        guia_de_horarios['minuto_inicio'] = get_minuto_do_ano(guia_de_horarios['inicio'])
+        guia_de_horarios['minuto_fim'] = get_minuto_do_ano(guia_de_horarios['fim'])
+
+        # horizonte de planejamento: uma única janela de dias do ano para todas as saídas
+        janela = (trechos['origem'].unique(), get_dia_do_ano(guia_de_horarios['inicio'].min()),
+                  get_dia_do_ano(guia_de_horarios['fim'].max()))
+        dm = self.get_resumos(*janela) if self.metodo_de_ajuste == 'resumo' else self.get_dados_metereologicos(*janela)
+
+        # puxa todos os dados históricos de horários no intervalo em que o veículo passa pela localidade
+        # não podemos filtrar pelo timestamp porque queremos dados de anos passados: a comparação é feita
+        # no calendário circular de minutos do ano, o que também cobre faixas que viram o dia, o mês ou o ano
+        data = get_observacoes_da_guia(guia_de_horarios).merge(dm, left_on=['origem', 'minuto'],
+                                                               right_on=['cidade_id', 'minuto'])
+
+        data = data[['cidade_id', 'saida', 'hora', 'duracao', *(['medida', *ESTATISTICAS, 'histograma']
+                                                                if self.metodo_de_ajuste == 'resumo' else MEDIDAS)]]
+
+        self.get_distribuicoes(data)
+
+    def read_trechos(self):
+        """
+        :return: trechos da rota na ordem do percurso, com o início e o fim de cada trecho sem atrasos e, com
+                 'atrasos', a distribuição do atraso de cada trecho, o maior atraso sorteado ('QUANTIL_DO_ATRASO') e
+                 a janela em que o veículo pode estar no trecho ('get_alcance_dos_trechos')
+        """
+        origem_rota, destino_rota = self.cnx.execute("select origem, destino from rotas where rota_id = ?",
+                                                     (self.rota_id,)).fetchone()
+        itinerario = pd.read_sql("select * from transit_time where rota_id = ?", self.cnx, params=(self.rota_id,))
 
-            origem = origem_rota
-            destino = None
+        # os tempos de cada trecho (com as paradas obrigatórias) são os mesmos para qualquer horário de saída
+        trechos = get_sequencia_de_trechos(itinerario, origem_rota, destino_rota)
+        trechos['inicio'], trechos['fim'] = get_tempos_de_trecho(trechos['transit_time'].values)
 
-            horas_de_viagem, dias_de_viagem = 0, 0
+        if not self.atrasos:
+            return trechos
 
-            while destino != destino_rota:
-                subset = itinerario.query(f'origem == {origem}')
+        com_atraso = trechos['atraso_dist'].notna().values
+        desconhecidas = set(trechos['atraso_dist'][com_atraso]) - set(DIST_x_FUNC)
+        if desconhecidas:
+            raise ValueError(f"Distribuições de atraso desconhecidas na rota {self.rota_id}: {sorted(desconhecidas)} "
+                             f"(opções: {list(DIST_x_FUNC)})")
 
-                destino = subset['destino'].values[0]
-                transito = subset['transit_time'].values[0]
+        trechos['atraso_params'] = [[float(item) for item in params.split(',')] if atraso else []
+                                    for params, atraso in zip(trechos['atraso_params'], com_atraso)]
 
-                horario_final = horario_inicial + timedelta(minutes=int(transito))
+        # os atrasos são sorteados em minutos inteiros, entre zero e o quantil 'QUANTIL_DO_ATRASO'
+        atraso_maximo = np.zeros(len(trechos))
+        if com_atraso.any():
+            atraso_maximo[com_atraso] = get_quantis(trechos['atraso_dist'][com_atraso],
+                                                    trechos['atraso_params'][com_atraso], QUANTIL_DO_ATRASO)
+        trechos['atraso_maximo'] = np.maximum(np.ceil(atraso_maximo), 0)
 
-                horas_de_viagem += transito
-                dias_de_viagem += transito
+        trechos['inicio_minimo'], trechos['fim_maximo'] = get_alcance_dos_trechos(trechos['transit_time'].values,
+                                                                                  trechos['atraso_maximo'].values)
 
-                # caminhoneiros são obrigados legalmente a parar 30 minutos a cada 5h30 de viagem
-                if horas_de_viagem >= (5 * 60 + 30):
-                    horario_final += timedelta(minutes=30)
-                    horas_de_viagem = 0
-                    dias_de_viagem += 30
+        if com_atraso.any():
+            logger.info(f"(Rota: {self.rota_id}) Atrasos sorteados em {com_atraso.sum()} de {len(trechos)} trechos: "
+                        f"até {trechos['fim_maximo'].iloc[-1] - trechos['fim'].iloc[-1]:.0f} minutos a mais na "
+                        f"chegada")
 
-                # caminhoneiros são obrigados legalmente a parar por 8 horas ininterruptas após 24h de viagem
-                if dias_de_viagem >= (24 * 60):
-                    horario_final += timedelta(hours=8)
-                    horas_de_viagem = 0
-                    dias_de_viagem = 0
+        return trechos
 
-                itinerario.loc[itinerario['origem'] == origem, 'inicio'] = horario_inicial
-                itinerario.loc[itinerario['origem'] == origem, 'fim'] = horario_final
+    def get_dados_metereologicos(self, cidades, dia_inicial, dia_final):
+        """
+        Consulta os dados históricos das cidades da rota em uma janela de dias do ano, de todos os anos disponíveis
 
-                horario_inicial = horario_final
-                origem = destino
-            # endwhile
+        Com o cubo climático, a janela de cada cidade é uma fatia do arquivo mapeado em memória. Sem ele, a consulta
+        usa o índice (estacao_id, dia_do_ano, hora) de 'dados_metereologicos'. Janelas que viram o ano (por exemplo,
+        de 30/12 a 02/01) são divididas em duas faixas.
 
-            itinerario['inicio'] = pd.to_datetime(itinerario['inicio'])
-            itinerario['fim'] = pd.to_datetime(itinerario['fim'])
+        :param cidades:     cidades da rota
+        :param dia_inicial: primeiro dia do ano da janela
+        :param dia_final:   último dia do ano da janela
+        :return:            dados meteorológicos com a chave 'minuto' (minutos desde o início do ano)
+        """
+        if self.cubo is not None:
+            estacoes_por_cidade = dict(self.cnx.execute(f"select cidade_id, estacao_id from cidades "
+                                                        f"where cidade_id in ({', '.join('?' * len(cidades))})",
+                                                        [int(cidade_id) for cidade_id in cidades]))
+            dm = self.cubo.read(estacoes_por_cidade, dia_inicial, dia_final)
+        else:
+            if dia_inicial <= dia_final:
+                faixas = [(dia_inicial, dia_final)]
+            else:
+                faixas = [(dia_inicial, 365), (1, dia_final)]
 
-            itinerario['duracao'] = ((itinerario['fim'] - itinerario['inicio']).dt.seconds / 60).astype(int)
+            dm_query = " union all ".join(
+                f"select c.cidade_id, dm.dia_do_ano, dm.hora, dm.temperatura, dm.t_max, dm.t_min, "
+                f"       dm.umidade, dm.u_max, dm.u_min "
+                f"from cidades c "
+                f"inner join dados_metereologicos dm on (dm.estacao_id = c.estacao_id) "
+                f"where c.cidade_id in ({', '.join('?' * len(cidades))}) "
+                f"  and dm.dia_do_ano between ? and ?"
+                for _ in faixas)
+            parametros = [parametro for inicio, fim in faixas
+                          for parametro in [*map(int, cidades), int(inicio), int(fim)]]
 
-            # primeiro_horario_de_viagem = itinerario['inicio'].min()
+            # medidas inteiras (a umidade, por exemplo) chegam como inteiros da coluna NUMERIC
+            dm = pd.read_sql(dm_query, self.cnx, params=parametros).astype({medida: float for medida in MEDIDAS})
 
-            hora_maxima = int(divmod((itinerario['fim'].max() - horario).total_seconds(), 3600)[0])
-            guia_de_horarios = (pd.DataFrame(columns=['inicio', 'fim'])
-                                # somamos 2 para finalizar com o horário "acima" do último
-                                # por exemplo: se o trajeto termina às 14h, queremos que o guia vá até às 15h
-                                # para que quando o merge seja feito com dm, os dados de 14h sejam inclusos
-                                # porque hora do dado meteorológico <= hora de passagem
-                                # lembrando que range usa intervalos [,), ou seja: descarta o último item
-                                .assign(fim=[horario + timedelta(hours=x) for x in range(1, hora_maxima + 2)]))
+        contar('linhas_lidas', len(dm))
+        dm['minuto'] = (dm['dia_do_ano'] - 1) * 24 * 60 + dm['hora'] * 60
+        dm['hora'] = dm['hora'].map('{:02d}:00:00'.format)
 
-            guia_de_horarios['inicio'] = guia_de_horarios.apply(lambda x: x.fim - timedelta(hours=1), axis=1)
-            guia_de_horarios = (guia_de_horarios
-                                .merge(itinerario, how='cross', suffixes=('', '_itinerario'))
-                                .query('inicio >= inicio_itinerario & fim <= fim_itinerario'))
+        return dm
 
-            # puxa todos os dados históricos de horários no intervalo em que o veículo passa pela localidade
-            data = (guia_de_horarios
-                    .merge(dm, left_on=['origem'], right_on=['cidade_id'])
-                    # não podemos filtrar pelo timestamp porque queremos dados de anos passados
-                    .query('hora >= inicio.dt.time and hora <= fim.dt.time '
-                           'and mes >= inicio.dt.month and mes <= fim.dt.month '
-                           'and dia >= inicio.dt.day and dia <= fim.dt.day')
-                    .assign(saida=horario)
-                    )[['cidade_id', 'saida', 'hora', 'duracao', 'temperatura', 't_max', 't_min', 'umidade', 'u_max',
-                       'u_min']]
+    def get_resumos(self, cidades, dia_inicial, dia_final):
+        """
+        Resumos da tabela 'climatologia' (ver 'src/climatology.py') das cidades da rota em uma janela de dias do ano,
+        para o ajuste pelo método 'resumo': uma linha por cidade, dia do ano, hora e medida, em vez de uma linha por
+        observação de cada ano
+
+        :param cidades:     cidades da rota
+        :param dia_inicial: primeiro dia do ano da janela
+        :param dia_final:   último dia do ano da janela
+        :return:            resumos com a chave 'minuto' (minutos desde o início do ano)
+        """
+        resumos = read_climatologia(self.cnx, cidades, dia_inicial, dia_final)
+        contar('linhas_lidas', len(resumos))
+        resumos['minuto'] = (resumos['dia_do_ano'] - 1) * 24 * 60 + resumos['hora'] * 60
+        resumos['hora'] = resumos['hora'].map('{:02d}:00:00'.format)
 
-            self.get_distribuicoes(data)
-        # endfor
+        return resumos
 
     @cronometro
     def get_distribuicoes(self, data):
@@ -148,12 +361,71 @@ class Simulador:
         Infere a distribuição de probabilidade que melhor representa as condições climáticas de cada local da rota
         em determinado horário
 
+        Apenas os horários de saída cujas observações (ou configuração de ajuste) mudaram desde o último ajuste são
+        ajustados novamente; as distribuições dos demais são lidas do banco
+
         :param data: conjunto de dados com a data (dia e hora) em que o veículo estará em cada cidade
         """
-        saida = str(data['saida'].iloc[0])
+        self.impressoes = get_impressoes_por_saida(data.assign(histograma=data['histograma'].map(bytes))
+                                                   if 'histograma' in data else data,
+                                                   (list(DIST_x_FUNC), self.metodo_de_ajuste))
+        validas = self.get_validas('ajuste', self.impressoes)
+        pendentes = [saida for saida in self.impressoes if saida not in validas]
+
+        logger.info(f"(Rota: {self.rota_id}) {len(pendentes)} de {len(self.impressoes)} saídas a ajustar")
+        contar('saidas_reaproveitadas', len(validas))
+
+        # as distribuições de saídas fora da grade atual (outro intervalo ou horizonte) também são descartadas
+        obsoletas = {saida for saida, in self.cnx.execute("select distinct saida from distribuicoes where rota_id = ?",
+                                                          (self.rota_id,))} - set(self.impressoes)
+
+        self.escrita.executemany("delete from distribuicoes where rota_id = ? and saida = ?",
+                                 [(self.rota_id, saida) for saida in [*pendentes, *sorted(obsoletas)]])
+        self.escrita.commit()
+
+        data = data[data['saida'].isin(pd.to_datetime(pendentes))]
+
+        grupos, amostras = self.get_amostras_de_ajuste(data)
+
+        dist_por_hora = [grupo + ajuste for grupo, ajuste in zip(grupos, self.fit_amostras(amostras))]
+
+        # as distribuições da rota ficam em memória para a simulação (as escritas podem ser adiadas)
+        ajustadas = pd.DataFrame(dist_por_hora, columns=['rota_id', 'saida', 'cidade_id', 'hora', 'duracao', 'medida',
+                                                         'dist_name', 'params'])
+        self.escrita.append('distribuicoes', ajustadas)
+        self.dependencias.write(self.rota_id, 'ajuste', {saida: self.impressoes[saida] for saida in pendentes})
+
+        if validas:
+            ajustadas = (pd.concat([self.read_distribuicoes(validas), ajustadas], ignore_index=True)
+                         .sort_values(['saida', 'cidade_id', 'hora', 'medida'], ignore_index=True))
+        self.distribuicoes = ajustadas
+
+        if self.cache is not None:
+            self.cache.evict()
+
+    def get_amostras_de_ajuste(self, data):
+        """
+        :param data: dados históricos por saída, cidade e hora (observações ou resumos da 'climatologia')
+        :return:     identificação (rota, saída, cidade, hora, duração, medida) e amostra de cada célula ajustada
+        """
+        grupos, amostras = [], []
+
+        if 'histograma' in data:
+            # os resumos dos dias do ano que compõem a célula são combinados em um único resumo
+            chaves = ['medida', 'saida', 'cidade_id', 'hora']
+            celulas = combine_resumos(data, chaves)
+            celulas['duracao'] = data.groupby(chaves, sort=False)['duracao'].first().values
+
+            for celula in celulas.sort_values(chaves).itertuples(index=False):
+                logger.info(f"Avaliando {celula.medida} para Cidade ID: {celula.cidade_id} "
+                            f"(Saída: {celula.saida} -> Hora: {celula.hora})")
+
+                grupos += [(self.rota_id, str(celula.saida), celula.cidade_id, str(celula.hora), celula.duracao,
+                            celula.medida)]
+                amostras += [Resumo(celula.medida, *[getattr(celula, coluna) for coluna in ESTATISTICAS],
+                                    celula.histograma)]
 
-        self.cnx.execute(f"delete from distribuicoes where rota_id = {self.rota_id} and saida = '{saida}'")
-        self.cnx.commit()
+            return grupos, amostras
 
         for medida in ['temperatura', 'umidade']:
             if medida == "temperatura":
@@ -168,20 +440,143 @@ class Simulador:
                   .drop(columns=['variable'])
                   .dropna(subset=['value']))
 
-            dist_por_hora = []
-
             for index, values in df.groupby(['saida', 'cidade_id', 'hora']):
                 saida, cidade_id, hora = index
                 duracao = values['duracao'].iloc[0]
 
                 logger.info(f"Avaliando {medida} para Cidade ID: {cidade_id} (Saída: {saida} -> Hora: {hora})")
 
-                dist_name, params = best_fit_distribution(values['value'])
-                dist_por_hora += [(self.rota_id, str(saida), cidade_id, str(hora), duracao, medida, dist_name, params)]
+                grupos += [(self.rota_id, str(saida), cidade_id, str(hora), duracao, medida)]
+                amostras += [values['value'].values]
+
+        return grupos, amostras
+
+    def read_distribuicoes(self, saidas=None):
+        """
+        Lê as distribuições da rota gravadas em um ajuste anterior, para simular sem ajustar novamente
+
+        :param saidas: horários de saída lidos (None para todos)
+        :return:       distribuições gravadas
+        """
+        filtro = '' if saidas is None else f"and saida in ({', '.join('?' * len(saidas))}) "
+        distribuicoes = pd.read_sql(f"select rota_id, saida, cidade_id, hora, duracao, medida, dist_name, params "
+                                    f"from distribuicoes where rota_id = ? {filtro}"
+                                    f"order by saida, cidade_id, hora, medida", self.cnx,
+                                    params=[self.rota_id, *sorted(saidas or [])])
+
+        if distribuicoes.empty:
+            raise ValueError(f"A rota {self.rota_id} não tem distribuições ajustadas: execute a etapa de ajuste antes")
+
+        return distribuicoes
+
+    def get_validas(self, etapa, impressoes):
+        """
+        :param etapa:      etapa ('ajuste' ou 'simulacao')
+        :param impressoes: impressão atual das entradas de cada horário de saída da rota
+        :return:           horários de saída que não precisam ser recalculados (nenhum, se não for incremental)
+        """
+        if not self.incremental:
+            return set()
+
+        return self.dependencias.get_validas(self.rota_id, etapa, impressoes)
+
+    def get_impressoes_de_simulacao(self):
+        """
+        :return: impressão de cada horário de saída simulado: a impressão do ajuste (que cobre as distribuições)
+                 combinada aos parâmetros da simulação. Saídas sem impressão de ajuste são sempre simuladas.
+        """
+        configuracao = (self.seed, SIZE, self.amostragem, self.streaming, self.erro_padrao_alvo, self.corrida,
+                        CENARIOS_POR_LOTE)
+
+        # com os atrasos, as distribuições de atraso também são entradas da simulação
+        if self.atrasos:
+            configuracao += (self.trechos[['transit_time', 'atraso_dist']].values.tolist(),
+                             self.trechos['atraso_params'].tolist())
+
+        # o score interpolado na superfície difere do score exato
+        if self.superficie:
+            configuracao += ('superficie',)
 
-            (pd.DataFrame(dist_por_hora,
-                          columns=['rota_id', 'saida', 'cidade_id', 'hora', 'duracao', 'medida', 'dist_name', 'params'])
-             .to_sql('distribuicoes', self.cnx, if_exists='append', index=False))
+        return {saida: get_impressao(self.impressoes[saida], configuracao) if saida in self.impressoes else None
+                for saida in self.distribuicoes['saida'].unique()}
+
+    def get_celulas_pendentes(self):
+        """
+        Separa as células dos horários de saída que precisam ser simulados novamente. Na corrida, as saídas são
+        comparadas entre si, então a rota inteira é simulada quando qualquer saída muda.
+
+        :return: células pendentes (ver 'get_celulas')
+        """
+        impressoes = self.get_impressoes_de_simulacao()
+        validas = self.get_validas('simulacao', impressoes)
+
+        if self.corrida and len(validas) < len(impressoes):
+            validas = set()
+
+        self.reaproveitadas = validas
+        self.recalculadas = {saida: impressao for saida, impressao in impressoes.items() if saida not in validas}
+        contar('saidas_reaproveitadas', len(validas))
+
+        if validas:
+            logger.info(f"(Rota: {self.rota_id}) {len(self.recalculadas)} de {len(impressoes)} saídas a simular")
+
+        # os cenários das saídas recalculadas e das que não fazem mais parte da grade são descartados
+        self.armazem.clear(self.rota_id, None if not validas else
+                           [saida for saida in self.armazem.get_saidas(self.rota_id)
+                            if str(pd.Timestamp(saida)) not in validas])
+
+        celulas = self.get_celulas()
+
+        return celulas[~celulas.index.get_level_values('saida').isin(list(validas))]
+
+    def fit_amostras(self, amostras):
+        """
+        Ajusta as distribuições de um lote de amostras, consultando o cache antes de ajustar
+
+        Amostras idênticas no lote (a mesma cidade e hora do histórico vista por saídas ou dias diferentes do
+        horizonte) são ajustadas uma única vez, mesmo sem o cache. As amostras ainda não ajustadas são enviadas em
+        blocos ao pool de processos (quando 'workers' > 1). O resultado mantém a ordem das amostras, independente da
+        ordem em que os processos terminam.
+
+        :param amostras: lista de conjuntos de dados a serem ajustados
+        :return:         lista com a melhor distribuição ajustada e seus parâmetros para cada amostra
+        """
+        configuracao = (list(DIST_x_FUNC), self.metodo_de_ajuste)
+        ajuste_por_amostra = partial(best_fit_distribution, metodo=self.metodo_de_ajuste)
+        chaves = [CacheDeDistribuicoes.get_chave(amostra, *configuracao) for amostra in amostras]
+        ajustes = [None] * len(amostras)
+
+        if self.cache is not None:
+            ajustes = [self.cache.get(chave) for chave in chaves]
+
+        # primeira amostra de cada chave ainda não ajustada
+        por_chave = {}
+        for idx, (chave, ajuste) in enumerate(zip(chaves, ajustes)):
+            if ajuste is None:
+                por_chave.setdefault(chave, idx)
+        pendentes = list(por_chave.values())
+
+        contar('ajustes', len(pendentes))
+        contar('ajustes_compartilhados', sum(ajuste is None for ajuste in ajustes) - len(pendentes))
+        if self.cache is not None:
+            contar('cache_acertos', sum(ajuste is not None for ajuste in ajustes))
+
+        if self.executor is not None and len(pendentes) > 1:
+            # blocos grandes o suficiente para diluir a comunicação entre processos, mas com ~4 blocos por worker
+            # para equilibrar a carga entre eles
+            chunksize = max(1, len(pendentes) // (4 * self.workers))
+            resultados = self.executor.map(ajuste_por_amostra, [amostras[idx] for idx in pendentes],
+                                           chunksize=chunksize)
+        else:
+            resultados = map(ajuste_por_amostra, [amostras[idx] for idx in pendentes])
+
+        for idx, resultado in zip(pendentes, resultados):
+            ajustes[idx] = tuple(resultado)
+
+            if self.cache is not None:
+                self.cache.set(chaves[idx], *ajustes[idx])
+
+        return [ajuste if ajuste is not None else ajustes[por_chave[chave]] for chave, ajuste in zip(chaves, ajustes)]
 
     @cronometro
     def simulate_por_hora(self):
@@ -190,46 +585,364 @@ class Simulador:
         para os pontos esperados em que o veículo esteja durante a rota, podemos simular diversos cenários
         por meio da geração de números aleatórios que repliquem a realidade.
         """
-        distribuicoes = pd.read_sql(f'select * from distribuicoes where rota_id = {self.rota_id}', self.cnx)
+        celulas = self.get_celulas_pendentes()
+        logger.info(f"Simulando {len(celulas)} células com {SIZE} cenários cada")
+
+        # um gerador por horário de saída, para que os cenários de uma saída não dependam das demais saídas
+        # simuladas na mesma execução: as células de uma mesma família são amostradas de uma só vez em cada saída
+        for saida, celulas_da_saida in celulas.groupby(level='saida', sort=False):
+            rng = get_gerador(self.seed, self.rota_id, get_chave_de_saida(saida))
+            amostrador = Amostrador(2 * len(celulas_da_saida), self.amostragem, rng)
+            indice = celulas_da_saida.index.to_frame(index=False)
+
+            contar('cenarios', SIZE)
+            contar('amostras', 2 * SIZE * len(celulas_da_saida))
+
+            amostras = self.get_amostras(celulas_da_saida, amostrador, SIZE)
+            duracoes = (self.get_duracoes(indice, Amostrador(len(self.trechos), self.amostragem, rng), SIZE)
+                        if self.atrasos else None)
+
+            self.write_cenarios(indice, amostras, duracoes=duracoes)
+
+    @cronometro
+    def simulate_streaming(self):
+        """
+        Simula os cenários em lotes de 'CENARIOS_POR_LOTE' e calcula o score fuzzy de cada lote assim que é gerado.
+        Cada horário de saída acumula apenas as estatísticas do score dos seus cenários, então a memória utilizada
+        não depende da quantidade de cenários, e os cenários brutos só são gravados se 'persistir_cenarios'.
+
+        Com 'erro_padrao_alvo', novos lotes são simulados até que o erro padrão de todas as saídas fique abaixo do
+        alvo (ou até 'SIZE' cenários). O erro padrão é estimado pela dispersão das médias dos lotes, que capta a
+        redução de variância das amostragens antitética, hipercubo latino e Sobol.
+
+        Com 'corrida', a partir de 'MINIMO_DE_LOTES' lotes, as saídas cujo intervalo de confiança fica abaixo do
+        intervalo da líder do mesmo dia deixam de ser simuladas ('get_eliminadas'), até restar uma única saída por
+        dia ou até esgotar o orçamento de 'SIZE' cenários por saída: os cenários que as saídas eliminadas deixam de
+        usar são redistribuídos entre as saídas restantes ('get_lotes'). Cada eliminação é registrada em
+        'eliminacoes'.
+
+        Apenas as saídas pendentes ('get_celulas_pendentes') são simuladas, com um único gerador para a rota. Com
+        'atrasos', os pesos das células mudam a cada cenário ('get_duracoes').
+        """
+        celulas = self.get_celulas_pendentes()
+
+        if celulas.empty:
+            logger.info(f"(Rota: {self.rota_id}) Nenhuma saída alterada: resultados mantidos")
+            self.keep_resultados()
+            return
+
+        indice = celulas.index.to_frame(index=False)
+        logger.info(f"Simulando {len(celulas)} células com {SIZE} cenários cada, em lotes de {CENARIOS_POR_LOTE}")
+
+        saidas, saida_por_celula = np.unique(indice['saida'].values, return_inverse=True)
+        pesos = get_pesos_por_saida(saida_por_celula, indice['duracao'].values)
+
+        # na corrida, as saídas competem apenas com as saídas do mesmo dia
+        _, dia_por_saida = np.unique(pd.DatetimeIndex(saidas).normalize(), return_inverse=True)
+        dias = [np.flatnonzero(dia_por_saida == dia) for dia in range(dia_por_saida.max() + 1)]
+        estatisticas = [EstatisticasOnline() for _ in saidas]
+        medias_dos_lotes = [EstatisticasOnline() for _ in saidas]
+        ativas = np.ones(len(saidas), dtype=bool)
+        eliminacoes = []
+
+        rng = get_gerador(self.seed, self.rota_id)
+        amostrador = Amostrador(2 * len(celulas), self.amostragem, rng)
+        amostrador_de_atrasos = (Amostrador(len(saidas) * len(self.trechos), self.amostragem, rng) if self.atrasos
+                                 else None)
+
+        for lote, (primeiro_cenario, tamanho) in enumerate(get_lotes(SIZE * len(saidas), ativas)):
+            with trecho('lote', lote=lote):
+                celulas_ativas = ativas[saida_por_celula]
+                amostras = self.get_amostras(celulas, amostrador, tamanho, celulas_ativas)
+                duracoes = (self.get_duracoes(indice, amostrador_de_atrasos, tamanho, celulas_ativas)
+                            if self.atrasos else None)
+
+                contar('cenarios', tamanho * ativas.sum())
+                contar('amostras', 2 * tamanho * celulas_ativas.sum())
+
+                if self.persistir_cenarios:
+                    self.write_cenarios(indice[celulas_ativas], amostras, primeiro_cenario, lote, duracoes)
+
+                temperatura = np.clip(amostras['temperatura'], *DOMINIO_TEMPERATURA)
+                umidade = np.clip(amostras['umidade'], *DOMINIO_UMIDADE)
+                if duracoes is None:
+                    score = get_score(temperatura.ravel(), umidade.ravel(), self.superficie).reshape(temperatura.shape)
+                else:
+                    # com os atrasos, o score é calculado apenas nas células percorridas em cada cenário
+                    percorridas = duracoes > 0
+                    score = np.zeros(temperatura.shape)
+                    score[percorridas] = get_score(temperatura[percorridas], umidade[percorridas], self.superficie)
+
+                # score de cada cenário por saída ativa (saídas x cenários do lote)
+                if duracoes is None:
+                    por_saida = pesos[np.ix_(ativas, celulas_ativas)] @ score
+                else:
+                    por_saida = get_scores_por_saida(score, duracoes, saida_por_celula[celulas_ativas])
+
+                for saida, valores in zip(np.flatnonzero(ativas), por_saida):
+                    estatisticas[saida].update(valores)
+                    medias_dos_lotes[saida].update([valores.mean()])
+
+                if lote + 1 < MINIMO_DE_LOTES:
+                    continue
+
+                if self.corrida:
+                    for saidas_do_dia in dias:
+                        if ativas[saidas_do_dia].sum() <= 1:
+                            continue
+
+                        lider, eliminadas = get_eliminadas(medias_dos_lotes, saidas_do_dia[ativas[saidas_do_dia]])
+                        lider_inferior = medias_dos_lotes[lider].get_intervalo_de_confianca()[0]
+
+                        for saida in eliminadas:
+                            eliminacoes += [(self.rota_id, str(pd.Timestamp(saidas[saida])), lote + 1,
+                                             primeiro_cenario + tamanho, medias_dos_lotes[saida].media,
+                                             medias_dos_lotes[saida].get_intervalo_de_confianca()[1],
+                                             str(pd.Timestamp(saidas[lider])), lider_inferior)]
+                            logger.info(f"(Rota: {self.rota_id}) Saída {pd.Timestamp(saidas[saida])} eliminada com "
+                                        f"{primeiro_cenario + tamanho} cenários")
+
+                        ativas[eliminadas] = False
+
+                    if all(ativas[saidas_do_dia].sum() == 1 for saidas_do_dia in dias):
+                        break
+
+                if self.erro_padrao_alvo is not None:
+                    erro_padrao = max(medias_dos_lotes[saida].erro_padrao for saida in np.flatnonzero(ativas))
+
+                    if erro_padrao <= self.erro_padrao_alvo:
+                        logger.info(f"Erro padrão {erro_padrao:.4f} atingido com {primeiro_cenario + tamanho} cenários")
+                        break
+
+        if self.corrida:
+            self.write_eliminacoes(eliminacoes)
+
+        self.write_resultados(dict(zip(saidas, estatisticas)),
+                              {saida: rodada for _, saida, rodada, *_ in eliminacoes})
+
+    def get_celulas(self):
+        """
+        :return: uma linha por célula (saída, cidade, hora), com a distribuição de cada medida em colunas
+        """
+        distribuicoes = self.distribuicoes.copy()
         distribuicoes['params'] = distribuicoes['params'].apply(lambda row: [float(item) for item in row.split(',')])
 
-        self.cnx.execute(f'delete from resultados where rota_id = {self.rota_id}')
-        self.cnx.execute(f'delete from simulacoes where rota_id = {self.rota_id}')
-        self.cnx.commit()
+        return distribuicoes.pivot(index=['saida', 'cidade_id', 'hora', 'duracao'], columns='medida',
+                                   values=['dist_name', 'params'])
 
-        for index, values in distribuicoes.groupby(['saida', 'cidade_id', 'hora', 'duracao']):
-            saida, cidade_id, hora, duracao = index
-            hora = str(hora)
+    def get_amostras(self, celulas, amostrador, size, ativas=None):
+        """
+        :param celulas:    células com a distribuição de cada medida
+        :param amostrador: amostrador da rota (as primeiras dimensões são de temperatura e as seguintes de umidade)
+        :param size:       quantidade de cenários do lote
+        :param ativas:     máscara das células simuladas (None para todas)
+        :return:           matrizes (células ativas x cenários) simuladas de cada medida
+        """
+        # os números uniformes são gerados para todas as dimensões, para manter a sequência do amostrador
+        uniformes = amostrador.get_uniformes(size)
+        ativas = np.ones(len(celulas), dtype=bool) if ativas is None else ativas
 
-            logger.info(f"Ajustando distribuição para Cidade ID: {cidade_id} ({saida} - {hora})")
+        return {medida: simulate_batch(celulas.loc[ativas, ('dist_name', medida)].values,
+                                       celulas.loc[ativas, ('params', medida)].values, size=size, rng=amostrador.rng,
+                                       uniformes=None if uniformes is None else uniformes[dimensoes][ativas])
+                for medida, dimensoes in [('temperatura', slice(0, len(celulas))),
+                                          ('umidade', slice(len(celulas), None))]}
 
-            simulated_df = pd.DataFrame()
-            for medida in ['temperatura', 'umidade']:
-                dist_name = values.loc[values['medida'] == medida, 'dist_name'].iloc[0]
-                params = values.loc[values['medida'] == medida, 'params'].iloc[0]
+    def get_duracoes(self, indice, amostrador, size, ativas=None):
+        """
+        Duração de cada célula em cada cenário, com os atrasos dos trechos sorteados: os tempos de trecho, as
+        paradas obrigatórias e as horas de passagem são resolvidos para todos os cenários de uma saída de uma só
+        vez, em matrizes (cenários x trechos), e cada cenário pondera apenas as células que percorre
+
+        :param indice:     células simuladas, ordenadas por saída (saída, cidade, hora e duração)
+        :param amostrador: amostrador dos atrasos (uma dimensão por saída de 'indice' e trecho)
+        :param size:       quantidade de cenários do lote
+        :param ativas:     máscara das células simuladas (None para todas)
+        :return:           matriz (células ativas x cenários) com a duração do trecho da célula nos cenários que
+                           passam por ela, e zero nos demais
+        """
+        trechos = self.trechos
+        com_atraso = np.flatnonzero(trechos['atraso_dist'].notna().values)
+        ativas = np.ones(len(indice), dtype=bool) if ativas is None else ativas
+
+        # os números uniformes são gerados para todas as saídas, para manter a sequência do amostrador
+        uniformes = amostrador.get_uniformes(size)
+
+        saidas, primeira_celula = np.unique(indice['saida'].values, return_index=True)
+        limites = np.append(primeira_celula, len(indice))
+        duracoes = []
+
+        for posicao, (saida, inicio, fim) in enumerate(zip(saidas, limites[:-1], limites[1:])):
+            if not ativas[inicio:fim].any():
+                continue
+
+            transito = np.tile(trechos['transit_time'].values.astype(int), (size, 1))
+            if len(com_atraso):
+                atrasos = simulate_batch(trechos['atraso_dist'].values[com_atraso],
+                                         trechos['atraso_params'].values[com_atraso], size=size, rng=amostrador.rng,
+                                         uniformes=None if uniformes is None else
+                                         uniformes[posicao * len(trechos) + com_atraso])
+                atrasos = np.clip(atrasos, 0, trechos['atraso_maximo'].values[com_atraso, np.newaxis])
+                transito[:, com_atraso] += np.rint(atrasos).astype(int).T
+
+            inicio_por_cenario, fim_por_cenario = get_tempos_de_trecho(transito)
+
+            # observações alcançáveis de cada célula da saída, ordenadas por célula
+            saida = pd.Timestamp(saida)
+            trecho, hora = get_horas_do_alcance(trechos, saida.minute != 0)
+            linhas = {(cidade_id, str(hora_da_celula)): linha for linha, (cidade_id, hora_da_celula)
+                      in enumerate(zip(indice['cidade_id'].values[inicio:fim], indice['hora'].values[inicio:fim]))}
+            celula = np.array([linhas.get((cidade_id, f'{(saida.hour + horas) % 24:02d}:00:00'), -1)
+                               for cidade_id, horas in zip(trechos['origem'].values[trecho], hora)], dtype=int)
+            mantidas = np.flatnonzero(celula >= 0)
+            ordem = mantidas[np.argsort(celula[mantidas], kind='stable')]
+
+            por_observacao = get_duracoes_por_cenario(inicio_por_cenario, fim_por_cenario, trecho[ordem], hora[ordem],
+                                                      saida.minute != 0)
+
+            # uma célula pode reunir observações de dias diferentes (trechos com mais de 24 horas)
+            duracoes_da_saida = np.zeros((fim - inicio, size), dtype=int)
+            celulas, primeiras = np.unique(celula[ordem], return_index=True)
+            if len(celulas):
+                duracoes_da_saida[celulas] = np.maximum.reduceat(por_observacao, primeiras, axis=0)
+
+            duracoes += [duracoes_da_saida[ativas[inicio:fim]]]
+
+        return np.vstack(duracoes)
+
+    def write_cenarios(self, indice, amostras, primeiro_cenario=0, lote=0, duracoes=None):
+        """
+        :param indice:           células simuladas (saída, cidade, hora e duração)
+        :param amostras:         matrizes (células x cenários) simuladas de cada medida
+        :param primeiro_cenario: quantidade de cenários já gravados em lotes anteriores
+        :param lote:             número do lote de cenários
+        :param duracoes:         matriz (células x cenários) com a duração de cada célula por cenário, com os atrasos
+                                 sorteados ('get_duracoes'): as células que o cenário não percorre não são gravadas
+        """
+        tamanho = amostras['temperatura'].shape[1]
+
+        # exportando resultados agregados apenas em nível de rota, horário de saída e cenário (1..1000)
+        cenarios = pd.DataFrame({'hora': np.repeat(indice['hora'].astype(str).values, tamanho),
+                                 'cidade_id': np.repeat(indice['cidade_id'].values, tamanho),
+                                 'duracao': (np.repeat(indice['duracao'].values, tamanho) if duracoes is None
+                                             else duracoes.ravel()),
+                                 'cenario': np.tile(np.arange(primeiro_cenario + 1, primeiro_cenario + tamanho + 1),
+                                                    len(indice)),
+                                 'temperatura': amostras['temperatura'].ravel(),
+                                 'umidade': amostras['umidade'].ravel()})
+
+        # as células estão ordenadas por saída, então os cenários de cada saída são contíguos
+        saidas, primeira_celula = np.unique(indice['saida'].values, return_index=True)
+        limites = np.append(primeira_celula, len(indice)) * tamanho
+
+        for saida, inicio, fim in zip(saidas, limites[:-1], limites[1:]):
+            cenarios_da_saida = cenarios.iloc[inicio:fim]
+            if duracoes is not None:
+                cenarios_da_saida = cenarios_da_saida[cenarios_da_saida['duracao'] > 0]
+
+            self.armazem.write(self.rota_id, saida, cenarios_da_saida, lote)
+
+    def write_eliminacoes(self, eliminacoes):
+        """
+        :param eliminacoes: saídas eliminadas na corrida, com a rodada, os cenários simulados e o intervalo da líder
+        """
+        self.escrita.execute("delete from eliminacoes where rota_id = ?", (self.rota_id,))
+        self.escrita.append('eliminacoes', pd.DataFrame(eliminacoes, columns=['rota_id', 'saida', 'rodada', 'cenarios',
+                                                                             'score', 'score_superior', 'saida_lider',
+                                                                             'lider_inferior']))
+        self.escrita.commit()
+
+    def write_resultados(self, estatisticas, rodadas=None):
+        """
+        Grava uma linha por horário de saída em 'resultados', ordenadas pelo score médio dentro de cada dia (ranking
+        1 = melhor saída do dia), com o intervalo de confiança da média e os quantis do score entre cenários
 
-                simulated_df[medida] = \
-                    DIST_x_FUNC.get(
-                        dist_name,
-                        lambda *_: logger.info(f"Falha no método de transformação de {dist_name}")  # trata erro
-                    )(*params)                                                                      # chama a função
+        :param estatisticas: estatísticas do score por cenário de cada horário de saída
+        :param rodadas:      rodada em que cada saída foi eliminada na corrida (as saídas eliminadas ficam abaixo
+                             das que chegaram ao fim, e as eliminadas mais tarde acima das eliminadas mais cedo)
+        """
+        resultados = pd.DataFrame([(self.rota_id, str(pd.Timestamp(saida)), estatistica.media,
+                                    np.sqrt(estatistica.variancia), *estatistica.get_intervalo_de_confianca(CONFIANCA),
+                                    *[estatistica.get_quantil(q) for q in QUANTIS.values()], estatistica.n)
+                                   for saida, estatistica in estatisticas.items()],
+                                  columns=['rota_id', 'saida', 'score', 'desvio_padrao', 'score_inferior',
+                                           'score_superior', *QUANTIS, 'cenarios'])
+
+        # os resultados das saídas reaproveitadas são mantidos e entram no ranking
+        reaproveitadas = self.reaproveitadas - set(resultados['saida'])
+        if reaproveitadas:
+            resultados = pd.concat([resultados, self.read_resultados(reaproveitadas)], ignore_index=True)
+
+        resultados['rodada'] = resultados['saida'].map(rodadas or {}).fillna(np.inf)
+        resultados['dia'] = resultados['saida'].str[:10]
+        resultados = (resultados.sort_values(['dia', 'rodada', 'score'], ascending=[True, False, False])
+                      .drop(columns=['rodada']))
+        resultados['ranking'] = resultados.groupby('dia').cumcount() + 1
+        resultados = resultados.drop(columns=['dia'])
+
+        self.escrita.execute("delete from resultados where rota_id = ?", (self.rota_id,))
+        self.escrita.append('resultados', resultados)
+        self.dependencias.write(self.rota_id, 'simulacao', self.recalculadas)
+
+        melhores = resultados[resultados['ranking'] == 1]
+        for _, melhor in melhores.iterrows():
+            logger.info(f"(Rota: {self.rota_id}) Melhor saída: {melhor['saida']} -> Score: {melhor['score']:.2f} "
+                        f"[{melhor['score_inferior']:.2f}, {melhor['score_superior']:.2f}]")
+
+        # no horizonte de vários dias, a melhor saída da rota é a de maior score entre as melhores de cada dia
+        self.melhores_saidas[self.rota_id] = melhores.loc[melhores['score'].idxmax(), 'saida']
+
+    def read_resultados(self, saidas):
+        """
+        :param saidas: horários de saída lidos
+        :return:       resultados gravados das saídas (sem o ranking)
+        """
+        return pd.read_sql(f"select rota_id, saida, score, desvio_padrao, score_inferior, score_superior, "
+                           f"{', '.join(QUANTIS)}, cenarios from resultados where rota_id = ? "
+                           f"and saida in ({', '.join('?' * len(saidas))})", self.cnx,
+                           params=[self.rota_id, *sorted(saidas)])
 
-            simulated_df['saida'] = saida
+    def keep_resultados(self):
+        """
+        Mantém os resultados gravados quando nenhuma saída é recalculada. Se a grade de saídas mudou (outro
+        intervalo ou horizonte), os resultados das saídas fora da grade são descartados e o ranking é refeito
+        """
+        gravadas = {saida for saida, in self.cnx.execute("select saida from resultados where rota_id = ?",
+                                                         (self.rota_id,))}
 
-            # exportando resultados agregados apenas em nível de rota, horário de saída e cenário (1..1000)
-            (simulated_df.assign(rota_id=self.rota_id, cidade_id=cidade_id, hora=hora, duracao=duracao,
-                                 cenario=simulated_df.index + 1)  # noqa
-            [['rota_id', 'saida', 'hora', 'cidade_id', 'duracao', 'cenario', 'temperatura', 'umidade']]
-            .to_sql('simulacoes', self.cnx, if_exists='append', index=False))
+        if gravadas - self.reaproveitadas:
+            self.write_resultados({})
+        else:
+            self.read_melhor_saida()
+
+    def read_melhor_saida(self):
+        """
+        Melhor horário de saída gravado para a rota, quando nenhuma saída é recalculada
+        """
+        melhor = self.cnx.execute("select saida from resultados where rota_id = ? "
+                                  "and ranking = 1 order by score desc limit 1", (self.rota_id,)).fetchone()
+        self.melhores_saidas[self.rota_id] = None if melhor is None else melhor[0]
 
     @cronometro
     def get_results(self):
         logger.info('Calculando resultados!')
-        simulated_df = pd.read_sql(f'select * from simulacoes where rota_id = {self.rota_id}',
-                                   self.cnx, parse_dates=['saida'])
 
-        simulated_df['dia'] = simulated_df['saida'].dt.strftime("%d/%m/%Y")
-        simulated_df['hora'] = simulated_df['saida'].dt.strftime("%H:%M")
+        # sem gráficos, apenas os cenários das saídas simuladas nesta execução são lidos
+        if self.reaproveitadas and self.graficos is None:
+            if not self.recalculadas:
+                logger.info(f"(Rota: {self.rota_id}) Nenhuma saída alterada: resultados mantidos")
+                self.keep_resultados()
+                return
+
+            simulated_df = self.armazem.read(self.rota_id, list(self.recalculadas))
+        else:
+            simulated_df = self.armazem.read(self.rota_id)
+        contar('linhas_lidas', len(simulated_df))
+
+        # formata apenas os horários de saída distintos (a formatação linha a linha domina o tempo dos gráficos)
+        codigos, saidas = pd.factorize(simulated_df['saida'])
+        simulated_df['dia'] = saidas.strftime("%d/%m/%Y")[codigos]
+        simulated_df['hora'] = saidas.strftime("%H:%M")[codigos]
 
         # Consistências de dados:
         # umidade deve ter intervalo entre 0 a 100 (%)
@@ -240,7 +953,49 @@ class Simulador:
         simulated_df.loc[simulated_df['temperatura'] > 40, 'temperatura'] = 40
         simulated_df.loc[simulated_df['temperatura'] < 0, 'temperatura'] = 0
 
-        simulated_df['score'] = get_fuzzy_results(simulated_df[['temperatura', 'umidade']])
+        simulated_df['score'] = get_fuzzy_results(simulated_df[['temperatura', 'umidade']], self.superficie)
+
+        # score de cada cenário por saída: média das células ponderada pela duração do trecho
+        simulated_df['exposicao'] = simulated_df['score'] * simulated_df['duracao']
+        por_cenario = simulated_df.groupby(['saida', 'cenario'])[['exposicao', 'duracao']].sum()
+        por_cenario = por_cenario['exposicao'] / por_cenario['duracao']
+
+        estatisticas = {}
+        for saida, valores in por_cenario.groupby(level='saida'):
+            estatisticas[saida] = EstatisticasOnline()
+            estatisticas[saida].update(valores.values)
+
+        self.write_resultados(estatisticas)
+
+        if self.graficos == 'janela':
+            get_boxplot(simulated_df)  # analisa a dispersão de resultados entre cenários para um horário de saída
+            get_duracao_de_medidas(simulated_df)
+        elif self.graficos == 'arquivo':
+            # apenas os agregados dos gráficos ficam em memória até o fim das rotas
+            self.agregados[self.rota_id] = get_agregados(simulated_df)
+
+
+def get_chave_de_saida(saida):
+    """
+    :param saida: horário de saída
+    :return:      minutos desde 01/01/1970, usado como chave do gerador de números aleatórios da saída
+    """
+    return int(pd.Timestamp(saida).value // (60 * 10 ** 9))
+
+
+def get_dias_do_horizonte(primeiro_dia, data_final=None):
+    """
+    :param primeiro_dia: primeiro dia do horizonte (00:00)
+    :param data_final:   último dia do horizonte, 'AAAA-MM-DD' (None para apenas o primeiro dia)
+    :return:             dias do horizonte de planejamento
+    """
+    if data_final is None:
+        return [primeiro_dia]
+
+    dias = list(pd.date_range(primeiro_dia, data_final, freq='D').to_pydatetime())
+
+    # a janela do histórico é uma faixa de dias do ano: o horizonte (mais a viagem) precisa caber em um ano
+    if not 0 < len(dias) < 300:
+        raise ValueError(f"Horizonte inválido: de {primeiro_dia:%Y-%m-%d} a {data_final} (entre 1 e 299 dias)")
 
-        get_boxplot(simulated_df)  # analisa a dispersão de resultados entre cenários para um horário de saída
-        get_duracao_de_medidas(simulated_df)
+    return dias
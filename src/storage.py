@@ -0,0 +1,327 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+
+from src.profiling import contar
+
+
+# PRAGMAs de toda conexão ('connect'): com o journal em WAL, 'NORMAL' só sincroniza o disco nos checkpoints, e
+# não a cada commit (uma queda de energia pode desfazer as últimas transações, mas não corromper o banco)
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -64_000, 'temp_store': 'MEMORY'}
+
+# comandos preparados mantidos por conexão: as consultas parametrizadas são preparadas uma única vez
+COMANDOS_EM_CACHE = 256
+
+
+class Conexao(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        """
+        Conexão que mede cada comando executado, inclusive os do pandas ('read_sql' usa o cursor da conexão): a
+        quantidade de execuções e o tempo total por comando ficam em 'tempos' (ver 'get_tempos') e, com o perfil
+        ligado, nos contadores 'comandos_sql' e 'microssegundos_sql' do trecho aberto ('src/profiling.py')
+
+        O tempo de uma consulta é o da execução até a primeira linha, sem a leitura das demais.
+        """
+        super().__init__(*args, **kwargs)
+        self.tempos = {}
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or Cursor)
+
+    def execute(self, comando, parametros=()):
+        return self.cursor().execute(comando, parametros)
+
+    def executemany(self, comando, linhas):
+        return self.cursor().executemany(comando, linhas)
+
+    def medir(self, comando, inicio, execucoes=1):
+        duracao = time.perf_counter() - inicio
+
+        tempo = self.tempos.setdefault(comando, [0, 0.0])
+        tempo[0] += execucoes
+        tempo[1] += duracao
+
+        contar('comandos_sql', execucoes)
+        contar('microssegundos_sql', duracao * 1e6)
+
+    def get_tempos(self):
+        """
+        :return: execuções e segundos de cada comando, do mais demorado para o mais rápido
+        """
+        return (pd.DataFrame([(comando, execucoes, segundos) for comando, (execucoes, segundos) in self.tempos.items()],
+                             columns=['comando', 'execucoes', 'segundos'])
+                .sort_values('segundos', ascending=False, ignore_index=True))
+
+
+class Cursor(sqlite3.Cursor):
+    def execute(self, comando, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(comando, parametros)
+        finally:
+            self.connection.medir(comando, inicio)
+
+    def executemany(self, comando, linhas):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(comando, linhas)
+        finally:
+            self.connection.medir(comando, inicio, max(self.rowcount, 1))
+
+
+def connect(caminho, pragmas=None, somente_leitura=False):
+    """
+    :param caminho:         caminho do banco de dados local
+    :param pragmas:         PRAGMAs aplicados sobre os de 'PRAGMAS' (por exemplo, {'synchronous': 'FULL'})
+    :param somente_leitura: recusa escritas na conexão (processos de um pool, ver 'src/scheduler.py')
+    :return:                conexão com os comandos medidos e preparados em cache
+    """
+    cnx = sqlite3.connect(caminho, factory=Conexao, cached_statements=COMANDOS_EM_CACHE)
+    set_pragmas(cnx, {**PRAGMAS, **(pragmas or {})})
+
+    if somente_leitura:
+        cnx.execute("pragma query_only = 1")
+
+    return cnx
+
+
+def set_pragmas(cnx, pragmas):
+    """
+    :param cnx:     conexão com o banco de dados local
+    :param pragmas: valor de cada PRAGMA (nomes e valores simples, já que PRAGMAs não aceitam parâmetros)
+    """
+    for pragma, valor in pragmas.items():
+        if not re.fullmatch(r'\w+', pragma) or not re.fullmatch(r'-?\w+', str(valor)):
+            raise ValueError(f"PRAGMA inválido: {pragma} = {valor}")
+
+        cnx.execute(f"pragma {pragma} = {valor}")
+
+
+@contextmanager
+def pragmas_temporarios(cnx, pragmas):
+    """
+    PRAGMAs válidos apenas dentro do bloco (uso: 'with pragmas_temporarios(cnx, {...}): ...'): os valores da conexão
+    são lidos antes do bloco e restaurados ao final, de forma que a conexão compartilhada volta à configuração do
+    chamador. O bloco deve terminar fora de uma transação ('journal_mode' não muda dentro de uma).
+
+    :param cnx:     conexão com o banco de dados local
+    :param pragmas: valor de cada PRAGMA dentro do bloco
+    """
+    anteriores = {}
+    for pragma in pragmas:
+        if not re.fullmatch(r'\w+', pragma):
+            raise ValueError(f"PRAGMA inválido: {pragma}")
+        anteriores[pragma] = cnx.execute(f"pragma {pragma}").fetchone()[0]
+
+    set_pragmas(cnx, pragmas)
+    try:
+        yield cnx
+    finally:
+        set_pragmas(cnx, anteriores)
+
+
+def get_pragmas(opcoes):
+    """
+    :param opcoes: PRAGMAs no formato 'nome=valor' (opção '--pragma' de 'main.py')
+    :return:       valor de cada PRAGMA
+    """
+    pragmas = {}
+
+    for opcao in opcoes or []:
+        pragma, separador, valor = opcao.partition('=')
+        if not separador:
+            raise ValueError(f"PRAGMA sem valor: '{opcao}' (formato: nome=valor)")
+        pragmas[pragma.strip()] = valor.strip()
+
+    return pragmas
+
+
+def get_caminho_junto_ao_banco(cnx, caminho):
+    """
+    :param cnx:     conexão com o banco de dados local
+    :param caminho: caminho relativo ao diretório do banco de dados (ou absoluto)
+    :return:        caminho no diretório do arquivo do banco, e não no diretório de trabalho (o próprio caminho, no
+                    banco em memória)
+    """
+    arquivo = cnx.execute("pragma database_list").fetchone()[2]
+
+    return os.path.join(os.path.dirname(arquivo), caminho) if arquivo else caminho
+
+
+class Escrita:
+    def __init__(self, cnx):
+        """
+        Escritas de uma rota aplicadas imediatamente na conexão (execução em um único processo)
+
+        Os arquivos preparados pelos armazenamentos em arquivo ('src/scenarios.py') acompanham as transações: são
+        movidos para o destino apenas após o commit, e descartados no rollback ('move' e 'remove').
+
+        :param cnx: conexão com o banco de dados local
+        """
+        self.cnx = cnx
+        self.aninhamento = 0
+        self.arquivos = []
+
+    def execute(self, query, parametros=()):
+        self.cnx.execute(query, parametros)
+
+    def executemany(self, query, linhas):
+        self.cnx.executemany(query, linhas)
+
+    def append(self, tabela, df):
+        """
+        :param tabela: tabela de destino
+        :param df:     linhas a serem adicionadas (colunas com os nomes da tabela)
+        """
+        insert = f"insert into {tabela} ({', '.join(df.columns)}) values ({', '.join('?' * df.shape[1])})"
+
+        self.cnx.executemany(insert, df.itertuples(index=False, name=None))
+        contar('linhas_gravadas', len(df))
+
+    def move(self, origem, destino):
+        """
+        :param origem:  arquivo ou diretório preparado
+        :param destino: caminho definitivo, substituído no commit
+        """
+        self.arquivos += [('move', origem, destino)]
+
+    def remove(self, caminho):
+        """
+        :param caminho: arquivo ou diretório removido no commit
+        """
+        self.arquivos += [('remove', caminho)]
+
+    def get_arquivos(self):
+        """
+        :return: operações em arquivos ainda não aplicadas, na ordem em que foram registradas
+        """
+        return self.arquivos
+
+    @contextmanager
+    def transacao(self):
+        """
+        Unidade de trabalho (uso: 'with escrita.transacao(): ...'): os commits intermediários dentro do bloco são
+        adiados, e todas as escritas do bloco são gravadas em um único commit ao final, ou desfeitas em caso de erro
+        """
+        if not self.aninhamento:
+            self.begin()
+
+        self.aninhamento += 1
+        try:
+            yield self
+        except BaseException:
+            self.aninhamento -= 1
+            if not self.aninhamento:
+                self.rollback()
+            raise
+
+        self.aninhamento -= 1
+        self.commit()
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        if not self.aninhamento:
+            self.cnx.commit()
+            apply_arquivos(self.arquivos)
+            self.arquivos = []
+
+    def rollback(self):
+        self.cnx.rollback()
+        discard_arquivos(self.arquivos)
+        self.arquivos = []
+
+
+class EscritaAdiada(Escrita):
+    def __init__(self):
+        """
+        Escritas de uma rota registradas em ordem para serem aplicadas depois, pelo único processo escritor
+        ('apply_escritas'). Os processos que simulam as rotas apenas leem o banco de dados.
+        """
+        super().__init__(None)
+        self.operacoes = []
+        self.inicio_da_transacao = 0
+
+    def execute(self, query, parametros=()):
+        self.operacoes += [('execute', query, tuple(parametros))]
+
+    def executemany(self, query, linhas):
+        self.operacoes += [('executemany', query, list(linhas))]
+
+    def append(self, tabela, df):
+        self.operacoes += [('append', tabela, df)]
+
+    def move(self, origem, destino):
+        self.operacoes += [('move', origem, destino)]
+
+    def remove(self, caminho):
+        self.operacoes += [('remove', caminho)]
+
+    def get_arquivos(self):
+        return [operacao for operacao in self.operacoes if operacao[0] in ('move', 'remove')]
+
+    def begin(self):
+        self.inicio_da_transacao = len(self.operacoes)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        # as operações da transação desfeita não chegam ao escritor
+        discard_arquivos(self.operacoes[self.inicio_da_transacao:])
+        del self.operacoes[self.inicio_da_transacao:]
+
+
+def apply_escritas(cnx, operacoes):
+    """
+    Aplica as escritas registradas de uma rota em uma única transação: em caso de erro, nada da rota é gravado (e os
+    arquivos preparados pela rota são descartados)
+
+    :param cnx:       conexão do processo escritor
+    :param operacoes: operações registradas por 'EscritaAdiada'
+    """
+    escrita = Escrita(cnx)
+
+    try:
+        with escrita.transacao():
+            for operacao, *argumentos in operacoes:
+                getattr(escrita, operacao)(*argumentos)
+    except BaseException:
+        discard_arquivos(operacoes)
+        raise
+
+
+def apply_arquivos(operacoes):
+    """
+    :param operacoes: operações em arquivos registradas por 'Escrita' ('move' substitui o destino pelo arquivo ou
+                      diretório preparado, com uma renomeação no mesmo sistema de arquivos)
+    """
+    for operacao, caminho, *destino in operacoes:
+        if operacao == 'remove':
+            remove_caminho(caminho)
+        elif operacao == 'move' and os.path.exists(caminho):
+            remove_caminho(destino[0])
+            os.makedirs(os.path.dirname(destino[0]), exist_ok=True)
+            os.replace(caminho, destino[0])
+
+
+def discard_arquivos(operacoes):
+    """
+    :param operacoes: operações registradas por 'Escrita' ou 'EscritaAdiada' (os arquivos preparados são removidos)
+    """
+    for operacao, caminho, *_ in operacoes:
+        if operacao == 'move':
+            remove_caminho(caminho)
+
+
+def remove_caminho(caminho):
+    if os.path.isdir(caminho):
+        shutil.rmtree(caminho, ignore_errors=True)
+    elif os.path.exists(caminho):
+        os.remove(caminho)
@@ -0,0 +1,173 @@
+from statistics import NormalDist
+
+import numpy as np
+
+
+# o score fuzzy é limitado ao universo da variável de saída (ver 'src/fuzzy.py')
+LIMITES_DO_SCORE = (0, 10)
+INTERVALOS_DO_HISTOGRAMA = 1000
+
+QUANTIS = {'p05': 0.05, 'p50': 0.50, 'p95': 0.95}
+CONFIANCA = 0.95
+
+# cenários simulados e avaliados por vez no modo 'streaming' de 'Simulador' (potência de 2 para a sequência de Sobol)
+CENARIOS_POR_LOTE = 64
+
+# lotes mínimos antes de avaliar o critério de parada adaptativo (erro padrão estimado pelas médias dos lotes)
+MINIMO_DE_LOTES = 4
+
+
+class EstatisticasOnline:
+    def __init__(self, limites=LIMITES_DO_SCORE, intervalos=INTERVALOS_DO_HISTOGRAMA):
+        """
+        Estatísticas acumuladas lote a lote, sem guardar os valores observados:
+            - média e variância pelo método de Welford, com a combinação de lotes de Chan et al.
+            - quantis por um histograma de intervalos fixos sobre um domínio limitado
+
+        Duas instâncias com os mesmos limites podem ser combinadas ('merge'), por exemplo entre processos.
+
+        :param limites:    domínio dos valores observados (valores fora dele são contados nos extremos)
+        :param intervalos: quantidade de intervalos do histograma (resolução dos quantis)
+        """
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+
+        self.limites = limites
+        self.histograma = np.zeros(intervalos, dtype=np.int64)
+
+    def update(self, valores):
+        """
+        :param valores: lote de valores observados
+        """
+        valores = np.asarray(valores, dtype=float)
+        if len(valores) == 0:
+            return
+
+        media = valores.mean()
+        self.combine(len(valores), media, ((valores - media) ** 2).sum())
+
+        self.histograma += np.histogram(np.clip(valores, *self.limites), bins=len(self.histograma),
+                                        range=self.limites)[0]
+
+    def merge(self, outra):
+        """
+        :param outra: estatísticas de outro conjunto de valores, com o mesmo histograma
+        """
+        self.combine(outra.n, outra.media, outra.m2)
+        self.histograma += outra.histograma
+
+    def combine(self, n, media, m2):
+        total = self.n + n
+        if total == 0:
+            return
+
+        delta = media - self.media
+
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.media += delta * n / total
+        self.n = total
+
+    @property
+    def variancia(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def erro_padrao(self):
+        return np.sqrt(self.variancia / self.n) if self.n > 0 else np.inf
+
+    def get_intervalo_de_confianca(self, confianca=CONFIANCA):
+        """
+        :param confianca: nível de confiança do intervalo
+        :return:          limites inferior e superior do intervalo de confiança da média (aproximação normal)
+        """
+        z = NormalDist().inv_cdf(0.5 + confianca / 2)
+
+        return self.media - z * self.erro_padrao, self.media + z * self.erro_padrao
+
+    def get_quantil(self, q):
+        """
+        :param q: probabilidade acumulada (0 a 1)
+        :return:  quantil aproximado, interpolado linearmente dentro do intervalo do histograma
+        """
+        if self.n == 0:
+            return np.nan
+
+        acumulado = np.cumsum(self.histograma)
+        intervalo = int(np.searchsorted(acumulado, q * self.n))
+        intervalo = min(intervalo, len(self.histograma) - 1)
+
+        anterior = acumulado[intervalo - 1] if intervalo > 0 else 0
+        fracao = (q * self.n - anterior) / max(self.histograma[intervalo], 1)
+
+        largura = (self.limites[1] - self.limites[0]) / len(self.histograma)
+
+        return self.limites[0] + (intervalo + fracao) * largura
+
+
+def get_pesos_por_saida(saida_por_celula, duracao):
+    """
+    Matriz de pesos para o score de um cenário em cada horário de saída: a média das células da saída
+    ponderada pela duração do trecho (tempo de exposição)
+
+    :param saida_por_celula: índice do horário de saída de cada célula
+    :param duracao:          duração do trecho de cada célula (minutos)
+    :return:                 matriz (saídas x células) cujas linhas somam 1
+    """
+    pesos = np.zeros((saida_por_celula.max() + 1, len(saida_por_celula)))
+    pesos[saida_por_celula, np.arange(len(saida_por_celula))] = duracao
+
+    return pesos / pesos.sum(axis=1, keepdims=True)
+
+
+def get_scores_por_saida(score, duracoes, saida_por_celula):
+    """
+    Score de cada cenário por horário de saída quando os pesos mudam entre cenários (atrasos sorteados, ver
+    'Simulador.get_duracoes'): a média das células percorridas no cenário ponderada pela duração do trecho
+
+    :param score:            matriz (células x cenários) com o score de cada célula
+    :param duracoes:         matriz (células x cenários) com a duração do trecho (zero nas células não percorridas)
+    :param saida_por_celula: índice do horário de saída de cada célula (células ordenadas por saída)
+    :return:                 matriz (saídas x cenários), uma linha por saída presente em 'saida_por_celula'
+    """
+    _, primeiras = np.unique(saida_por_celula, return_index=True)
+
+    return np.add.reduceat(score * duracoes, primeiras) / np.add.reduceat(duracoes, primeiras)
+
+
+def get_lotes(orcamento, ativas, cenarios_por_lote=CENARIOS_POR_LOTE):
+    """
+    Lotes de cenários dentro de um orçamento de pares (cenário, saída): cada lote consome o seu tamanho vezes a
+    quantidade de saídas ativas, então o orçamento das saídas eliminadas na corrida passa às saídas restantes. Sem
+    eliminações, cada saída recebe 'orcamento / len(ativas)' cenários
+
+    :param orcamento:         quantidade total de pares (cenário, saída) a simular
+    :param ativas:            máscara das saídas ainda simuladas (consultada a cada lote, pode mudar entre lotes)
+    :param cenarios_por_lote: tamanho máximo de cada lote
+    :return:                  gerador do primeiro cenário e do tamanho de cada lote
+    """
+    primeiro_cenario = 0
+
+    while 0 < ativas.sum() <= orcamento:
+        tamanho = int(min(cenarios_por_lote, orcamento // ativas.sum()))
+        orcamento -= tamanho * ativas.sum()
+
+        yield primeiro_cenario, tamanho
+
+        primeiro_cenario += tamanho
+
+
+def get_eliminadas(medias_dos_lotes, ativas, confianca=CONFIANCA):
+    """
+    Regra de eliminação da corrida entre horários de saída: uma saída é eliminada quando o limite superior do
+    intervalo de confiança do seu score fica abaixo do limite inferior do intervalo da saída líder
+
+    :param medias_dos_lotes: estatísticas das médias dos lotes de cada saída (lotes de mesmo tamanho)
+    :param ativas:           índices das saídas ainda na corrida
+    :param confianca:        nível de confiança dos intervalos
+    :return:                 índice da saída líder e índices das saídas eliminadas na rodada
+    """
+    intervalos = {saida: medias_dos_lotes[saida].get_intervalo_de_confianca(confianca) for saida in ativas}
+    lider = max(ativas, key=lambda saida: medias_dos_lotes[saida].media)
+
+    return lider, [saida for saida in ativas if intervalos[saida][1] < intervalos[lider][0]]
@@ -1,10 +1,14 @@
-import time
 import logging
 
+import pandas as pd
+
 
 FORMATTER = logging.Formatter("[%(asctime)s] %(message)s", datefmt="%d/%m/%Y %H:%M:%S")
 LOG_FILE = "simulation.log"
 
+# calendário fixo de 365 dias, utilizado para comparar a mesma data em anos diferentes
+MINUTOS_NO_ANO = 365 * 24 * 60
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -18,18 +22,24 @@ logger.addHandler(ch)
 logger.addHandler(fh)
 
 
-def cronometro(func):
+def get_dia_do_ano(data):
     """
-    Função de suporte para a contagem de tempo gasta em cada parte do sistema.
+    Dia do ano em um calendário fixo de 365 dias: em anos bissextos, 29/02 é tratado como 28/02 e os dias seguintes
+    são deslocados, para que a mesma data do calendário tenha o mesmo índice em todos os anos
 
-    :param func: função a ser medida
-    :return: empacotamento do cronometro
+    :param data: data (ou série de datas)
+    :return:     dia do ano (1 a 365)
     """
-    def wrapper(*args, **kwargs):
-        inicio = time.time()
-        func(*args, **kwargs)
-        fim = time.time()
+    calendario = data.dt if isinstance(data, pd.Series) else pd.Timestamp(data)
+
+    return calendario.dayofyear - (calendario.is_leap_year & (calendario.dayofyear >= 60))
 
-        logger.info(f"'{func.__name__}' ({(fim - inicio):.4f} segundos)")
 
-    return wrapper
+def get_minuto_do_ano(data):
+    """
+    :param data: data (ou série de datas)
+    :return:     minutos desde o início do ano no calendário fixo de 'get_dia_do_ano'
+    """
+    calendario = data.dt if isinstance(data, pd.Series) else pd.Timestamp(data)
+
+    return (get_dia_do_ano(data) - 1) * 24 * 60 + calendario.hour * 60 + calendario.minute
@@ -0,0 +1,62 @@
+import os
+import sqlite3
+
+import pytest
+
+from src.integrate import Integrador
+from tests.inmet import get_clima, write_arquivo_inmet
+
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# rota sintética: três cidades, dois trechos (o segundo termina com a parada de descanso) e dez anos de histórico
+ESTACOES = ['A001', 'A002', 'A003']
+TRECHOS = [(1, 2, 240), (2, 3, 300)]
+ANOS = range(2013, 2023)
+INICIO_DA_ROTA = '2023-07-15'
+
+
+@pytest.fixture
+def projeto(tmp_path, monkeypatch):
+    """
+    Diretório de trabalho temporário com os scripts de 'db/' do repositório e uma pasta 'data/' vazia, como o
+    'Integrador' espera encontrar na raiz do projeto
+    """
+    os.symlink(os.path.join(RAIZ, 'db'), tmp_path / 'db')
+    os.makedirs(tmp_path / 'data')
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
+
+
+@pytest.fixture
+def banco(projeto):
+    """
+    Conexão com um banco de dados vazio no diretório do projeto
+    """
+    cnx = sqlite3.connect(projeto / 'teste.sqlite')
+    yield cnx
+    cnx.close()
+
+
+@pytest.fixture
+def rota(banco):
+    """
+    Banco com a rota sintética ativa (rota 1) e o histórico das suas estações carregado pelo 'Integrador'
+    """
+    for estacao_id in ESTACOES:
+        for ano in ANOS:
+            write_arquivo_inmet('data', estacao_id, get_clima(estacao_id, ano))
+
+    Integrador(banco)
+    banco.executemany("insert into cidades (cidade_id, cidade, estacao_id) values (?, ?, ?)",
+                      [(cidade_id, f'CIDADE {cidade_id}', estacao_id)
+                       for cidade_id, estacao_id in enumerate(ESTACOES, start=1)])
+    banco.execute("insert into rotas (rota_id, origem, destino, inicio, ativo) values (1, 1, ?, ?, 1)",
+                  (len(ESTACOES), INICIO_DA_ROTA))
+    banco.executemany("insert into transit_time (rota_id, origem, destino, transit_time) values (1, ?, ?, ?)", TRECHOS)
+    banco.commit()
+
+    Integrador(banco, atualizar_base=True)
+
+    return banco
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# colunas dos arquivos anuais do INMET (a partir de 2019) lidas por 'read_arquivo_inmet': as demais ficam vazias
+COLUNAS_INMET = 19
+COLUNA_POR_MEDIDA = {'temperatura': 7, 't_max': 9, 't_min': 10, 'u_max': 13, 'u_min': 14, 'umidade': 15}
+
+
+def get_clima(estacao_id, ano, inicio='07-10', fim='07-20'):
+    """
+    Série horária (UTC) com ciclo diário de temperatura e umidade inversamente relacionada à temperatura, sempre a
+    mesma para a estação e o ano
+
+    :param estacao_id: código da estação ('A' seguido de um número)
+    :param ano:        ano da série
+    :param inicio:     primeiro dia da série, MM-DD
+    :param fim:        último dia da série, MM-DD
+    :return:           série horária com as medidas de 'dados_metereologicos'
+    """
+    horarios = pd.date_range(f'{ano}-{inicio} 00:00', f'{ano}-{fim} 23:00', freq='h')
+    rng = np.random.default_rng([int(estacao_id[1:]), ano])
+    hora_local = (horarios.hour.values - 3) % 24
+
+    temperatura = 18 + 8 * np.cos(2 * np.pi * (hora_local - 15) / 24) + rng.normal(0, 1.5, len(horarios))
+    umidade = np.clip(75 - 2.5 * (temperatura - 18) + rng.normal(0, 5, len(horarios)), 10, 98)
+
+    return pd.DataFrame({'horario': horarios, 'temperatura': temperatura, 't_max': temperatura + 0.5,
+                         't_min': temperatura - 0.5, 'umidade': umidade, 'u_max': umidade + 2, 'u_min': umidade - 2})
+
+
+def write_arquivo_inmet(caminho_dos_dados, estacao_id, clima):
+    """
+    Grava a série no formato dos arquivos do INMET: 8 linhas de metadados, cabeçalho, separador ';', vírgula decimal
+    e codificação windows-1252, em 'caminho_dos_dados/<ano>/INMET_<região>_<UF>_<código>_<localidade>_...CSV'
+
+    :param caminho_dos_dados: diretório dos arquivos do INMET
+    :param estacao_id:        código da estação
+    :param clima:             série horária de 'get_clima' (de um único ano)
+    :return:                  caminho do arquivo gravado
+    """
+    ano = clima['horario'].dt.year.iloc[0]
+
+    colunas = [np.full(len(clima), '')] * COLUNAS_INMET
+    colunas[0] = clima['horario'].dt.strftime('%Y/%m/%d').values
+    colunas[1] = clima['horario'].dt.strftime('%H00 UTC').values
+    for medida, coluna in COLUNA_POR_MEDIDA.items():
+        valores = np.char.mod('%.1f' if medida[0] == 't' else '%.0f', clima[medida].values)
+        colunas[coluna] = np.char.replace(valores, '.', ',')
+
+    caminho = os.path.join(caminho_dos_dados, str(ano), f'INMET_CO_GO_{estacao_id}_LOCAL {estacao_id}_01-01-{ano}_A_'
+                                                         f'31-12-{ano}.CSV')
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+
+    with open(caminho, 'w', encoding='windows-1252', newline='') as arquivo:
+        arquivo.write(''.join(f'METADADO {linha}:;\r\n' for linha in range(8)))
+        arquivo.write(';'.join(['Data', 'Hora UTC', *[f'COLUNA {coluna}' for coluna in range(2, COLUNAS_INMET)]])
+                      + ';\r\n')
+        arquivo.writelines(';'.join(linha) + ';\r\n' for linha in zip(*colunas))
+
+    return caminho
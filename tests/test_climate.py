@@ -0,0 +1,88 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.climate import get_cubo, write_cubo
+from src.integrate import Integrador
+from src.simulate import Simulador
+from src.utils import get_dia_do_ano
+
+
+# dias carregados: viradas de ano e o fim de fevereiro de um ano bissexto (2020) e de um ano comum (2021)
+PERIODOS = [('2019-12-25', '2020-01-06'), ('2020-02-25', '2020-03-03'), ('2020-12-25', '2021-01-06'),
+            ('2021-02-25', '2021-03-03')]
+
+
+@pytest.fixture
+def cnx(banco):
+    Integrador(banco, caminho_cubo=None)
+
+    banco.executemany("insert into estacoes (estacao_id) values (?)", [('A001',), ('A002',), ('A003',)])
+    banco.executemany("insert into cidades (cidade_id, cidade, estacao_id) values (?, ?, ?)",
+                      [(1, 'CIDADE 1', 'A001'), (2, 'CIDADE 2', 'A002'), (3, 'CIDADE 3', 'A003')])
+
+    # horas sem registro e medidas ausentes em parte das horas registradas (a estação 'A003' não tem dados)
+    rng = np.random.default_rng(0)
+    horas = pd.DatetimeIndex(np.concatenate([pd.date_range(inicio, f'{fim} 23:00', freq='h')
+                                             for inicio, fim in PERIODOS]))
+    dm = pd.concat([pd.DataFrame({'estacao_id': estacao_id, 'timestamp': horas}) for estacao_id in ['A001', 'A002']])
+    dm = dm[rng.random(len(dm)) > 0.1]
+
+    medidas = pd.DataFrame(np.round(rng.normal(25, 5, (len(dm), 6)), 1),
+                           columns=['temperatura', 't_max', 't_min', 'umidade', 'u_max', 'u_min'])
+    medidas[rng.random(medidas.shape) < 0.05] = np.nan
+
+    dm = pd.concat([dm.reset_index(drop=True), medidas], axis=1).assign(
+        dia_do_ano=lambda row: get_dia_do_ano(row['timestamp']), hora=lambda row: row['timestamp'].dt.hour,
+        timestamp=lambda row: row['timestamp'].dt.strftime('%Y-%m-%d %H:%M'))
+
+    banco.executemany(f"insert into dados_metereologicos ({', '.join(dm.columns)}) "
+                      f"values ({', '.join('?' * dm.shape[1])})",
+                      dm.astype(object).where(dm.notna(), None).itertuples(index=False, name=None))
+    banco.execute("insert into manifesto (caminho, estacao_id, ano, hash, carregado) values ('a.csv', 'A001', 2020, "
+                  "'1', 1)")
+    banco.commit()
+
+    return banco
+
+
+def read_dados(cnx, cubo, dia_inicial, dia_final):
+    """
+    :return: leitura de 'Simulador.get_dados_metereologicos' (pelo cubo ou pela tabela), em ordem fixa
+    """
+    simulador = SimpleNamespace(cnx=cnx, cubo=cubo)
+    dm = Simulador.get_dados_metereologicos(simulador, [1, 2, 3], dia_inicial, dia_final)
+
+    return dm.sort_values(list(dm.columns), ignore_index=True)
+
+
+@pytest.mark.parametrize('dia_inicial, dia_final', [(360, 5), (365, 1), (355, 365), (1, 6), (56, 62), (59, 59),
+                                                    (60, 60), (1, 365)])
+def test_cubo_igual_a_tabela(cnx, dia_inicial, dia_final):
+    write_cubo(cnx)
+    cubo = get_cubo(cnx)
+    assert cubo is not None
+
+    tabela = read_dados(cnx, None, dia_inicial, dia_final)
+
+    assert not tabela.empty
+    pd.testing.assert_frame_equal(read_dados(cnx, cubo, dia_inicial, dia_final), tabela, check_dtype=False)
+
+
+def test_cubo_desatualizado(cnx, tmp_path):
+    write_cubo(cnx)
+    versao = get_cubo(cnx).versao
+
+    cnx.execute("update manifesto set hash = '2'")
+    cnx.commit()
+    assert get_cubo(cnx) is None
+
+    write_cubo(cnx)
+    cubo = get_cubo(cnx)
+    assert cubo is not None and cubo.versao != versao
+
+    # a nova geração substitui o índice e remove os dados da versão anterior
+    assert sorted(os.listdir(tmp_path / 'cubo')) == [f'dados_{cubo.versao}.npy', 'indice.json']
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from src.climatology import CHAVES, ESTATISTICAS, Resumo, combine_resumos, get_resumos, write_climatologia
+from src.integrate import Integrador
+from src.monte_carlo import fit_nativo, fit_resumo
+from tests.inmet import get_clima, write_arquivo_inmet
+
+
+@pytest.fixture
+def dm():
+    """
+    Dez anos de observações de duas estações em três dias e duas horas, com medidas ausentes
+    """
+    rng = np.random.default_rng(0)
+    chaves = pd.MultiIndex.from_product([['A001', 'A002'], [59, 60, 365], [0, 12], range(10)],
+                                        names=[*CHAVES[:3], 'ano']).to_frame(index=False)
+    medidas = {'temperatura': rng.gamma(9, 2.5, len(chaves)), 'umidade': rng.uniform(20, 100, len(chaves))}
+
+    dm = chaves.assign(temperatura=medidas['temperatura'],
+                       t_max=medidas['temperatura'] + rng.uniform(0, 2, len(chaves)),
+                       t_min=medidas['temperatura'] - rng.uniform(0, 2, len(chaves)), umidade=medidas['umidade'],
+                       u_max=np.minimum(medidas['umidade'] + 5, 100), u_min=medidas['umidade'] - 5)
+    dm.loc[rng.random(len(dm)) < 0.1, ['temperatura', 'u_max']] = np.nan
+
+    return dm.drop(columns=['ano'])
+
+
+def get_resumo(linha):
+    return Resumo(linha['medida'], *[linha[coluna] for coluna in ESTATISTICAS], linha['histograma'])
+
+
+def assert_resumos_iguais(resumos, esperados):
+    resumos = resumos.sort_values(CHAVES, ignore_index=True)
+    esperados = esperados.sort_values(CHAVES, ignore_index=True)
+
+    pd.testing.assert_frame_equal(resumos[CHAVES + ESTATISTICAS], esperados[CHAVES + ESTATISTICAS], check_dtype=False)
+    for histograma, esperado in zip(resumos['histograma'], esperados['histograma']):
+        np.testing.assert_array_equal(histograma, esperado)
+
+
+def test_resumo_igual_as_observacoes(dm):
+    resumos = get_resumos(dm)
+    assert len(resumos) == 2 * 3 * 2 * 2
+
+    for _, linha in resumos.iterrows():
+        colunas = ['temperatura', 't_max', 't_min'] if linha['medida'] == 'temperatura' else ['umidade', 'u_max',
+                                                                                              'u_min']
+        celula = dm[(dm[CHAVES[:3]] == linha[CHAVES[:3]].values).all(axis=1)]
+        valores = celula[colunas].values.ravel()
+        valores = valores[~np.isnan(valores)]
+        resumo = get_resumo(linha)
+
+        assert resumo.n == len(valores) == resumo.histograma.sum()
+        assert (resumo.minimo, resumo.maximo) == (valores.min(), valores.max())
+        assert resumo.media == pytest.approx(valores.mean(), rel=1e-12)
+        assert resumo.desvio == pytest.approx(valores.std(), rel=1e-9)
+        assert resumo.assimetria == pytest.approx(stats.skew(valores), rel=1e-6, abs=1e-9)
+
+
+def test_resumos_combinados_igual_ao_resumo_do_todo(dm):
+    primeira, segunda = dm.iloc[::2], dm.iloc[1::2]
+
+    assert_resumos_iguais(combine_resumos(pd.concat([get_resumos(primeira), get_resumos(segunda)]), CHAVES),
+                          get_resumos(dm))
+
+
+def test_fit_resumo_proximo_do_nativo():
+    data = np.random.default_rng(1).gamma(9, 2.5, 3000)
+    resumo = get_resumo(get_resumos(pd.DataFrame({'estacao_id': 'A001', 'dia_do_ano': 1, 'hora': 0,
+                                                  'temperatura': data, 't_max': np.nan, 't_min': np.nan,
+                                                  'umidade': np.nan, 'u_max': np.nan, 'u_min': np.nan})).iloc[0])
+
+    ajuste, params = fit_resumo(resumo)
+    esperada, ajustada = getattr(stats, fit_nativo(data)[0])(*fit_nativo(data)[1]), getattr(stats, ajuste)(*params)
+
+    assert ajustada.mean() == pytest.approx(esperada.mean(), rel=1e-3)
+    assert ajustada.std() == pytest.approx(esperada.std(), rel=0.02)
+
+
+def test_climatologia_somada_no_banco(banco, dm):
+    Integrador(banco)
+
+    # cargas sucessivas somam os resumos às chaves já gravadas (upsert)
+    write_climatologia(banco, get_resumos(dm.iloc[::2]))
+    write_climatologia(banco, get_resumos(dm.iloc[1::2]))
+    banco.commit()
+
+    gravados = pd.read_sql("select * from climatologia", banco)
+    gravados['histograma'] = [np.frombuffer(histograma, dtype=np.uint16) for histograma in gravados['histograma']]
+
+    assert_resumos_iguais(gravados, get_resumos(dm))
+
+
+def test_climatologia_acompanha_arquivos_alterados(rota):
+    def assert_climatologia_dos_dados():
+        gravados = pd.read_sql("select * from climatologia", rota)
+        gravados['histograma'] = [np.frombuffer(histograma, dtype=np.uint16) for histograma in gravados['histograma']]
+
+        assert_resumos_iguais(gravados, get_resumos(pd.read_sql("select * from dados_metereologicos", rota)))
+
+    assert_climatologia_dos_dados()
+
+    # os resumos não permitem subtrair: a estação do arquivo alterado é recalculada a partir dos seus dados
+    clima = get_clima('A002', 2020)
+    caminho = write_arquivo_inmet('data', 'A002', clima.assign(umidade=clima['umidade'] / 2))
+    os.utime(caminho, (1_000_000, 1_000_000))
+    Integrador(rota, atualizar_base=True)
+
+    assert_climatologia_dos_dados()
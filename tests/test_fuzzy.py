@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import skfuzzy as fuzz
+from skfuzzy import control as ctrl
+
+from src.fuzzy import DOMINIO_TEMPERATURA, DOMINIO_UMIDADE, get_superficie_de_score, interpolate_superficie, score_fuzzy
+
+
+def get_score_skfuzzy(temperatura, umidade):
+    """
+    Sistema de controle do skfuzzy da versão original de 'get_fuzzy_results', com o universo das entradas nos
+    próprios valores avaliados
+
+    :param temperatura: valores de temperatura
+    :param umidade:     valores de umidade
+    :return:            score de cada par calculado pelo 'ControlSystemSimulation'
+    """
+    antecedente_temperatura = ctrl.Antecedent(universe=np.sort(temperatura), label='Temperatura')
+    antecedente_umidade = ctrl.Antecedent(universe=np.sort(umidade), label='Umidade')
+    score = ctrl.Consequent(universe=np.arange(0, 11, 1), label='Score', defuzzify_method='centroid')
+
+    antecedente_temperatura['Baixa'] = fuzz.trapmf(antecedente_temperatura.universe, [0, 0, 10, 25])
+    antecedente_temperatura['Media'] = fuzz.trimf(antecedente_temperatura.universe, [20, 25, 30])
+    antecedente_temperatura['Alta'] = fuzz.trapmf(antecedente_temperatura.universe, [25, 35, 40, 40])
+
+    antecedente_umidade['Baixa'] = fuzz.trapmf(antecedente_umidade.universe, [0, 0, 30, 50])
+    antecedente_umidade['Media'] = fuzz.trimf(antecedente_umidade.universe, [40, 60, 80])
+    antecedente_umidade['Alta'] = fuzz.trapmf(antecedente_umidade.universe, [70, 90, 100, 100])
+
+    score['Bom'] = fuzz.gaussmf(score.universe, mean=10, sigma=2)
+    score['Medio'] = fuzz.trimf(score.universe, [4, 5, 6])
+    score['Ruim'] = fuzz.gaussmf(score.universe, mean=0, sigma=2)
+
+    regras = {('Baixa', 'Baixa'): 'Bom', ('Baixa', 'Media'): 'Bom', ('Baixa', 'Alta'): 'Ruim',
+              ('Media', 'Baixa'): 'Bom', ('Media', 'Media'): 'Medio', ('Media', 'Alta'): 'Ruim',
+              ('Alta', 'Baixa'): 'Medio', ('Alta', 'Media'): 'Ruim', ('Alta', 'Alta'): 'Ruim'}
+
+    controlador = ctrl.ControlSystem(rules=[ctrl.Rule(antecedente_temperatura[termo_temperatura] &
+                                                      antecedente_umidade[termo_umidade], score[termo_score])
+                                            for (termo_temperatura, termo_umidade), termo_score in regras.items()])
+    simulador = ctrl.ControlSystemSimulation(controlador)
+    simulador.input['Temperatura'] = temperatura
+    simulador.input['Umidade'] = umidade
+    simulador.compute()
+
+    return simulador.output['Score']
+
+
+@pytest.fixture
+def entradas():
+    # pontos aleatórios no domínio e os vértices das funções de pertinência (cortes nulos e cortes em 1)
+    rng = np.random.default_rng(2)
+    vertices_temperatura = np.array([0, 10, 20, 25, 30, 35, 40], dtype=float)
+    vertices_umidade = np.array([0, 30, 40, 50, 60, 70, 80, 90, 100], dtype=float)
+    grade_temperatura, grade_umidade = np.meshgrid(vertices_temperatura, vertices_umidade)
+
+    temperatura = np.concatenate([rng.uniform(*DOMINIO_TEMPERATURA, 2000), grade_temperatura.ravel()])
+    umidade = np.concatenate([rng.uniform(*DOMINIO_UMIDADE, 2000), grade_umidade.ravel()])
+
+    return temperatura, umidade
+
+
+# o skfuzzy 0.5 ainda chama 'np.maximum' com o terceiro argumento posicional
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+def test_score_fuzzy_igual_ao_skfuzzy(entradas):
+    temperatura, umidade = entradas
+
+    np.testing.assert_allclose(score_fuzzy(temperatura, umidade), get_score_skfuzzy(temperatura, umidade),
+                               rtol=0, atol=1e-9)
+
+
+def test_score_fuzzy_independe_do_lote(entradas, monkeypatch):
+    temperatura, umidade = entradas
+    score = score_fuzzy(temperatura, umidade)
+
+    monkeypatch.setattr('src.fuzzy.TAMANHO_DO_LOTE', 7)
+
+    np.testing.assert_array_equal(score_fuzzy(temperatura, umidade), score)
+
+
+def test_superficie_proxima_do_score_exato(entradas):
+    temperatura, umidade = entradas
+
+    superficie = get_superficie_de_score()
+
+    np.testing.assert_allclose(interpolate_superficie(superficie, temperatura, umidade),
+                               score_fuzzy(temperatura, umidade), atol=0.05)
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from src import integrate
+from src.integrate import Integrador
+from src.utils import get_dia_do_ano
+from tests.inmet import get_clima, write_arquivo_inmet
+
+
+def test_chaves_de_calendario_de_base_antiga():
+    # base criada antes das colunas 'dia_do_ano' e 'hora', com anos comuns e bissextos
+    cnx = sqlite3.connect(':memory:')
+    cnx.execute("create table dados_metereologicos (estacao_id, timestamp, temperatura, t_max, t_min, umidade, "
+                "u_max, u_min)")
+
+    horarios = pd.date_range('2019-12-30 21:00', '2024-12-31 23:00', freq='7h')
+    cnx.executemany("insert into dados_metereologicos (estacao_id, timestamp, temperatura) values ('A001', ?, 20)",
+                    [(horario,) for horario in horarios.strftime('%Y-%m-%d %H:%M:%S')])
+
+    Integrador.create_chaves_de_calendario(SimpleNamespace(cnx=cnx))
+
+    dm = pd.read_sql("select timestamp, dia_do_ano, hora from dados_metereologicos order by timestamp", cnx,
+                     parse_dates=['timestamp'])
+
+    assert dm['dia_do_ano'].tolist() == get_dia_do_ano(dm['timestamp']).tolist()
+    assert dm['hora'].tolist() == dm['timestamp'].dt.hour.tolist()
+
+
+def get_chamadas(monkeypatch, funcao):
+    """
+    :return: lista preenchida com o primeiro argumento de cada chamada à função de 'src/integrate.py'
+    """
+    chamadas, original = [], getattr(integrate, funcao)
+
+    def registrar(caminho, *args, **kwargs):
+        chamadas.append(caminho)
+        return original(caminho, *args, **kwargs)
+
+    monkeypatch.setattr(integrate, funcao, registrar)
+
+    return chamadas
+
+
+def test_manifesto_carrega_apenas_arquivos_novos_ou_alterados(banco, monkeypatch):
+    clima = get_clima('A001', 2022)
+    caminho = write_arquivo_inmet('data', 'A001', clima)
+    os.utime(caminho, (1_000_000, 1_000_000))
+
+    Integrador(banco)
+    banco.execute("insert into cidades (cidade_id, cidade, estacao_id) values (1, 'CIDADE 1', 'A001')")
+    banco.commit()
+
+    def read_temperatura():
+        return pd.read_sql("select count(1) linhas, avg(temperatura) temperatura from dados_metereologicos",
+                           banco).iloc[0]
+
+    Integrador(banco, atualizar_base=True)
+    carga = read_temperatura()
+    assert carga['linhas'] == len(clima)
+    assert banco.execute("select carregado from manifesto").fetchall() == [(1,)]
+
+    # arquivo inalterado: nem o hash é calculado
+    hashes, leituras = get_chamadas(monkeypatch, 'get_hash_do_arquivo'), get_chamadas(monkeypatch, 'read_arquivo_inmet')
+    Integrador(banco, atualizar_base=True)
+    assert hashes == [] and leituras == []
+
+    # nova data de modificação com o mesmo conteúdo: o hash confirma que o arquivo não mudou
+    os.utime(caminho, (2_000_000, 2_000_000))
+    Integrador(banco, atualizar_base=True)
+    assert len(hashes) == 1 and leituras == []
+    assert banco.execute("select modificado from manifesto").fetchone()[0] == 2_000_000
+    pd.testing.assert_series_equal(read_temperatura(), carga)
+
+    # conteúdo alterado: os dados da estação-ano são substituídos, sem duplicar linhas
+    write_arquivo_inmet('data', 'A001', clima.assign(temperatura=clima['temperatura'] + 5))
+    os.utime(caminho, (3_000_000, 3_000_000))
+    Integrador(banco, atualizar_base=True)
+    assert len(leituras) == 1
+
+    recarga = read_temperatura()
+    assert recarga['linhas'] == len(clima)
+    assert recarga['temperatura'] - carga['temperatura'] == pytest.approx(5, abs=0.01)
+
+
+def test_pragmas_da_carga_respeitam_o_chamador(banco, monkeypatch):
+    write_arquivo_inmet('data', 'A001', get_clima('A001', 2022))
+
+    Integrador(banco)
+    banco.execute("insert into cidades (cidade_id, cidade, estacao_id) values (1, 'CIDADE 1', 'A001')")
+    banco.commit()
+
+    def read_pragmas():
+        return {pragma: banco.execute(f"pragma {pragma}").fetchone()[0]
+                for pragma in ['journal_mode', 'synchronous', 'cache_size']}
+
+    antes = read_pragmas()
+    durante, original = [], integrate.write_climatologia
+
+    def registrar(cnx, resumos):
+        durante.append(read_pragmas())
+        return original(cnx, resumos)
+
+    monkeypatch.setattr(integrate, 'write_climatologia', registrar)
+    Integrador(banco, atualizar_base=True, caminho_cubo=None, pragmas={'synchronous': 'FULL'})
+
+    # durante a carga, o 'synchronous' do chamador prevalece sobre o de 'PRAGMAS_DE_CARGA'
+    assert durante == [{'journal_mode': 'wal', 'synchronous': 2, 'cache_size': -200_000}]
+    assert read_pragmas() == antes
+
+
+def test_pragmas_restaurados_apos_erro_na_carga(banco, monkeypatch):
+    write_arquivo_inmet('data', 'A001', get_clima('A001', 2022))
+
+    Integrador(banco)
+    banco.execute("insert into cidades (cidade_id, cidade, estacao_id) values (1, 'CIDADE 1', 'A001')")
+    banco.commit()
+    cache_size = banco.execute("pragma cache_size").fetchone()[0]
+
+    def falhar(cnx, resumos):
+        raise RuntimeError('falha na carga')
+
+    monkeypatch.setattr(integrate, 'write_climatologia', falhar)
+    with pytest.raises(RuntimeError):
+        Integrador(banco, atualizar_base=True, caminho_cubo=None)
+
+    # o arquivo continua pendente no manifesto, sem linhas gravadas
+    assert banco.execute("pragma cache_size").fetchone()[0] == cache_size
+    assert banco.execute("select carregado from manifesto").fetchall() == [(0,)]
+    assert banco.execute("select count(1) from dados_metereologicos").fetchone()[0] == 0
@@ -0,0 +1,158 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.itinerary import (get_alcance_dos_trechos, get_duracoes_por_cenario, get_guia_de_alcance,
+                           get_guia_de_horarios, get_horas_do_alcance, get_observacoes_da_guia,
+                           get_quadro_de_horarios, get_saidas, get_sequencia_de_trechos, get_tempos_de_trecho)
+from src.utils import MINUTOS_NO_ANO
+
+
+def test_saidas_em_horario_comercial():
+    saidas = get_saidas(datetime(2023, 7, 15))
+
+    assert len(saidas) == 13
+    assert saidas[0] == datetime(2023, 7, 15, 6) and saidas[-1] == datetime(2023, 7, 15, 18)
+
+    # a última saída só entra quando cai exatamente no fim da janela
+    assert get_saidas(datetime(2023, 7, 15), intervalo=50)[-1] == datetime(2023, 7, 15, 17, 40)
+    assert len(get_saidas(datetime(2023, 7, 15), intervalo=30)) == 25
+
+
+def test_parada_de_descanso():
+    # 5h de viagem sem parada; o segundo trecho passa de 5h30 acumuladas e termina com 30 minutos de descanso
+    inicio, fim = get_tempos_de_trecho([300, 60, 60])
+
+    np.testing.assert_array_equal(inicio, [0, 300, 390])
+    np.testing.assert_array_equal(fim, [300, 390, 450])
+
+
+def test_parada_diaria():
+    # cada trecho de 5h30 termina com 30 minutos de descanso; ao completar 24h de viagem, a parada é de 8h
+    inicio, fim = get_tempos_de_trecho([330] * 5)
+
+    np.testing.assert_array_equal(inicio, [0, 360, 720, 1080, 1920])
+    np.testing.assert_array_equal(fim, [360, 720, 1080, 1920, 2280])
+
+
+def test_sequencia_de_trechos():
+    itinerario = pd.DataFrame({'origem': [3, 1, 2], 'destino': [4, 2, 3], 'transit_time': [30, 10, 20]})
+
+    trechos = get_sequencia_de_trechos(itinerario, 1, 4)
+
+    assert trechos['origem'].tolist() == [1, 2, 3]
+    assert trechos['transit_time'].tolist() == [10, 20, 30]
+
+
+# sem trecho partindo da origem, e um ciclo que nunca chega ao destino
+@pytest.mark.parametrize('origem, destino', [(4, 1), (1, 5)])
+def test_sequencia_de_trechos_incompleta(origem, destino):
+    itinerario = pd.DataFrame({'origem': [1, 2, 3], 'destino': [2, 3, 1], 'transit_time': [10, 20, 30]})
+
+    with pytest.raises(ValueError):
+        get_sequencia_de_trechos(itinerario, origem, destino)
+
+
+def test_quadro_de_horarios():
+    trechos = pd.DataFrame({'inicio': [0, 300, 390], 'fim': [300, 390, 450]})
+    saidas = [datetime(2023, 7, 15, 6), datetime(2023, 7, 15, 18)]
+
+    inicio, fim = get_quadro_de_horarios(trechos, saidas)
+
+    assert inicio.shape == fim.shape == (2, 3)
+    assert fim[1, -1] == np.datetime64('2023-07-16T01:30')
+    np.testing.assert_array_equal(inicio[:, 1:], fim[:, :-1])
+
+
+def test_guia_de_horarios():
+    # faixas de uma hora inteiramente contidas em um trecho: a faixa 2h-3h passa pelos dois trechos e fica de fora
+    trechos = pd.DataFrame({'origem': [1, 2], 'inicio': [0, 150], 'fim': [150, 300]})
+    saidas = [datetime(2023, 7, 15, 6), datetime(2023, 7, 15, 7, 30)]
+
+    guia = get_guia_de_horarios(trechos, saidas)
+
+    assert len(guia) == 8
+    assert guia['origem'].tolist() == [1, 1, 2, 2] * 2
+    assert (guia['duracao'] == 150).all()
+    assert ((guia['fim'] - guia['inicio']) == pd.Timedelta(hours=1)).all()
+    assert ((guia['inicio'] - guia['saida']) / pd.Timedelta(minutes=1)).tolist() == [0, 60, 180, 240] * 2
+
+
+def test_observacoes_da_guia_igual_ao_produto_com_filtro():
+    # faixas em hora cheia, fora da hora cheia, mais curtas que uma hora e virando o ano
+    inicios = [0, 30, 600, 1000, MINUTOS_NO_ANO - 90, MINUTOS_NO_ANO - 30, 120]
+    fins = [60, 90, 780, 1010, MINUTOS_NO_ANO - 30, 30, 120]
+    guia = pd.DataFrame({'faixa': range(len(inicios)), 'minuto_inicio': inicios, 'minuto_fim': fins})
+
+    observacoes = get_observacoes_da_guia(guia)
+
+    # referência: todas as horas do ano, mantidas as que caem na faixa no calendário circular
+    produto = guia.merge(pd.DataFrame({'minuto': np.arange(0, MINUTOS_NO_ANO, 60)}), how='cross')
+    na_faixa = ((produto['minuto'] - produto['minuto_inicio']) % MINUTOS_NO_ANO
+                <= (produto['minuto_fim'] - produto['minuto_inicio']) % MINUTOS_NO_ANO)
+
+    esperadas = produto[na_faixa].sort_values(['faixa', 'minuto'], ignore_index=True)
+    pd.testing.assert_frame_equal(observacoes.sort_values(['faixa', 'minuto'], ignore_index=True), esperadas,
+                                  check_dtype=False)
+    assert observacoes['faixa'].value_counts().reindex(guia['faixa'], fill_value=0).tolist() == [2, 1, 4, 0, 1, 1, 1]
+
+
+# trechos curtos e longos, para que os atrasos mudem o trecho das paradas de descanso e da parada diária
+TRANSIT_TIME = np.array([240, 90, 300, 60, 420, 180])
+ATRASO_MAXIMO = 120
+
+
+@pytest.fixture
+def transito_por_cenario():
+    atrasos = np.random.default_rng(0).integers(0, ATRASO_MAXIMO, (200, len(TRANSIT_TIME)), endpoint=True)
+    atrasos[0] = 0
+    atrasos[1] = ATRASO_MAXIMO
+
+    return TRANSIT_TIME + atrasos
+
+
+def get_trechos(inicio, fim):
+    trechos = pd.DataFrame({'origem': np.arange(len(inicio)), 'inicio': inicio, 'fim': fim})
+    trechos['inicio_minimo'], trechos['fim_maximo'] = get_alcance_dos_trechos(TRANSIT_TIME, ATRASO_MAXIMO)
+
+    return trechos
+
+
+def test_tempos_de_trecho_por_cenario(transito_por_cenario):
+    inicio, fim = get_tempos_de_trecho(transito_por_cenario)
+
+    for cenario, transito in enumerate(transito_por_cenario):
+        np.testing.assert_array_equal(np.stack([inicio[cenario], fim[cenario]]), get_tempos_de_trecho(transito))
+
+
+def test_alcance_contem_todos_os_cenarios(transito_por_cenario):
+    inicio_minimo, fim_maximo = get_alcance_dos_trechos(TRANSIT_TIME, ATRASO_MAXIMO)
+    inicio, fim = get_tempos_de_trecho(transito_por_cenario)
+
+    assert (inicio >= inicio_minimo).all() and (fim <= fim_maximo).all()
+
+
+@pytest.mark.parametrize('saida', [datetime(2023, 1, 2, 6), datetime(2023, 1, 2, 7, 30)])
+def test_duracoes_por_cenario_igual_a_guia_de_cada_cenario(transito_por_cenario, saida):
+    inicio, fim = get_tempos_de_trecho(transito_por_cenario)
+    trechos = get_trechos(*get_tempos_de_trecho(TRANSIT_TIME))
+
+    trecho, hora = get_horas_do_alcance(trechos, saida.minute != 0)
+    duracoes = get_duracoes_por_cenario(inicio, fim, trecho, hora, saida.minute != 0)
+    alcance = get_guia_de_alcance(trechos, [saida])
+
+    for cenario in range(len(transito_por_cenario)):
+        # referência: a guia e as observações do percurso do cenário, em horas cheias após a hora da saída
+        guia = get_guia_de_horarios(get_trechos(inicio[cenario], fim[cenario]), [saida])
+        minutos = (guia[['inicio', 'fim']] - pd.Timestamp('2023-01-01')) // pd.Timedelta(minutes=1)
+        observacoes = get_observacoes_da_guia(guia.assign(minuto_inicio=minutos['inicio'], minuto_fim=minutos['fim']))
+        esperadas = dict(zip(zip(observacoes['origem'], observacoes['minuto'] // 60 - (24 + saida.hour)),
+                             observacoes['duracao']))
+
+        assert {(t, h): d for t, h, d in zip(trecho, hora, duracoes[:, cenario]) if d > 0} == esperadas
+
+        # a guia de alcance cobre as faixas de todos os cenários
+        faixas = set(zip(guia['origem'], guia['inicio']))
+        assert faixas <= set(zip(alcance['origem'], alcance['inicio']))
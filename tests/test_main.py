@@ -0,0 +1,44 @@
+import pandas as pd
+
+from main import get_argumentos
+
+
+def executar(cnx, *argumentos):
+    opcoes = get_argumentos(['--banco', 'teste.sqlite', *argumentos])
+    opcoes.comando(cnx, opcoes)
+
+
+def test_simulacao_em_paralelo_sem_armazem(rota, projeto):
+    # sem '--armazem', a execução em paralelo grava os cenários no armazenamento em NumPy
+    executar(rota, 'simulate', '--rotas-em-paralelo', '2', '--metodo', 'nativo')
+
+    resultados = pd.read_sql("select * from resultados where rota_id = 1", rota)
+    assert len(resultados) == 13
+    assert (projeto / 'cenarios').is_dir()
+
+
+def test_relatorio_de_banco_vazio(banco, capsys):
+    executar(banco, 'report')
+
+    assert capsys.readouterr().out.strip() == "Nenhum resultado encontrado"
+
+
+def test_relatorio_com_os_melhores_horarios(rota, capsys):
+    executar(rota, 'simulate', '--streaming', '--metodo', 'nativo')
+    capsys.readouterr()
+
+    executar(rota, 'report', '--top', '1')
+    linhas = capsys.readouterr().out.strip().splitlines()
+
+    assert len(linhas) == 2 and linhas[0].split()[:4] == ['rota_id', 'origem', 'destino', 'ranking']
+
+
+def test_score_na_superficie_a_partir_dos_cenarios(rota):
+    executar(rota, 'simulate', '--metodo', 'nativo')
+    exato = pd.read_sql("select saida, score from resultados", rota).set_index('saida')['score']
+
+    executar(rota, 'score', '--superficie')
+    interpolado = pd.read_sql("select saida, score from resultados", rota).set_index('saida')['score']
+
+    assert (interpolado != exato[interpolado.index]).any()
+    assert (interpolado - exato[interpolado.index]).abs().max() < 0.05
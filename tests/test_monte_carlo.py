@@ -0,0 +1,112 @@
+import sys
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from src.monte_carlo import (best_fit_distribution, fit_nativo, get_estimadores, get_gerador, simulate_batch,
+                             triang_transformation)
+
+
+# células de famílias diferentes intercaladas, como as linhas de 'distribuicoes' de uma saída
+CELULAS = [('norm', [20, 3]), ('gamma', [4, 10, 2]), ('norm', [20, 3]), ('uniform', [5, 20]), ('norm', [-5, 0.5])]
+ESPERADAS = [stats.norm(20, 3), stats.gamma(4, 10, 2), stats.norm(20, 3), stats.uniform(5, 20), stats.norm(-5, 0.5)]
+
+# parâmetros na ordem do scipy, como os gravados em 'distribuicoes'
+DISTRIBUICOES = {'norm': (20, 3), 'gamma': (4, 10, 2), 'triang': (0.3, 15, 10), 'uniform': (5, 20)}
+
+
+def test_simulate_batch_segue_a_distribuicao_de_cada_celula():
+    dist_names, params = zip(*CELULAS)
+    amostras = simulate_batch(list(dist_names), list(params), size=50_000, rng=np.random.default_rng(0))
+
+    assert amostras.shape == (len(CELULAS), 50_000)
+    for amostra, esperada in zip(amostras, ESPERADAS):
+        assert amostra.mean() == pytest.approx(esperada.mean(), abs=0.02 * esperada.std())
+        assert amostra.std() == pytest.approx(esperada.std(), rel=0.02)
+
+    # células da mesma família sorteadas na mesma chamada não repetem os cenários
+    assert abs(np.corrcoef(amostras[0], amostras[2])[0, 1]) < 0.02
+
+
+def test_simulate_batch_familia_desconhecida():
+    amostras = simulate_batch(['norm', 'weibull', 'uniform'], [[0, 1], [1, 2, 3], [0, 1]], size=100,
+                              rng=np.random.default_rng(0))
+
+    assert np.isnan(amostras[1]).all()
+    assert np.isfinite(amostras[[0, 2]]).all()
+
+
+def test_simulate_batch_reprodutivel_por_chave():
+    dist_names, params = zip(*CELULAS)
+
+    def simular(*chaves):
+        return simulate_batch(list(dist_names), list(params), size=100, rng=get_gerador(7, *chaves))
+
+    np.testing.assert_array_equal(simular(1), simular(1))
+    assert not np.array_equal(simular(1), simular(2))
+
+
+@pytest.mark.parametrize('dist_name', list(DISTRIBUICOES))
+def test_estimadores_recuperam_os_parametros(dist_name):
+    params = DISTRIBUICOES[dist_name]
+    data = getattr(stats, dist_name).rvs(*params, size=20_000, random_state=np.random.default_rng(0))
+
+    # a forma da gama (método dos momentos na localização) é a estimativa mais dispersa
+    np.testing.assert_allclose(get_estimadores(data)[dist_name], params, rtol=0.1 if dist_name == 'gamma' else 0.02)
+
+
+@pytest.mark.parametrize('dist_name', list(DISTRIBUICOES))
+def test_fit_nativo_escolhe_distribuicao_equivalente(dist_name):
+    params = DISTRIBUICOES[dist_name]
+    data = getattr(stats, dist_name).rvs(*params, size=20_000, random_state=np.random.default_rng(1))
+
+    # uma gama de forma muito grande equivale a uma normal: a comparação é pela média e pelo desvio
+    ajuste, params_ajustados = fit_nativo(data)
+    esperada, ajustada = getattr(stats, dist_name)(*params), getattr(stats, ajuste)(*params_ajustados)
+
+    assert ajustada.mean() == pytest.approx(esperada.mean(), rel=0.01)
+    assert ajustada.std() == pytest.approx(esperada.std(), rel=0.03)
+
+
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+@pytest.mark.parametrize('deslocamento', [0, 1e-11, 1e-3])
+def test_estimadores_em_amostra_simetrica(deslocamento):
+    # assimetria nula ou quase nula: a localização da gama não pode ir a -infinito (nem dividir por zero)
+    metade = np.random.default_rng(2).normal(0, 1, 1000)
+    data = np.concatenate([metade, -metade])
+    data[np.argmax(data)] += deslocamento
+    estimadores = get_estimadores(data)
+
+    assert {'norm', 'triang', 'uniform'} <= set(estimadores)
+    assert all(np.isfinite(params).all() for params in estimadores.values())
+    if 'gamma' in estimadores:
+        assert estimadores['gamma'][1] >= data.min() - np.ptp(data)
+    assert fit_nativo(data)[0] == 'norm'
+
+
+def test_fit_nativo_amostra_constante():
+    assert fit_nativo(np.full(50, 7.5)) == ('norm', [7.5, 0.0])
+
+
+def test_triang_na_ordem_do_scipy():
+    c, loc, scale = DISTRIBUICOES['triang']
+    esperada = stats.triang(c, loc=loc, scale=scale)
+
+    aleatoria = triang_transformation(c, loc, scale, size=100_000, rng=np.random.default_rng(3))
+    inversa = triang_transformation(c, loc, scale, uniformes=(np.arange(100_000) + 0.5) / 100_000)
+
+    for amostra in [aleatoria, inversa]:
+        assert amostra.min() >= loc and amostra.max() <= loc + scale
+        assert amostra.mean() == pytest.approx(esperada.mean(), rel=0.005)
+        assert np.median(amostra) == pytest.approx(esperada.median(), rel=0.005)
+
+
+def test_distfit_opcional(monkeypatch):
+    data = np.random.default_rng(4).normal(20, 3, 500)
+    monkeypatch.setitem(sys.modules, 'distfit', None)
+
+    with pytest.raises(ImportError, match="pacote opcional 'distfit'"):
+        best_fit_distribution(data, metodo='distfit')
+
+    assert best_fit_distribution(data, metodo='nativo')[0] == 'norm'
@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.scenarios import PREPARACAO, ArmazemNumpy
+from src.scheduler import Escalonador
+from src.simulate import Simulador
+from src.storage import Escrita, EscritaAdiada, apply_escritas
+from tests.conftest import TRECHOS
+
+
+SAIDA = pd.Timestamp('2023-07-15 06:00')
+
+
+def get_cenarios(valor, tamanho=10):
+    return pd.DataFrame({'hora': '06:00:00', 'cidade_id': 1, 'duracao': 240, 'cenario': np.arange(1, tamanho + 1),
+                         'temperatura': valor, 'umidade': 60.0})
+
+
+def read_arquivos(caminho):
+    """
+    :return: conteúdo de cada arquivo abaixo do diretório (caminhos relativos)
+    """
+    arquivos = {}
+    for diretorio, _, nomes in os.walk(caminho):
+        for nome in nomes:
+            with open(os.path.join(diretorio, nome), 'rb') as file:
+                arquivos[os.path.relpath(os.path.join(diretorio, nome), caminho)] = file.read()
+
+    return arquivos
+
+
+def test_lotes_publicados_apenas_no_commit(banco, projeto):
+    escrita = Escrita(banco)
+    armazem = ArmazemNumpy(str(projeto / 'cenarios'), escrita)
+
+    with escrita.transacao():
+        armazem.write(1, SAIDA, get_cenarios(20.0))
+    assert armazem.read(1)['temperatura'].tolist() == [20.0] * 10
+    publicados = read_arquivos(projeto / 'cenarios' / 'rota_1')
+
+    # até o commit, a leitura considera as operações pendentes, e o diretório da rota não muda
+    with pytest.raises(RuntimeError):
+        with escrita.transacao():
+            armazem.clear(1)
+            armazem.write(1, SAIDA, get_cenarios(30.0, 5), lote=1)
+            assert armazem.get_saidas(1) == [SAIDA]
+            assert armazem.read(1)['temperatura'].tolist() == [30.0] * 5
+            assert read_arquivos(projeto / 'cenarios' / 'rota_1') == publicados
+            raise RuntimeError('falha na etapa')
+
+    assert armazem.read(1)['temperatura'].tolist() == [20.0] * 10
+    assert os.listdir(projeto / 'cenarios' / PREPARACAO) == []
+
+
+def test_escritas_adiadas_descartadas_no_escritor(banco, projeto):
+    escrita = EscritaAdiada()
+    armazem = ArmazemNumpy(str(projeto / 'cenarios'), escrita)
+
+    armazem.write(1, SAIDA, get_cenarios(20.0))
+    escrita.execute("insert into tabela_inexistente values (1)")
+
+    # a escrita da rota falha no processo escritor: nenhum cenário é publicado e os lotes preparados são removidos
+    with pytest.raises(Exception):
+        apply_escritas(banco, escrita.operacoes)
+
+    assert not os.path.exists(projeto / 'cenarios' / 'rota_1')
+    assert os.listdir(projeto / 'cenarios' / PREPARACAO) == []
+
+
+@pytest.fixture
+def duas_rotas(rota):
+    rota.execute("insert into rotas (rota_id, origem, destino, inicio, ativo) select 2, origem, destino, inicio, 1 "
+                 "from rotas where rota_id = 1")
+    rota.executemany("insert into transit_time (rota_id, origem, destino, transit_time) values (2, ?, ?, ?)", TRECHOS)
+    rota.commit()
+
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', armazem='numpy', graficos=None)
+
+    return rota
+
+
+def falhar_na_rota_1(monkeypatch):
+    """
+    A simulação da rota 1 falha depois de gravar os cenários da primeira saída
+    """
+    original = Simulador.write_cenarios
+
+    def write_cenarios(simulador, *args, **kwargs):
+        original(simulador, *args, **kwargs)
+        if simulador.rota_id == 1:
+            raise RuntimeError('falha na simulação')
+
+    monkeypatch.setattr(Simulador, 'write_cenarios', write_cenarios)
+
+
+def test_rota_com_falha_isolada_na_execucao_serial(duas_rotas, projeto, monkeypatch):
+    antes = {rota_id: read_arquivos(projeto / 'cenarios' / f'rota_{rota_id}') for rota_id in [1, 2]}
+    falhar_na_rota_1(monkeypatch)
+
+    simulador = Simulador(duas_rotas, seed=2, metodo_de_ajuste='nativo', armazem='numpy', graficos=None,
+                          incremental=False)
+
+    # a rota com falha mantém os cenários anteriores, e a outra rota é simulada normalmente
+    assert simulador.relatorio.set_index('rota_id')['status'].to_dict() == {1: 'falha', 2: 'ok'}
+    assert 'falha na simulação' in simulador.relatorio.set_index('rota_id').at[1, 'erro']
+    assert read_arquivos(projeto / 'cenarios' / 'rota_1') == antes[1]
+    assert read_arquivos(projeto / 'cenarios' / 'rota_2').keys() == antes[2].keys()
+    assert read_arquivos(projeto / 'cenarios' / 'rota_2') != antes[2]
+    assert os.listdir(projeto / 'cenarios' / PREPARACAO) == []
+
+
+def test_rota_com_falha_isolada_na_execucao_em_paralelo(duas_rotas, projeto, monkeypatch):
+    antes = read_arquivos(projeto / 'cenarios' / 'rota_1')
+    falhar_na_rota_1(monkeypatch)
+
+    # os processos do pool herdam a falha simulada (início por 'fork')
+    escalonador = Escalonador(str(projeto / 'teste.sqlite'), workers=2, seed=2, metodo_de_ajuste='nativo',
+                              graficos=None, incremental=False)
+
+    assert escalonador.relatorio.set_index('rota_id')['status'].to_dict() == {1: 'falha', 2: 'ok'}
+    assert read_arquivos(projeto / 'cenarios' / 'rota_1') == antes
+    assert os.listdir(projeto / 'cenarios' / PREPARACAO) == []
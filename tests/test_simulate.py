@@ -0,0 +1,193 @@
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from src import simulate
+from src.integrate import Integrador
+from src.monte_carlo import SIZE
+from src.simulate import Simulador
+from src.streaming import MINIMO_DE_LOTES
+from src.utils import get_dia_do_ano
+from tests.inmet import get_clima, write_arquivo_inmet
+
+
+@pytest.fixture
+def cnx():
+    cnx = sqlite3.connect(':memory:')
+    cnx.execute("create table cidades (cidade_id, estacao_id)")
+    cnx.execute("create table dados_metereologicos (estacao_id, timestamp, temperatura, t_max, t_min, umidade, "
+                "u_max, u_min, dia_do_ano, hora)")
+    cnx.executemany("insert into cidades values (?, ?)", [(1, 'A001'), (2, 'A002')])
+
+    horarios = pd.Series(pd.date_range('2023-12-25', '2024-03-05 23:00', freq='h'))
+    cnx.executemany("insert into dados_metereologicos values (?, ?, 20, 21, 19, 60, 65, 55, ?, ?)",
+                    [(estacao_id, str(horario), dia, horario.hour) for estacao_id in ['A001', 'A002', 'A003']
+                     for horario, dia in zip(horarios, get_dia_do_ano(horarios))])
+
+    yield cnx
+    cnx.close()
+
+
+@pytest.mark.parametrize('dia_inicial, dia_final, dias', [(362, 2, [362, 363, 364, 365, 1, 2]), (58, 60, [58, 59, 60])])
+def test_dados_metereologicos_por_janela_de_dias(cnx, dia_inicial, dia_final, dias):
+    dm = Simulador.get_dados_metereologicos(SimpleNamespace(cnx=cnx, cubo=None), [1, 2], dia_inicial, dia_final)
+
+    assert sorted(dm['cidade_id'].unique()) == [1, 2]
+    assert sorted(dm['dia_do_ano'].unique()) == sorted(dias)
+
+    # em 2024, 28/02 e 29/02 são o mesmo dia do calendário fixo
+    por_dia = dm.groupby(['cidade_id', 'dia_do_ano']).size()
+    assert (por_dia == [48 if dia == 59 else 24 for _, dia in por_dia.index]).all()
+
+    assert (dm['minuto'] == (dm['dia_do_ano'] - 1) * 24 * 60 + dm['hora'].str[:2].astype(int) * 60).all()
+
+
+def read_resultados(cnx):
+    return pd.read_sql("select * from resultados where rota_id = 1 order by ranking", cnx)
+
+
+def test_corrida_elimina_saidas_piores(rota):
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True)
+    completa = read_resultados(rota).set_index('saida')
+
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, corrida=True)
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, corrida=True)
+    corrida = read_resultados(rota)
+    eliminacoes = pd.read_sql("select * from eliminacoes where rota_id = 1", rota).set_index('saida')
+
+    # uma linha por saída eliminada, mesmo após executar a corrida de novo
+    assert 0 < len(eliminacoes) < len(corrida) and eliminacoes.index.is_unique
+    assert (eliminacoes['rodada'] >= MINIMO_DE_LOTES).all()
+    assert (eliminacoes['score_superior'] < eliminacoes['lider_inferior']).all()
+
+    # as saídas eliminadas ficam abaixo das que chegaram ao fim, com os cenários simulados até a eliminação
+    lider = corrida.iloc[0]
+    assert lider['saida'] not in eliminacoes.index
+    assert set(corrida['saida'].iloc[-len(eliminacoes):]) == set(eliminacoes.index)
+    assert (corrida.set_index('saida').loc[eliminacoes.index, 'cenarios'] == eliminacoes['cenarios']).all()
+
+    # dentro do orçamento de 'SIZE' cenários por saída, e a corrida termina quando resta uma única saída no dia
+    assert corrida['cenarios'].sum() <= SIZE * len(corrida)
+    assert lider['cenarios'] == eliminacoes['cenarios'].max()
+
+    # sem a corrida, com todos os cenários, as saídas eliminadas continuam piores que a líder
+    assert (completa.loc[eliminacoes.index, 'score'] < completa.loc[lider['saida'], 'score']).all()
+
+
+def test_recalcula_apenas_saidas_alteradas(rota, monkeypatch):
+    ajustes, best_fit_distribution = [], simulate.best_fit_distribution
+
+    def ajustar(data, metodo):
+        ajustes.append(len(data))
+        return best_fit_distribution(data, metodo)
+
+    monkeypatch.setattr(simulate, 'best_fit_distribution', ajustar)
+
+    def simular():
+        ajustes.clear()
+        return Simulador(rota, seed=1, cache=False, metodo_de_ajuste='nativo', streaming=True)
+
+    simulador = simular()
+    assert len(simulador.recalculadas) == 13 and ajustes
+    resultados = read_resultados(rota).set_index('saida')
+
+    # sem alterações, nada é ajustado ou simulado de novo
+    simulador = simular()
+    assert simulador.recalculadas == {} and len(simulador.reaproveitadas) == 13 and ajustes == []
+    pd.testing.assert_frame_equal(read_resultados(rota).set_index('saida'), resultados)
+
+    # às 08:00 (11:00 UTC) de 15/07/2022 na origem: apenas as saídas das 06:00, 07:00 e 08:00 ainda estão no primeiro
+    # trecho (4 horas a partir da saída)
+    clima = get_clima('A001', 2022)
+    clima.loc[clima['horario'] == '2022-07-15 11:00', 'temperatura'] += 10
+    caminho = write_arquivo_inmet('data', 'A001', clima)
+    os.utime(caminho, (1_000_000, 1_000_000))
+    Integrador(rota, atualizar_base=True)
+
+    simulador = simular()
+    alteradas = ['2023-07-15 06:00:00', '2023-07-15 07:00:00', '2023-07-15 08:00:00']
+    assert sorted(simulador.recalculadas) == alteradas and ajustes
+
+    depois = read_resultados(rota).set_index('saida')
+    assert (depois.loc[alteradas, 'score'] != resultados.loc[alteradas, 'score']).all()
+    pd.testing.assert_frame_equal(depois.drop(index=alteradas).drop(columns='ranking'),
+                                  resultados.drop(index=alteradas).drop(columns='ranking'))
+
+
+def test_horizonte_de_varios_dias(rota):
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True)
+    primeiro_dia = read_resultados(rota).set_index('saida')
+
+    simulador = Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, data_final='2023-07-17')
+    resultados = read_resultados(rota).assign(dia=lambda row: row['saida'].str[:10])
+
+    # ranking dentro de cada dia, com a melhor saída da rota entre as melhores de cada dia
+    assert resultados.groupby('dia').size().to_dict() == {'2023-07-15': 13, '2023-07-16': 13, '2023-07-17': 13}
+    for _, dia in resultados.groupby('dia'):
+        assert dia.sort_values('ranking')['ranking'].tolist() == list(range(1, 14))
+        assert dia.sort_values('ranking')['score'].is_monotonic_decreasing
+    assert simulador.melhores_saidas[1] == resultados.loc[resultados['score'].idxmax(), 'saida']
+
+    # ao estender o horizonte, apenas os dias novos são ajustados e simulados
+    assert len(simulador.recalculadas) == 26
+    assert not any(saida.startswith('2023-07-15') for saida in simulador.recalculadas)
+    pd.testing.assert_frame_equal(resultados.set_index('saida').loc[primeiro_dia.index, primeiro_dia.columns],
+                                  primeiro_dia)
+
+
+def test_atrasos_sorteados_por_trecho(rota):
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True)
+    sem_atrasos = read_resultados(rota).set_index('saida')
+
+    # sem distribuição de atraso cadastrada, a simulação com atrasos é a mesma
+    simulador = Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, atrasos=True)
+    assert len(simulador.recalculadas) == 13
+    pd.testing.assert_frame_equal(read_resultados(rota).set_index('saida'), sem_atrasos)
+
+    rota.execute("update transit_time set atraso_dist = 'uniform', atraso_params = '0,120' where origem = 1")
+    rota.commit()
+    simulador = Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, atrasos=True)
+    com_atrasos = read_resultados(rota).set_index('saida')
+
+    # o primeiro trecho atrasado muda as células percorridas e a duração do percurso
+    assert len(simulador.recalculadas) == 13
+    assert simulador.trechos['atraso_maximo'].tolist() == [120, 0]
+    assert com_atrasos.index.sort_values().tolist() == sem_atrasos.index.sort_values().tolist()
+    assert com_atrasos['score'].between(0, 10).all()
+    assert (com_atrasos['score'] != sem_atrasos.loc[com_atrasos.index, 'score']).any()
+
+
+def test_score_na_superficie(rota):
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True)
+    exato = read_resultados(rota).set_index('saida')
+
+    # a superfície muda o score: todas as saídas são simuladas novamente, com os mesmos cenários
+    simulador = Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, superficie=True)
+    interpolado = read_resultados(rota).set_index('saida')
+
+    assert len(simulador.recalculadas) == 13
+    assert (interpolado['score'] != exato.loc[interpolado.index, 'score']).any()
+    assert (interpolado['score'] - exato.loc[interpolado.index, 'score']).abs().max() < 0.05
+
+
+def test_grade_de_saidas_alterada(rota):
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True)
+
+    # com outro intervalo, as distribuições das saídas que saíram da grade são descartadas
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, intervalo_de_saida=120)
+    grade = [f'2023-07-15 {hora:02d}:00:00' for hora in range(6, 19, 2)]
+
+    distribuicoes = pd.read_sql("select distinct saida from distribuicoes order by saida", rota)
+    assert distribuicoes['saida'].tolist() == grade
+    assert sorted(read_resultados(rota)['saida']) == grade
+    assert read_resultados(rota)['ranking'].tolist() == list(range(1, 8))
+
+    # sem a etapa de ajuste, apenas as distribuições da grade atual são simuladas
+    Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True)
+    simulador = Simulador(rota, seed=1, metodo_de_ajuste='nativo', streaming=True, intervalo_de_saida=120,
+                          etapas=('simulacao', 'resultados'))
+    assert sorted(simulador.distribuicoes['saida'].unique()) == grade
+    assert sorted(read_resultados(rota)['saida']) == grade
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from src.streaming import INTERVALOS_DO_HISTOGRAMA, LIMITES_DO_SCORE, EstatisticasOnline, get_lotes
+
+
+@pytest.fixture
+def valores():
+    return np.random.default_rng(1).gamma(4, 1.2, 5000)
+
+
+def dividir_em_lotes(valores, tamanhos):
+    """
+    :return: valores divididos em lotes de tamanhos variados (inclusive lotes vazios e unitários)
+    """
+    return np.split(valores, np.cumsum(tamanhos)[np.cumsum(tamanhos) < len(valores)])
+
+
+def test_welford_igual_ao_numpy(valores):
+    estatisticas = EstatisticasOnline()
+    for lote in dividir_em_lotes(valores, [1, 0, 64, 37, 500, 2, 1000]):
+        estatisticas.update(lote)
+
+    assert estatisticas.n == len(valores)
+    assert estatisticas.media == pytest.approx(np.mean(valores), rel=1e-12)
+    assert estatisticas.variancia == pytest.approx(np.var(valores, ddof=1), rel=1e-12)
+    assert estatisticas.erro_padrao == pytest.approx(np.std(valores, ddof=1) / np.sqrt(len(valores)), rel=1e-12)
+
+
+def test_chan_merge_igual_ao_numpy(valores):
+    # cada parte acumulada separadamente, como em processos diferentes, e combinadas ao final
+    partes = [EstatisticasOnline() for _ in range(3)]
+    for posicao, lote in enumerate(dividir_em_lotes(valores, [700, 13, 64, 1])):
+        partes[posicao % 3].update(lote)
+
+    combinada = EstatisticasOnline()
+    for parte in [EstatisticasOnline(), *partes, EstatisticasOnline()]:
+        combinada.merge(parte)
+
+    assert combinada.n == len(valores)
+    assert combinada.media == pytest.approx(np.mean(valores), rel=1e-12)
+    assert combinada.variancia == pytest.approx(np.var(valores, ddof=1), rel=1e-12)
+    np.testing.assert_array_equal(combinada.histograma,
+                                  np.histogram(valores.clip(*LIMITES_DO_SCORE), bins=INTERVALOS_DO_HISTOGRAMA,
+                                               range=LIMITES_DO_SCORE)[0])
+
+
+def test_welford_estavel_com_deslocamento():
+    # a soma dos quadrados perderia toda a precisão com uma média tão grande em relação à dispersão
+    valores = 1e8 + np.random.default_rng(3).normal(0, 1, 10_000)
+
+    estatisticas = EstatisticasOnline()
+    for lote in np.array_split(valores, 97):
+        estatisticas.update(lote)
+
+    assert estatisticas.variancia == pytest.approx(np.var(valores, ddof=1), rel=1e-6)
+
+
+def test_quantis_do_histograma(valores):
+    estatisticas = EstatisticasOnline()
+    estatisticas.update(valores)
+
+    largura = (LIMITES_DO_SCORE[1] - LIMITES_DO_SCORE[0]) / INTERVALOS_DO_HISTOGRAMA
+    for q in [0.05, 0.5, 0.95]:
+        assert abs(estatisticas.get_quantil(q) - np.quantile(valores, q)) <= largura
+
+
+def test_estatisticas_vazias():
+    estatisticas = EstatisticasOnline()
+    estatisticas.update([])
+
+    assert estatisticas.n == 0 and estatisticas.variancia == 0.0 and estatisticas.erro_padrao == np.inf
+    assert np.isnan(estatisticas.get_quantil(0.5))
+
+
+def test_lotes_sem_eliminacoes():
+    ativas = np.ones(3, dtype=bool)
+    lotes = list(get_lotes(300 * 3, ativas, cenarios_por_lote=64))
+
+    assert [tamanho for _, tamanho in lotes] == [64, 64, 64, 64, 44]
+    assert [primeiro for primeiro, _ in lotes] == [0, 64, 128, 192, 256]
+
+
+def test_lotes_redistribuem_o_orcamento_das_eliminadas():
+    ativas = np.ones(4, dtype=bool)
+    consumido, cenarios = 0, np.zeros(4, dtype=int)
+
+    for lote, (primeiro_cenario, tamanho) in enumerate(get_lotes(300 * 4, ativas, cenarios_por_lote=64)):
+        assert primeiro_cenario == cenarios[ativas].max()
+        consumido += tamanho * ativas.sum()
+        cenarios[ativas] += tamanho
+
+        # a máscara é consultada a cada lote: duas saídas eliminadas após o segundo lote
+        if lote == 1:
+            ativas[[0, 2]] = False
+
+    assert consumido <= 300 * 4 and 300 * 4 - consumido < ativas.sum()
+    assert cenarios.tolist() == [128, 472, 128, 472]
+
+
+def test_lotes_terminam_sem_saidas_ativas():
+    ativas = np.ones(2, dtype=bool)
+
+    for lote, _ in enumerate(get_lotes(1000, ativas)):
+        ativas[:] = False
+
+    assert lote == 0
@@ -0,0 +1,21 @@
+import pandas as pd
+import pytest
+
+from src.utils import MINUTOS_NO_ANO, get_dia_do_ano, get_minuto_do_ano
+
+
+@pytest.mark.parametrize('data, dia', [('2023-01-01', 1), ('2023-02-28', 59), ('2023-03-01', 60), ('2023-12-31', 365),
+                                       ('2024-02-28', 59), ('2024-02-29', 59), ('2024-03-01', 60),
+                                       ('2024-12-31', 365)])
+def test_dia_do_ano_em_calendario_fixo(data, dia):
+    assert get_dia_do_ano(pd.Timestamp(data)) == dia
+    assert get_dia_do_ano(pd.Series(pd.to_datetime([data])))[0] == dia
+
+
+def test_mesma_data_em_anos_diferentes():
+    comum = pd.Series(pd.date_range('2023-01-01', '2023-12-31 23:00', freq='h'))
+    bissexto = pd.Series(pd.date_range('2024-01-01', '2024-12-31 23:00', freq='h'))
+    bissexto = bissexto[~((bissexto.dt.month == 2) & (bissexto.dt.day == 29))].reset_index(drop=True)
+
+    pd.testing.assert_series_equal(get_minuto_do_ano(comum), get_minuto_do_ano(bissexto))
+    assert get_minuto_do_ano(comum).tolist() == list(range(0, MINUTOS_NO_ANO, 60))